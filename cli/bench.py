@@ -0,0 +1,385 @@
+import argparse
+import random
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from config.data import (
+    CHUNK_EMBDEDDINGS_PATH,
+    MOVIE_EMBDEDDINGS_PATH,
+    QUANTIZED_RESCORE_FACTOR,
+)
+from lib.clean_str import get_cleaned_string
+from lib.data_loaders import load_movie_data
+from lib.indexes.flat_index import FlatIndex
+from lib.indexes.inverted_index import InvertedIndex, index_text
+from lib.indexes.ivf_index import IVFIndex
+from lib.indexes.quantization import QUANTIZERS, QuantizedIndex
+from lib.keyword_search import CURRENT_INVERTED_INDEX, populate_index
+from lib.semantic_search import SemanticSearch
+from lib.stem_words import stem_words
+from lib.tokenize import STOPWORDS, index_term, tokenize_many
+
+
+# builds long queries out of random description windows of the index
+# (the cached one by default), the same shape of query enhance_query
+# produces in expand mode
+def sample_queries(
+    n_queries: int,
+    query_len: int,
+    seed: int,
+    index: InvertedIndex = CURRENT_INVERTED_INDEX,
+) -> List[str]:
+    rng = random.Random(seed)
+    movies = list(index.docs)
+
+    queries = []
+    for _ in range(n_queries):
+        words = rng.choice(movies)["description"].split()
+        start = rng.randrange(max(1, len(words) - query_len))
+        queries.append(" ".join(words[start : start + query_len]))
+
+    return queries
+
+
+def time_queries(search: Callable[[str], list], queries: List[str]) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        search(query)
+
+    return time.perf_counter() - start
+
+
+# index over n_docs synthetic movies whose descriptions are random words
+# of the real ones (so terms keep the frequencies of the catalogue), for
+# timing the scorers on catalogues larger than the shipped one
+def synthetic_index(n_docs: int, seed: int) -> InvertedIndex:
+    rng = random.Random(seed)
+    words = " ".join(movie["description"] for movie in load_movie_data()).split()
+
+    movies = [
+        {
+            "id": doc_id,
+            "title": f"movie {doc_id}",
+            "description": " ".join(rng.choices(words, k=rng.randint(20, 120))),
+        }
+        for doc_id in range(1, n_docs + 1)
+    ]
+
+    index = InvertedIndex()
+    index.build(movies)
+    return index
+
+
+# exhaustive vs block-max pruned bm25 on long queries, over the cached
+# index or a synthetic one of n_docs movies
+def bench_bm25(
+    n_queries: int,
+    query_len: int,
+    limit: int,
+    seed: int,
+    n_docs: int,
+) -> None:
+    if n_docs:
+        index = synthetic_index(n_docs, seed)
+    else:
+        populate_index()
+        index = CURRENT_INVERTED_INDEX
+    queries = sample_queries(n_queries, query_len, seed, index)
+
+    mismatches = sum(
+        index.bm25_search(q, limit, exhaustive=True)
+        != index.bm25_search(q, limit, exhaustive=False)
+        for q in queries
+    )
+
+    exhaustive = time_queries(
+        lambda q: index.bm25_search(q, limit, exhaustive=True),
+        queries,
+    )
+    pruned = time_queries(
+        lambda q: index.bm25_search(q, limit, exhaustive=False),
+        queries,
+    )
+
+    print(
+        f"{len(index.doc_ids)} docs, {n_queries} queries x {query_len} words, "
+        f"top {limit}"
+    )
+    print(f"exhaustive: {1000 * exhaustive / n_queries:.3f} ms/query")
+    print(f"block-max:  {1000 * pruned / n_queries:.3f} ms/query")
+    print(f"speedup:    {exhaustive / pruned:.2f}x")
+    print(f"mismatching result lists: {mismatches}")
+
+
+# tokenizer throughput on every movie text: the unmemoized word by
+# word pipeline against tokenize_many with a cold and a warm stem cache
+def bench_tokenize(repeat: int) -> None:
+    texts = [index_text(movie) for movie in load_movie_data()]
+
+    def reference(text: str) -> List[str]:
+        return stem_words(
+            [
+                token
+                for token in get_cleaned_string(text).split()
+                if token and token not in STOPWORDS
+            ]
+        )
+
+    def cold() -> List[List[str]]:
+        index_term.cache_clear()
+        return tokenize_many(texts)
+
+    runs = {
+        "per word (no cache)": lambda: [reference(text) for text in texts],
+        "tokenize_many cold": cold,
+        "tokenize_many warm": lambda: tokenize_many(texts),
+    }
+
+    expected = runs["per word (no cache)"]()
+    n_words = sum(len(tokens) for tokens in expected)
+    print(f"{len(texts)} movies, {n_words} tokens")
+
+    baseline = None
+    for name, run in runs.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            tokens = run()
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        baseline = baseline or best
+        print(
+            f"{name:<20} {best:.3f} s  {n_words / best / 1e6:.2f} M tokens/s"
+            f"  {baseline / best:.2f}x  identical: {tokens == expected}"
+        )
+
+    info = index_term.cache_info()
+    print(f"stem cache: {info.currsize} distinct words")
+
+
+# bm25 index build time for a sweep of process counts, every build
+# has to produce the postings of the single process build
+def bench_index(processes: List[int], repeat: int) -> None:
+    movies = load_movie_data()
+
+    reference = None
+    for n_processes in processes:
+        timings = []
+        for _ in range(repeat):
+            index = InvertedIndex()
+            start = time.perf_counter()
+            index.build(movies, processes=n_processes)
+            timings.append(time.perf_counter() - start)
+
+        _, _, weights = index.postings.flat()
+        if reference is None:
+            reference = weights
+        identical = np.array_equal(reference, weights)
+
+        print(
+            f"processes={n_processes:<3} best of {repeat}: {min(timings):.3f} s"
+            f"  identical postings: {identical}"
+        )
+
+
+# recall@k of the ivf index against the exact flat scan for a sweep
+# of nprobe values, queries are description windows encoded by the model
+def bench_ann(
+    target: str,
+    n_queries: int,
+    query_len: int,
+    limit: int,
+    nprobes: List[int],
+    seed: int,
+) -> None:
+    populate_index()
+    queries = sample_queries(n_queries, query_len, seed)
+
+    semantic_search = SemanticSearch()
+    query_embeddings = semantic_search.generate_embeddings(queries)
+    embeddings = np.load(
+        MOVIE_EMBDEDDINGS_PATH if target == "movies" else CHUNK_EMBDEDDINGS_PATH
+    )
+
+    flat = FlatIndex(embeddings)
+    build_start = time.perf_counter()
+    ivf = IVFIndex.build(embeddings)
+    build_time = time.perf_counter() - build_start
+
+    exact = [set(ids.tolist()) for ids, _ in flat.search_many(query_embeddings, limit)]
+    flat_time = time_queries(
+        lambda q: flat.search(q, limit),
+        list(query_embeddings),
+    )
+
+    print(f"{len(embeddings)} {target} vectors, {ivf.n_lists} lists, top {limit}")
+    print(f"ivf build: {build_time:.2f} s")
+    print(f"flat:      {1000 * flat_time / n_queries:.3f} ms/query")
+
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        approx = [ids.tolist() for ids, _ in ivf.search_many(query_embeddings, limit)]
+        recall = np.mean(
+            [
+                len(expected.intersection(found)) / max(1, len(expected))
+                for expected, found in zip(exact, approx)
+            ]
+        )
+        ivf_time = time_queries(
+            lambda q: ivf.search(q, limit),
+            list(query_embeddings),
+        )
+
+        print(
+            f"nprobe {nprobe:>4}: recall@{limit} {recall:.3f}, "
+            f"{1000 * ivf_time / n_queries:.3f} ms/query, "
+            f"speedup {flat_time / ivf_time:.2f}x"
+        )
+
+
+# recall@k, latency and memory of int8 / pq codes against the exact
+# scan, with and without the exact re-score of the shortlist
+def bench_quantization(
+    target: str,
+    n_queries: int,
+    query_len: int,
+    limit: int,
+    rescore_factor: int,
+    seed: int,
+) -> None:
+    populate_index()
+    queries = sample_queries(n_queries, query_len, seed)
+
+    semantic_search = SemanticSearch()
+    query_embeddings = semantic_search.generate_embeddings(queries)
+    embeddings = np.load(
+        MOVIE_EMBDEDDINGS_PATH if target == "movies" else CHUNK_EMBDEDDINGS_PATH
+    )
+
+    flat = FlatIndex(embeddings)
+    exact = [set(ids.tolist()) for ids, _ in flat.search_many(query_embeddings, limit)]
+    flat_time = time_queries(
+        lambda q: flat.search(q, limit),
+        list(query_embeddings),
+    )
+
+    print(f"{len(embeddings)} {target} vectors, top {limit}")
+    print(
+        f"float32: {flat.vectors.nbytes / 2**20:.1f} MiB, "
+        f"{1000 * flat_time / n_queries:.3f} ms/query"
+    )
+
+    for kind in QUANTIZERS:
+        index = QuantizedIndex.build(embeddings, kind)
+        for factor in (0, rescore_factor):
+            index.rescore_factor = factor
+            approx = [
+                ids.tolist() for ids, _ in index.search_many(query_embeddings, limit)
+            ]
+            recall = np.mean(
+                [
+                    len(expected.intersection(found)) / max(1, len(expected))
+                    for expected, found in zip(exact, approx)
+                ]
+            )
+            elapsed = time_queries(
+                lambda q: index.search(q, limit),
+                list(query_embeddings),
+            )
+
+            print(
+                f"{kind:>4} rescore x{factor}: {index.codes.nbytes / 2**20:.1f} MiB, "
+                f"recall@{limit} {recall:.3f}, "
+                f"{1000 * elapsed / n_queries:.3f} ms/query"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search benchmarks")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    bm25_parser = subparsers.add_parser(
+        "bm25", help="exhaustive vs block-max pruned bm25"
+    )
+    bm25_parser.add_argument("--queries", type=int, default=200)
+    bm25_parser.add_argument("--query-len", type=int, default=24)
+    bm25_parser.add_argument("--limit", type=int, default=10)
+    bm25_parser.add_argument("--seed", type=int, default=0)
+    bm25_parser.add_argument(
+        "--docs",
+        type=int,
+        default=0,
+        help="time a synthetic index of this many movies instead of the cached one",
+    )
+
+    ann_parser = subparsers.add_parser(
+        "ann", help="ivf recall@k and latency against the exact scan"
+    )
+    ann_parser.add_argument("--target", choices=["movies", "chunks"], default="movies")
+    ann_parser.add_argument("--queries", type=int, default=200)
+    ann_parser.add_argument("--query-len", type=int, default=8)
+    ann_parser.add_argument("--limit", type=int, default=10)
+    ann_parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 4, 16, 64]
+    )
+    ann_parser.add_argument("--seed", type=int, default=0)
+
+    quant_parser = subparsers.add_parser(
+        "quant", help="int8 / pq codes recall@k and memory against the exact scan"
+    )
+    quant_parser.add_argument(
+        "--target", choices=["movies", "chunks"], default="movies"
+    )
+    quant_parser.add_argument("--queries", type=int, default=200)
+    quant_parser.add_argument("--query-len", type=int, default=8)
+    quant_parser.add_argument("--limit", type=int, default=10)
+    quant_parser.add_argument(
+        "--rescore", type=int, default=QUANTIZED_RESCORE_FACTOR
+    )
+    quant_parser.add_argument("--seed", type=int, default=0)
+
+    index_parser = subparsers.add_parser(
+        "index", help="bm25 index build time per number of processes"
+    )
+    index_parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    index_parser.add_argument("--repeat", type=int, default=3)
+
+    tokenize_parser = subparsers.add_parser(
+        "tokenize", help="tokenizer throughput on movies.json"
+    )
+    tokenize_parser.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+
+    match args.bench:
+        case "bm25":
+            bench_bm25(args.queries, args.query_len, args.limit, args.seed, args.docs)
+        case "ann":
+            bench_ann(
+                args.target,
+                args.queries,
+                args.query_len,
+                args.limit,
+                args.nprobe,
+                args.seed,
+            )
+        case "tokenize":
+            bench_tokenize(args.repeat)
+        case "index":
+            bench_index(args.processes, args.repeat)
+        case "quant":
+            bench_quantization(
+                args.target,
+                args.queries,
+                args.query_len,
+                args.limit,
+                args.rescore,
+                args.seed,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,125 @@
+import argparse
+
+from config.data import BM25_B, BM25_K1, EMBEDDING_QUANTIZATION
+from lib.build_manifest import (
+    MovieDiff,
+    create_manifest,
+    diff_movies,
+    load_manifest,
+    save_manifest,
+)
+from lib.cache import Cache
 from lib.chunked_semantic_search import ChunkedSemanticSearch
 from lib.data_loaders import load_movie_data
 from lib.indexes.inverted_index import InvertedIndex
 from lib.semantic_search import SemanticSearch
+from typedicts.movies import Movie
+
+from typing import List
 
 
-def build_cache() -> None:
+def build_cache(
+    quantization: str = EMBEDDING_QUANTIZATION,
+    incremental: bool = False,
+) -> None:
     movie_data = load_movie_data()
+
+    # an incremental build needs the manifest of the previous build
+    # and an intact cache, anything else falls back to a full build
+    manifest = load_manifest() if incremental else None
+    if manifest is not None and not Cache().is_broken():
+        # a build that changes nothing keeps the manifest and with it the
+        # generation, cached search responses stay valid
+        if not update_cache(
+            movie_data,
+            diff_movies(manifest, movie_data),
+            quantization,
+        ):
+            return
+    else:
+        full_build(movie_data, quantization)
+
+    save_manifest(create_manifest(movie_data))
+
+
+def full_build(movie_data: List[Movie], quantization: str) -> None:
     # build inverted index cache
+    # bm25 impacts and block maxes are computed with these constants
     CURRENT_INVERTED_INDEX = InvertedIndex()
     CURRENT_INVERTED_INDEX.build(
         movie_data,
+        k1=BM25_K1,
+        b=BM25_B,
     )
     CURRENT_INVERTED_INDEX.save()
 
     # build semantic cache
-    SEMANTICSEARCH = SemanticSearch()
+    SEMANTICSEARCH = SemanticSearch(quantization=quantization)
     SEMANTICSEARCH.build_embeddings(
         movie_data,
     )
     SEMANTICSEARCH.save_embeddings()
 
-    CHUNKED_SEMANTIC_SEARCH = ChunkedSemanticSearch()
+    CHUNKED_SEMANTIC_SEARCH = ChunkedSemanticSearch(quantization=quantization)
     CHUNKED_SEMANTIC_SEARCH.build_chunk_embeddings(
         movie_data,
     )
 
 
+# only added or changed movies are tokenized and encoded, everything
+# else is carried over from the current cache, deleted movies are
+# dropped while the files are rewritten
+# False when there was nothing to update
+def update_cache(
+    movie_data: List[Movie],
+    diff: MovieDiff,
+    quantization: str,
+) -> bool:
+    print(
+        f"incremental build: {diff.added} added, {diff.changed} changed, "
+        f"{diff.deleted} deleted"
+    )
+    if diff.is_empty:
+        print("cache is up to date.")
+        return False
+
+    CURRENT_INVERTED_INDEX = InvertedIndex()
+    CURRENT_INVERTED_INDEX.load()
+    CURRENT_INVERTED_INDEX.update(
+        movie_data,
+        diff.reuse,
+        k1=BM25_K1,
+        b=BM25_B,
+    )
+    CURRENT_INVERTED_INDEX.save()
+
+    CHUNKED_SEMANTIC_SEARCH = ChunkedSemanticSearch(quantization=quantization)
+    CHUNKED_SEMANTIC_SEARCH.update_embeddings(
+        movie_data,
+        diff.reuse,
+    )
+    CHUNKED_SEMANTIC_SEARCH.save_embeddings()
+    CHUNKED_SEMANTIC_SEARCH.update_chunk_embeddings(
+        movie_data,
+        diff.reuse,
+    )
+
+    return True
+
+
 if __name__ == "__main__":
-    build_cache()
+    parser = argparse.ArgumentParser(description="Build the search cache")
+    parser.add_argument(
+        "--quantization",
+        choices=["none", "int8", "pq"],
+        default=EMBEDDING_QUANTIZATION,
+        help="also store compact embedding codes next to the float vectors",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only re-index movies added or changed since the last build",
+    )
+    args = parser.parse_args()
+
+    build_cache(args.quantization, args.incremental)
@@ -1,7 +1,16 @@
 import argparse
 from typing import List
 
-from config.data import BM25_B, BM25_K1
+from config.data import (
+    ALPHA,
+    BM25_B,
+    BM25_K1,
+    IVF_NPROBE,
+    RRF_K,
+    SEMANTIC_INDEX_TYPE,
+    SERVER_HOST,
+    SERVER_PORT,
+)
 from typedicts.command_args import CLIarg
 
 
@@ -47,12 +56,13 @@ def setup_keyword_search_parser(master_subparser: argparse._SubParsersAction) ->
     create_parser(
         subparsers,
         "search",
-        "Search Movies using BM25",
+        "Filter movies with a boolean query: AND, OR, NOT, ( ), "
+        '"exact phrases" and "proximity"~N',
         [
             CLIarg(
                 name="query",
                 type=str,
-                help="Search Query",
+                help='Search Query, e.g. \'"space station" AND NOT alien\'',
                 is_optional=False,
                 default=None,
             ),
@@ -204,6 +214,112 @@ def setup_keyword_search_parser(master_subparser: argparse._SubParsersAction) ->
         ],
     )
 
+    create_parser(
+        subparsers,
+        "complete",
+        "List index terms starting with a prefix, most frequent first",
+        [
+            CLIarg(
+                name="prefix",
+                type=str,
+                help="Start of a word",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Max terms to return",
+                is_optional=True,
+                default=10,
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "bm25batch",
+        "Run every query of a file through BM25 and stream results as JSONL",
+        [
+            CLIarg(
+                name="queries_file",
+                type=str,
+                help="File with one query per line",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="output_file",
+                type=str,
+                help="JSONL file the results are streamed to",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Limit of the number of search results per query",
+                is_optional=True,
+                default=5,
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "ingest",
+        "Add or replace movies of a JSON file in the segmented index",
+        [
+            CLIarg(
+                name="movies_file",
+                type=str,
+                help='JSON file shaped like movies.json ({"movies": [...]})',
+                is_optional=False,
+                default=None,
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "unindex",
+        "Delete movies from the segmented index",
+        [
+            CLIarg(
+                name="doc_ids",
+                type=int,
+                help="Ids of the movies to delete",
+                is_optional=False,
+                default=None,
+                nargs="+",
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "segsearch",
+        "Search the segmented index using BM25",
+        [
+            CLIarg(
+                name="query",
+                type=str,
+                help="Search Query",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Max results to return",
+                is_optional=True,
+                default=10,
+            ),
+        ],
+    )
+
+    create_parser(subparsers, "segstats", "Show segmented index statistics", [])
+
 
 def setup_semanitc_parser(
     master_subparser: argparse._SubParsersAction,
@@ -262,6 +378,20 @@ def setup_semanitc_parser(
                 is_optional=True,
                 default=10,
             ),
+            CLIarg(
+                name="--index",
+                type=str,
+                help="Vector index: flat (exact) or ivf (approximate)",
+                is_optional=True,
+                default=SEMANTIC_INDEX_TYPE,
+            ),
+            CLIarg(
+                name="--nprobe",
+                type=int,
+                help="Lists scanned per query by the ivf index",
+                is_optional=True,
+                default=IVF_NPROBE,
+            ),
         ],
     )
 
@@ -318,6 +448,49 @@ def setup_semanitc_parser(
                 is_optional=True,
                 default=10,
             ),
+            CLIarg(
+                name="--index",
+                type=str,
+                help="Vector index: flat (exact) or ivf (approximate)",
+                is_optional=True,
+                default=SEMANTIC_INDEX_TYPE,
+            ),
+            CLIarg(
+                name="--nprobe",
+                type=int,
+                help="Lists scanned per query by the ivf index",
+                is_optional=True,
+                default=IVF_NPROBE,
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "semantic_batch",
+        "Semantically search every query of a file, results streamed as JSONL",
+        [
+            CLIarg(
+                name="queries_file",
+                type=str,
+                help="File with one query per line",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="output_file",
+                type=str,
+                help="JSONL file the results are streamed to",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Max results to return per query",
+                is_optional=True,
+                default=10,
+            ),
         ],
     )
 
@@ -451,6 +624,128 @@ def setup_hybrid_search_parser(
         ],
     )
 
+    create_parser(
+        subparsers,
+        "rrf-batch",
+        "rrf based hybrid search for every query of a file, streamed as JSONL",
+        [
+            CLIarg(
+                name="queries_file",
+                type=str,
+                help="File with one query per line",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="output_file",
+                type=str,
+                help="JSONL file the results are streamed to",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--k",
+                type=int,
+                help="rrf-k value constant value",
+                is_optional=True,
+                default=RRF_K,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Limit of the number of search results per query",
+                is_optional=True,
+                default=5,
+            ),
+        ],
+    )
+
+    create_parser(
+        subparsers,
+        "weighted-batch",
+        "weighted hybrid search for every query of a file, streamed as JSONL",
+        [
+            CLIarg(
+                name="queries_file",
+                type=str,
+                help="File with one query per line",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="output_file",
+                type=str,
+                help="JSONL file the results are streamed to",
+                is_optional=False,
+                default=None,
+            ),
+            CLIarg(
+                name="--alpha",
+                type=float,
+                help="Alpha constant value",
+                is_optional=True,
+                default=ALPHA,
+            ),
+            CLIarg(
+                name="--limit",
+                type=int,
+                help="Limit of the number of search results per query",
+                is_optional=True,
+                default=5,
+            ),
+        ],
+    )
+
+
+    create_parser(
+        subparsers,
+        "llm-cache-stats",
+        "Show entries, ttls and hits of the llm response cache per method",
+        [],
+    )
+
+    create_parser(
+        subparsers,
+        "llm-cache-clear",
+        "Drop cached llm responses",
+        [
+            CLIarg(
+                name="--method",
+                type=str,
+                help="Only drop responses of this method (spell, rewrite, expand, individual, batch)",
+                is_optional=True,
+                default=None,
+            ),
+        ],
+    )
+
+# serve is a single command so it gets no command level subparsers
+def setup_serve_parser(master_subparser: argparse._SubParsersAction) -> None:
+    serve_parser = master_subparser.add_parser(
+        "serve",
+        help="Keep indexes and models loaded and answer searches over http",
+    )
+    serve_parser.set_defaults(command="serve")
+
+    serve_parser.add_argument(
+        "--host",
+        type=str,
+        help="Interface to listen on",
+        default=SERVER_HOST,
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on",
+        default=SERVER_PORT,
+    )
+    serve_parser.add_argument(
+        "--socket",
+        type=str,
+        help="Listen on this unix socket path instead of host:port",
+        default=None,
+    )
+
 
 # just add functions here and they'll be
 # setup automatically
@@ -458,6 +753,7 @@ PARSER_FUNCS = [
     setup_semanitc_parser,
     setup_keyword_search_parser,
     setup_hybrid_search_parser,
+    setup_serve_parser,
 ]
 
 
@@ -467,6 +763,7 @@ PARSER_FUNCS = [
 # 1. semantic search parser
 # 2. keyword keyword search parser
 # 3. hybrid search parser
+# 4. search server parser
 def setup_parsers() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Multi-mode search CLI",
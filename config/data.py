@@ -22,55 +22,122 @@ CACHE_DIR_PATH = os.path.join(PROJECT_ROOT, "cache")
 
 # index for the files to be written in the path for cache
 
-# file containing indexes
-INDEX_CACHE_PATH = os.path.join(CACHE_DIR_PATH, "index.json")
+# binary index segment: term dictionary, compressed postings,
+# document lengths and block-max metadata (mmapped)
+INDEX_SEGMENT_PATH = os.path.join(CACHE_DIR_PATH, "index.seg")
 
-# file containing term frequeincies for ranking
-TERM_FREQUENCIES_PATH = os.path.join(
+# columnar stored fields (ids, titles, descriptions) of the indexed
+# movies, mmapped once per process and read only for returned results
+DOC_STORE_PATH = os.path.join(CACHE_DIR_PATH, "docs.bin")
+
+
+MOVIE_EMBDEDDINGS_PATH = os.path.join(
     CACHE_DIR_PATH,
-    "term_frequencies.json",
+    "movie_embeddings.npy",
 )
 
 
-# file containing document length for each doc for ranking
-DOC_LENGTH_PATH = os.path.join(
+CHUNK_EMBDEDDINGS_PATH = os.path.join(
     CACHE_DIR_PATH,
-    "doc_length.json",
+    "chunk_embeddings.npy",
 )
 
+CHUNK_METADATA_PATH = os.path.join(
+    CACHE_DIR_PATH,
+    "chunk_embeddings.json",
+)
 
-AVG_DOC_LENGTH = os.path.join(CACHE_DIR_PATH, "avg_doc_length.json")
+# ivf (approximate nearest neighbour) indexes over the embeddings above
+# optional: when missing or stale they are rebuilt in memory on load
+MOVIE_IVF_PATH = os.path.join(
+    CACHE_DIR_PATH,
+    "movie_embeddings.ivf.npz",
+)
 
+CHUNK_IVF_PATH = os.path.join(
+    CACHE_DIR_PATH,
+    "chunk_embeddings.ivf.npz",
+)
 
-MOVIE_EMBDEDDINGS_PATH = os.path.join(
+# int8 / product quantized codes of the embeddings above (mmapped) and
+# the quantizer they were encoded with, only written when
+# EMBEDDING_QUANTIZATION is not "none"
+MOVIE_CODES_PATH = os.path.join(
     CACHE_DIR_PATH,
-    "movie_embeddings.npy",
+    "movie_embeddings.codes.npy",
 )
 
+MOVIE_QUANTIZER_PATH = os.path.join(
+    CACHE_DIR_PATH,
+    "movie_embeddings.quantizer.npz",
+)
 
-CHUNK_EMBDEDDINGS_PATH = os.path.join(
+CHUNK_CODES_PATH = os.path.join(
     CACHE_DIR_PATH,
-    "chunk_embeddings.npy",
+    "chunk_embeddings.codes.npy",
 )
 
-CHUNK_METADATA_PATH = os.path.join(
+CHUNK_QUANTIZER_PATH = os.path.join(
     CACHE_DIR_PATH,
-    "chunk_embeddings.json",
+    "chunk_embeddings.quantizer.npz",
 )
 
+# ids and content hashes of the indexed movies, used by incremental builds
+MANIFEST_PATH = os.path.join(CACHE_DIR_PATH, "manifest.json")
+
+# persistent (model, text hash) -> embedding store consulted by the
+# embedding builders, lives next to the cache and survives rebuilds
+EMBEDDING_STORE_PATH = os.path.join(CACHE_DIR_PATH, "embedding_store.sqlite")
+
+# least recently used embeddings are evicted past this many entries
+# (a 384 dim float32 vector is 1.5kb), 0 disables storing
+EMBEDDING_STORE_MAX_ENTRIES = 200_000
+
+
+# full embedding builds encode this many texts per model call and
+# checkpoint after every batch, an interrupted build resumes there
+EMBEDDING_BUILD_BATCH_SIZE = 1024
+
+# worker processes chunking documents for the chunk embeddings and the
+# documents handed to them at a time
+EMBEDDING_BUILD_PROCESSES = min(4, os.cpu_count() or 1)
+EMBEDDING_BUILD_WINDOW = 2048
+
+
+# lru cache of query embeddings in front of the model
+# bounded by entries and by the bytes of the cached vectors
+QUERY_CACHE_MAX_ENTRIES = 10_000
+QUERY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# keep the query cache across restarts (loaded at start, written at exit)
+QUERY_CACHE_PERSIST = False
+QUERY_CACHE_PATH = os.path.join(CACHE_DIR_PATH, "query_embeddings.npz")
+
+
+# lru cache of complete hybrid (rrf / weighted) responses, entries
+# expire after the ttl and all of them are dropped by a new build
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_TTL_SECONDS = 600
+
+
+# directory of the segmented (log structured) bm25 index
+SEGMENTS_DIR_PATH = os.path.join(CACHE_DIR_PATH, "segments")
+
 
 # EXPECTED CACHE FILES (if these files are not the cache directory the cache is considered corrupt)
 EXPECTED_CACHE_DIR_FILES = [
-    INDEX_CACHE_PATH,
-    TERM_FREQUENCIES_PATH,
-    DOC_LENGTH_PATH,
-    AVG_DOC_LENGTH,
+    INDEX_SEGMENT_PATH,
+    DOC_STORE_PATH,
     MOVIE_EMBDEDDINGS_PATH,
     CHUNK_EMBDEDDINGS_PATH,
     CHUNK_METADATA_PATH,
 ]
 
 
+# distinct words whose stems are memoized by the tokenizer
+STEM_CACHE_SIZE = 100_000
+
+
 # k1 value for BM25 algorithm
 # this controls term frequency saturation
 # i.e  how quickly the term frequency contribution to the score
@@ -81,6 +148,91 @@ BM25_K1 = 1.5
 BM25_B = 0.75
 
 
+# number of consecutive documents sharing one block-max entry
+# smaller blocks give tighter bounds (more skipping) but more metadata
+BM25_BLOCK_SIZE = 64
+
+# block-max pruning is only used from this many documents on, below it
+# the bookkeeping costs about what the skipped postings save
+# (python -m cli.bench bm25 --docs N: ~0.9x at 5k, 1.2x at 10k, 1.7-3x
+# from 20k to 100k documents, for 4 and 24 word queries)
+BM25_PRUNING_MIN_DOCS = 10_000
+
+
+# postings per compressed block: document gaps and term frequencies of
+# a block are bit packed with the width of its largest value and a
+# block is the unit a posting list is decoded in
+POSTINGS_BLOCK_SIZE = 128
+
+# decoded postings kept per index (lru over terms), 12 bytes each
+POSTINGS_CACHE_SIZE = 1 << 20
+
+# a lookup of documents spread over more than this fraction of the
+# blocks of a row decodes (and caches) the whole row instead, skipping
+# blocks only pays off for a few documents
+POSTINGS_SPARSE_LOOKUP = 0.5
+
+
+# worker processes tokenizing movies for a bm25 index build and the
+# number of consecutive movies handed to a worker at a time
+INDEX_BUILD_PROCESSES = min(4, os.cpu_count() or 1)
+INDEX_BUILD_SHARD_SIZE = 1000
+
+
+# documents held in the in-memory write buffer of the segmented index
+# before it is flushed as a new segment
+SEGMENT_BUFFER_SIZE = 1000
+
+# segments of one size tier merged together by the segmented index
+# a larger factor means fewer merges but more segments per search
+SEGMENT_MERGE_FACTOR = 8
+
+
+# number of queries scored together by the batch search apis
+# bm25 keeps a dense (queries x documents) accumulator per batch and
+# semantic search a (queries x embeddings) score matrix
+BATCH_SEARCH_SIZE = 64
+
+
+# number of queries read from a query file per chunk by the batch
+# commands, every chunk is encoded with one model call
+BATCH_STREAM_SIZE = 1024
+
+
+# vector index used by semantic and chunked search
+# "flat" => exact scan of every embedding
+# "ivf"  => inverted file index, only the nprobe closest lists are scanned
+SEMANTIC_INDEX_TYPE = "flat"
+
+# lists probed per query by the ivf index (the recall / latency knob)
+IVF_NPROBE = 16
+
+# spherical k-means settings used to train the ivf centroids
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAIN_POINTS_PER_LIST = 64
+
+
+# compact embedding codes searched instead of the float32 vectors
+# "none" => float32 vectors in memory
+# "int8" => per dimension scalar quantization (4x smaller)
+# "pq"   => product quantization, PQ_SUBSPACES bytes per vector
+# with a quantization the float vectors are only read to re-score the
+# shortlist, it also takes precedence over SEMANTIC_INDEX_TYPE
+EMBEDDING_QUANTIZATION = "none"
+
+# pq subspaces, must divide the embedding dimension (384 for MiniLM)
+PQ_SUBSPACES = 48
+
+# shortlist of QUANTIZED_RESCORE_FACTOR * limit candidates re-scored
+# exactly against the float vectors, 0 returns the approximate scores
+QUANTIZED_RESCORE_FACTOR = 4
+
+
+# default address of the long lived search server (python -m cli.main serve)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+
+
 # ranking score precision
 SCORE_PRECISION = 4
 
@@ -104,3 +256,55 @@ SYSTEM_PROMPT = (
 
 # used cross enoder model
 CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+
+# pairs per cross encoder forward pass, pairs are length sorted first
+# so every batch pads to a similar length
+CROSS_ENCODER_BATCH_SIZE = 32
+
+# concurrent rerank requests are gathered for up to this long (or until
+# this many pairs) and scored together
+CROSS_ENCODER_MAX_WAIT_MS = 2
+CROSS_ENCODER_MAX_BATCH_PAIRS = 256
+
+# (query, document) scores kept by the cross encoder service (lru)
+CROSS_ENCODER_CACHE_SIZE = 50_000
+
+
+# gemini model used for query enhancement and llm reranking
+LLM_MODEL = "gemini-2.5-flash"
+
+# durable prompt -> response cache in front of the llm
+LLM_CACHE_PATH = os.path.join(CACHE_DIR_PATH, "llm_cache.sqlite")
+LLM_CACHE_MAX_ENTRIES = 50_000
+
+# expired responses are swept when the cache is opened and then every
+# this many writes, cache hits refresh their recency in batches of this
+# many (and at exit) instead of writing on every read
+LLM_CACHE_SWEEP_INTERVAL = 1000
+LLM_CACHE_TOUCH_BATCH = 64
+
+# seconds a cached response stays valid, per enhance / rerank method
+# spelling fixes never go stale, relevance ratings are redone sooner
+LLM_CACHE_TTL_SECONDS = {
+    "spell": 30 * 24 * 3600,
+    "rewrite": 7 * 24 * 3600,
+    "expand": 7 * 24 * 3600,
+    "individual": 24 * 3600,
+    "batch": 24 * 3600,
+    "default": 24 * 3600,
+}
+
+
+# requests per second (and burst) allowed to the llm across all threads
+LLM_RATE_LIMIT_PER_SECOND = 2.0
+LLM_RATE_LIMIT_BURST = 4
+
+# rate limited (429) llm calls are retried with exponential backoff and
+# jitter at most this many times, waits are capped at the max
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_MAX_SECONDS = 30.0
+
+# documents rated concurrently by the individual llm reranker and the
+# time a rerank may take, unrated documents keep their rrf position
+RERANK_WORKERS = 8
+RERANK_DEADLINE_SECONDS = 30.0
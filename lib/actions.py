@@ -1,15 +1,23 @@
 from argparse import Namespace, ArgumentParser
+from lib.ai.action import clear_llm_cache, llm_cache_stats
+from lib.batch_search import bm25_batch, rrf_batch, semantic_batch, weighted_batch
 from lib.chunked_semantic_search import chunked_semantic_search, embed_chunks
 from lib.hybrid_search import exec_rrf_search, exec_weighted_search, normalize_scores
 from lib.keyword_search import (
     bm25search,
     calc_bm25_idf,
     calc_bm25_tf,
+    complete_terms,
+    ingest_movies,
     search,
+    segment_stats,
+    segmented_search,
     term_freq,
     inverse_document_freq,
     tf_idf,
+    unindex_movies,
 )
+from lib.server import serve
 from lib.semantic_search import (
     chunk,
     embed_txt,
@@ -23,7 +31,7 @@ from lib.semantic_search import (
 COMMANDS = {
     "search": {
         "intro": lambda a: f"Searching For: {a.query} ....",
-        "action": lambda a: search(a.query),
+        "action": lambda a: search(a.query, a.limit),
         "format": lambda r: (
             "No results found."
             if not r
@@ -81,6 +89,46 @@ COMMANDS = {
             for i, (doc_id, title, score) in enumerate(results)
         ),
     },
+    "complete": {
+        "intro": lambda a: f"index terms starting with {a.prefix} ....",
+        "action": lambda a: complete_terms(a.prefix, a.limit),
+        "format": lambda terms: "\n".join(
+            f"{term} ({doc_freq} documents)" for term, doc_freq in terms
+        ),
+    },
+    "bm25batch": {
+        "intro": lambda a: f"BM25 batch search over {a.queries_file} ....",
+        "action": lambda a: bm25_batch(a.queries_file, a.output_file, a.limit),
+        "format": lambda n, a: f"Wrote results for {n} queries to {a.output_file}",
+    },
+    "ingest": {
+        "intro": lambda a: f"Ingesting movies from {a.movies_file} ....",
+        "action": lambda a: ingest_movies(a.movies_file),
+        "format": lambda stats: (
+            f"{stats['documents']} movies in {stats['segments']} segments "
+            f"({stats['deleted']} deleted awaiting merge)"
+        ),
+    },
+    "unindex": {
+        "intro": lambda a: f"Removing movies {a.doc_ids} ....",
+        "action": lambda a: unindex_movies(a.doc_ids),
+        "format": lambda n: f"Removed {n} movies",
+    },
+    "segsearch": {
+        "intro": lambda a: f"searching segments for {a.query} ....",
+        "action": lambda a: segmented_search(a.query, a.limit),
+        "format": lambda results: "\n".join(
+            f"{i + 1}. ({doc_id}) {title} - Score: {score:.2f}"
+            for i, (doc_id, title, score) in enumerate(results)
+        ),
+    },
+    "segstats": {
+        "intro": "segmented index stats ....",
+        "action": lambda: segment_stats(),
+        "format": lambda stats: "\n".join(
+            f"{name}: {value}" for name, value in stats.items()
+        ),
+    },
     # commands below belong to semantic_search
     "verify": {
         "intro": "verifying model.....",
@@ -109,12 +157,19 @@ COMMANDS = {
         "action": lambda a: semantic_search(
             query=a.query,
             limit=a.limit,
+            index_type=a.index,
+            nprobe=a.nprobe,
         ),
         "format": lambda results: "\n".join(
             f"{i + 1}. {r.title} ({r.score}) \n\t{r.description}"
             for i, r in enumerate(results)
         ),
     },
+    "semantic_batch": {
+        "intro": lambda a: f"semantic batch search over {a.queries_file}.....",
+        "action": lambda a: semantic_batch(a.queries_file, a.output_file, a.limit),
+        "format": lambda n, a: f"Wrote results for {n} queries to {a.output_file}",
+    },
     "semantic_chunk": {
         "intro": lambda a: f"semantic chunking for {len(a.text)} characters…..",
         "action": lambda a: semantic_chunk(
@@ -146,7 +201,9 @@ COMMANDS = {
         "intro": lambda a: f"Chukned Searching For: {a.query} ....",
         "action": lambda a: chunked_semantic_search(
             a.query,
-            a.limit,
+            int(a.limit),
+            index_type=a.index,
+            nprobe=a.nprobe,
         ),
         "format": lambda results: "\n".join(
             f"\n{i + 1}. {r.title} (score: {r.score:.4f})\n   {r.document}..."
@@ -195,6 +252,46 @@ COMMANDS = {
             for i, r in enumerate(results)
         ),
     },
+    "rrf-batch": {
+        "intro": lambda a: f"RRF batch search over {a.queries_file}....",
+        "action": lambda a: rrf_batch(
+            a.queries_file,
+            a.output_file,
+            k=a.k,
+            limit=a.limit,
+        ),
+        "format": lambda n, a: f"Wrote results for {n} queries to {a.output_file}",
+    },
+    "weighted-batch": {
+        "intro": lambda a: f"Weighted batch search over {a.queries_file}....",
+        "action": lambda a: weighted_batch(
+            a.queries_file,
+            a.output_file,
+            alpha=a.alpha,
+            limit=a.limit,
+        ),
+        "format": lambda n, a: f"Wrote results for {n} queries to {a.output_file}",
+    },
+    "llm-cache-stats": {
+        "intro": "llm response cache.....",
+        "action": lambda: llm_cache_stats(),
+        "format": lambda stats: "\n".join(
+            f"{method}: {s['entries']} entries (ttl {s['ttl_seconds']:.0f}s), "
+            f"{s['hits']} hits / {s['misses']} misses this run"
+            for method, s in stats.items()
+        )
+        or "cache is empty",
+    },
+    "llm-cache-clear": {
+        "intro": "clearing llm response cache.....",
+        "action": lambda a: clear_llm_cache(a.method),
+        "format": lambda n: f"Dropped {n} cached responses",
+    },
+    # long lived search server
+    "serve": {
+        "intro": "loading indexes and models.....",
+        "action": lambda a: serve(a.host, a.port, a.socket),
+    },
 }
 
 
@@ -1,34 +1,122 @@
 import time
+from functools import lru_cache
+from typing import Any
+
+import httpx
 from google.genai.errors import ServerError, APIError
-from google.genai.types import GenerateContentResponse
+from google.genai.types import (
+    GenerateContentConfig,
+    GenerateContentResponse,
+    HttpOptions,
+)
 
-from lib.ai.client import LLM_CLIENT
+from config.data import LLM_MAX_RETRIES, LLM_MODEL
+from lib.ai.llm_cache import LLMCache
+from lib.ai.rate_limit import LLM_RATE_LIMITER, backoff_delay
 from lib.ai.prompt_builders import build_prompt
 
 from lib.enums.enahnce_methods import EnhanceMethod
+from typedicts.llm_response import CachedLLMResponse
+
+
+# client the responses are generated with, anything exposing
+# models.generate_content(model=..., contents=..., config=...) works so
+# a local stand-in can replace gemini (see set_llm_client)
+_llm_client: Any = None
+
+
+def get_llm_client() -> Any:
+    global _llm_client
+
+    # the gemini client is only created once a prompt misses the cache
+    if _llm_client is None:
+        from lib.ai.client import LLM_CLIENT
+
+        _llm_client = LLM_CLIENT
+
+    return _llm_client
 
 
+def set_llm_client(client: Any) -> None:
+    global _llm_client
+
+    _llm_client = client
+
+
+# opened on first use and kept for the lifetime of the process
+@lru_cache(maxsize=1)
+def get_llm_cache() -> LLMCache:
+    return LLMCache()
+
+
+# method names the cache entry (and its ttl), calls without a method
+# always go to the llm, see request_resp for delay and deadline
 def generate_resp(
     prompt: str,
     delay: float | None = None,
+    method: str | None = None,
+    deadline: float | None = None,
+) -> GenerateContentResponse | CachedLLMResponse | None:
+    if method:
+        cached = get_llm_cache().get(method, LLM_MODEL, prompt)
+        if cached is not None:
+            return CachedLLMResponse(text=cached)
+
+    response = request_resp(prompt, delay, deadline)
+    if method and response and response.text:
+        get_llm_cache().put(method, LLM_MODEL, prompt, response.text)
+
+    return response
+
+
+# every request takes a token from the shared rate limiter
+# with a delay, 429s are retried up to LLM_MAX_RETRIES times with
+# exponential backoff starting at delay seconds, None once the
+# (time.monotonic) deadline would be passed waiting or the request
+# itself runs into it
+def request_resp(
+    prompt: str,
+    delay: float | None = None,
+    deadline: float | None = None,
 ) -> GenerateContentResponse | None:
-    try:
-        return LLM_CLIENT.models.generate_content(
-            model="gemini-2.5-flash", contents=prompt
-        )
-    except (ServerError, APIError) as e:
-        if e.code == 429:
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if not LLM_RATE_LIMITER.acquire(deadline):
+            return None
+
+        try:
+            return get_llm_client().models.generate_content(
+                model=LLM_MODEL,
+                contents=prompt,
+                config=request_config(deadline),
+            )
+        except httpx.TimeoutException:
+            return None
+        except (ServerError, APIError) as e:
+            if e.code != 429:
+                print(f"Server Error: {e.message}")
+                return None
+
             print(e.message)
-            # just to avoid hitting rate limit
-            if delay:
-                print(f"retrying after {delay} seconds...")
-                time.sleep(delay)
-                return generate_resp(
-                    prompt,
-                    delay,
-                )
-        else:
-            print(f"Server Error: {e.message}")
+            if not delay or attempt == LLM_MAX_RETRIES:
+                return None
+
+            wait = backoff_delay(attempt, delay)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return None
+
+            print(f"retrying after {wait:.1f} seconds...")
+            time.sleep(wait)
+
+    return None
+
+
+# a request made under a deadline times out at it
+def request_config(deadline: float | None) -> GenerateContentConfig | None:
+    if deadline is None:
+        return None
+
+    remaining_ms = int(1000 * (deadline - time.monotonic()))
+    return GenerateContentConfig(http_options=HttpOptions(timeout=max(1, remaining_ms)))
 
 
 def enhance_query(
@@ -44,7 +132,8 @@ def enhance_query(
         build_prompt(
             query=stripped_query,
             method=EnhanceMethod(method),
-        )
+        ),
+        method=EnhanceMethod(method).value,
     )
     if not response:
         return stripped_query
@@ -56,3 +145,11 @@ def enhance_query(
     print(f"Enhanced query ({method}): '{query}' -> '{enahnced_query}'\n")
 
     return enahnced_query.strip()
+
+
+def llm_cache_stats() -> dict:
+    return get_llm_cache().stats()
+
+
+def clear_llm_cache(method: str | None = None) -> int:
+    return get_llm_cache().clear(method)
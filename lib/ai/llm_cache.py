@@ -0,0 +1,216 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config.data import (
+    CACHE_DIR_PATH,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_PATH,
+    LLM_CACHE_SWEEP_INTERVAL,
+    LLM_CACHE_TOUCH_BATCH,
+    LLM_CACHE_TTL_SECONDS,
+)
+
+
+def prompt_hash(model: str, prompt: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).digest()
+
+
+# durable prompt -> response text cache for the llm calls
+# entries are namespaced by method (spell, rewrite, expand, individual,
+# batch ...) which picks their ttl, least recently used entries are
+# evicted past max_entries, one sqlite file shared by every process
+# expired entries are swept on open and every sweep_interval writes
+# (a read never returns one), the entry count is tracked across writes
+# and recounted by every sweep, hits refresh last_used in batches
+class LLMCache:
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttls: Dict[str, float] = LLM_CACHE_TTL_SECONDS,
+        sweep_interval: int = LLM_CACHE_SWEEP_INTERVAL,
+        touch_batch: int = LLM_CACHE_TOUCH_BATCH,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.sweep_interval = sweep_interval
+        self.touch_batch = touch_batch
+
+        # hits / misses of this process by method
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+        # key -> last_used of the hits not written yet
+        self.touched: Dict[bytes, float] = {}
+        self.puts = 0
+        self.entries = 0
+
+        os.makedirs(os.path.dirname(path) or CACHE_DIR_PATH, exist_ok=True)
+        # server worker threads share the connection
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key BLOB PRIMARY KEY,
+                method TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_method_created "
+            "ON responses (method, created)"
+        )
+        with self.lock:
+            self.sweep()
+            self.conn.commit()
+
+        atexit.register(self.flush)
+
+    def ttl(self, method: str) -> float:
+        return self.ttls.get(method, self.ttls["default"])
+
+    # cached response text or None when missing or expired
+    def get(self, method: str, model: str, prompt: str) -> Optional[str]:
+        key = prompt_hash(model, prompt)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created FROM responses WHERE key = ? AND method = ?",
+                (key, method),
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl(method):
+                self.misses[method] = self.misses.get(method, 0) + 1
+                return None
+
+            self.touched[key] = now
+            if len(self.touched) >= self.touch_batch:
+                self.write_touched()
+                self.conn.commit()
+            self.hits[method] = self.hits.get(method, 0) + 1
+
+            return row[0]
+
+    def put(self, method: str, model: str, prompt: str, response: str) -> None:
+        if self.max_entries <= 0:
+            return
+
+        key = prompt_hash(model, prompt)
+        now = time.time()
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, method, response, now, now),
+            )
+            self.touched.pop(key, None)
+            if exists is None:
+                self.entries += 1
+
+            self.puts += 1
+            if self.puts % self.sweep_interval == 0:
+                self.sweep()
+            self.evict()
+            self.conn.commit()
+
+    # writes the recency of the hits since the last flush
+    def flush(self) -> None:
+        with self.lock:
+            self.write_touched()
+            self.conn.commit()
+
+    def write_touched(self) -> None:
+        if not self.touched:
+            return
+
+        self.conn.executemany(
+            "UPDATE responses SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self.touched.items()],
+        )
+        self.touched.clear()
+
+    # drops the expired entries and recounts the rest (other processes
+    # share the file so the tracked count may have drifted)
+    def sweep(self) -> None:
+        now = time.time()
+        for method, ttl in self.ttls.items():
+            if method == "default":
+                continue
+            self.conn.execute(
+                "DELETE FROM responses WHERE method = ? AND created < ?",
+                (method, now - ttl),
+            )
+        self.conn.execute(
+            "DELETE FROM responses WHERE method NOT IN "
+            f"({','.join('?' * len(self.ttls))}) AND created < ?",
+            (*self.ttls, now - self.ttls["default"]),
+        )
+
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        self.entries = count
+
+    # least recently used entries above the bound
+    def evict(self) -> None:
+        excess = self.entries - self.max_entries
+        if excess <= 0:
+            return
+
+        # pending hits count towards recency
+        self.write_touched()
+        cursor = self.conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.entries -= cursor.rowcount
+
+    # returns the number of dropped entries
+    def clear(self, method: Optional[str] = None) -> int:
+        with self.lock:
+            if method is None:
+                cursor = self.conn.execute("DELETE FROM responses")
+            else:
+                cursor = self.conn.execute(
+                    "DELETE FROM responses WHERE method = ?",
+                    (method,),
+                )
+            self.entries = max(0, self.entries - cursor.rowcount)
+            self.conn.commit()
+
+            return cursor.rowcount
+
+    # entries stored per method plus this process' hits and misses
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            stored = dict(
+                self.conn.execute(
+                    "SELECT method, COUNT(*) FROM responses GROUP BY method"
+                ).fetchall()
+            )
+
+        return {
+            method: {
+                "entries": stored.get(method, 0),
+                "ttl_seconds": self.ttl(method),
+                "hits": self.hits.get(method, 0),
+                "misses": self.misses.get(method, 0),
+            }
+            for method in sorted(set(stored) | set(self.hits) | set(self.misses))
+        }
@@ -0,0 +1,60 @@
+import random
+import threading
+import time
+from typing import Optional
+
+from config.data import (
+    LLM_BACKOFF_MAX_SECONDS,
+    LLM_RATE_LIMIT_BURST,
+    LLM_RATE_LIMIT_PER_SECOND,
+)
+
+
+# token bucket shared by every thread talking to the llm
+# tokens refill at `rate` per second up to `capacity` (the burst size),
+# a request takes one token and waits for the refill when there is none
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # False when no token frees up before the (time.monotonic) deadline
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        if self.rate <= 0:
+            return True
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+
+                wait = (1 - self.tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# exponential backoff with equal jitter: half of base * 2^attempt (capped)
+# plus a random share of the other half, so retrying threads spread out
+def backoff_delay(
+    attempt: int,
+    base: float,
+    cap: float = LLM_BACKOFF_MAX_SECONDS,
+) -> float:
+    ceiling = min(cap, base * 2**attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+LLM_RATE_LIMITER = TokenBucket(LLM_RATE_LIMIT_PER_SECOND, LLM_RATE_LIMIT_BURST)
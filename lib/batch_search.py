@@ -0,0 +1,139 @@
+import json
+from itertools import batched
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from config.data import BATCH_STREAM_SIZE
+from lib.hybrid_search import HybridSearch
+from lib.keyword_search import CURRENT_INVERTED_INDEX, populate_index
+from lib.semantic_search import SemanticSearch
+from typedicts.search_res import (
+    RRFSearchResult,
+    SemanticChunkSearchRes,
+    SemanticSearchRes,
+    WeightedSearchResult,
+)
+
+
+# json records for every kind of search result
+# (shared with the search server)
+def bm25_record(res: Tuple[int, str, float]) -> Dict[str, Any]:
+    return {"id": res[0], "title": res[1], "score": res[2]}
+
+
+def semantic_record(res: SemanticSearchRes) -> Dict[str, Any]:
+    return {"id": res.id, "title": res.title, "score": res.score}
+
+
+def chunk_record(res: SemanticChunkSearchRes) -> Dict[str, Any]:
+    return {
+        "id": res.id,
+        "title": res.title,
+        "score": res.score,
+        "chunk_idx": res.metadata.chunk_idx,
+    }
+
+
+def rrf_record(res: RRFSearchResult) -> Dict[str, Any]:
+    return {
+        "id": res.id,
+        "title": res.movie["title"],
+        "rrf_score": res.rrf_score,
+        "keyword_rank": res.keyword_rank,
+        "semantic_rank": res.semantic_rank,
+    }
+
+
+def weighted_record(res: WeightedSearchResult) -> Dict[str, Any]:
+    return {
+        "id": res.id,
+        "title": res.movie["title"],
+        "hybrid_score": res.hybrid_score,
+        "keyword_score": res.keyword_score,
+        "semantic_score": res.semantic_score,
+    }
+
+
+# one query per line, blank lines are skipped
+def read_queries(queries_file: str) -> Iterator[str]:
+    with open(queries_file, "r", encoding="utf-8") as f:
+        for line in f:
+            query = line.strip()
+            if query:
+                yield query
+
+
+# runs the queries through a batch search function chunk by chunk and
+# streams one json line per query ({"query": ..., "results": [...]})
+# so huge query logs never have to fit in memory
+def stream_jsonl(
+    queries_file: str,
+    output_file: str,
+    search_many: Callable[[List[str]], List[List[Any]]],
+    to_record: Callable[[Any], Dict[str, Any]],
+    stream_size: int = BATCH_STREAM_SIZE,
+) -> int:
+    written = 0
+    with open(output_file, "w", encoding="utf-8") as out:
+        for chunk in batched(read_queries(queries_file), stream_size):
+            queries = list(chunk)
+            for query, results in zip(queries, search_many(queries)):
+                out.write(
+                    json.dumps(
+                        {
+                            "query": query,
+                            "results": [to_record(res) for res in results],
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+                written += 1
+
+            out.flush()
+
+    return written
+
+
+def bm25_batch(queries_file: str, output_file: str, limit: int) -> int:
+    populate_index()
+
+    return stream_jsonl(
+        queries_file,
+        output_file,
+        lambda queries: CURRENT_INVERTED_INDEX.bm25_search_many(queries, limit),
+        bm25_record,
+    )
+
+
+def semantic_batch(queries_file: str, output_file: str, limit: int) -> int:
+    semantic_search = SemanticSearch()
+    semantic_search.load_or_create_embeddings()
+
+    return stream_jsonl(
+        queries_file,
+        output_file,
+        lambda queries: semantic_search.search_many(queries, limit),
+        semantic_record,
+    )
+
+
+def rrf_batch(queries_file: str, output_file: str, k: int, limit: int) -> int:
+    hybrid_search = HybridSearch()
+
+    return stream_jsonl(
+        queries_file,
+        output_file,
+        lambda queries: hybrid_search.rrf_search_many(queries, k, limit),
+        rrf_record,
+    )
+
+
+def weighted_batch(queries_file: str, output_file: str, alpha, limit: int) -> int:
+    hybrid_search = HybridSearch()
+
+    return stream_jsonl(
+        queries_file,
+        output_file,
+        lambda queries: hybrid_search.weighted_search_many(queries, alpha, limit),
+        weighted_record,
+    )
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config.data import MANIFEST_PATH
+from decors.handle_json_load_errors import handle_json_errors
+from typedicts.movies import Movie
+
+
+MANIFEST_VERSION = 1
+
+
+# ids and content hashes of the movies the cache was built from, in
+# document ordinal order, the next incremental build diffs against it
+# generation is a fresh token per build, caches of search results are
+# only valid for the generation they were computed under
+@dataclass
+class BuildManifest:
+    doc_ids: List[int] = field(default_factory=list)
+    hashes: List[str] = field(default_factory=list)
+    generation: str = ""
+
+
+# result of diffing the current movies against the manifest
+# reuse[new_ord] => ordinal of the same unchanged movie in the cache or -1
+@dataclass
+class MovieDiff:
+    reuse: np.ndarray
+    added: int = 0
+    changed: int = 0
+    deleted: int = 0
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.deleted)
+
+
+# hash of every field that ends up in the index or the embeddings
+def content_hash(movie: Movie) -> str:
+    return hashlib.sha1(
+        json.dumps(
+            [movie.get("title"), movie.get("description")],
+            ensure_ascii=False,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def create_manifest(movies: List[Movie]) -> BuildManifest:
+    return BuildManifest(
+        doc_ids=[int(movie["id"]) for movie in movies],
+        hashes=[content_hash(movie) for movie in movies],
+        generation=uuid.uuid4().hex,
+    )
+
+
+def save_manifest(manifest: BuildManifest) -> None:
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": MANIFEST_VERSION,
+                "doc_ids": manifest.doc_ids,
+                "hashes": manifest.hashes,
+                "generation": manifest.generation,
+            },
+            f,
+        )
+
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+@handle_json_errors
+def read_manifest_file() -> dict:
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# None when there is no usable manifest (first build, older cache)
+def load_manifest() -> Optional[BuildManifest]:
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+
+    data = read_manifest_file()
+    if not data or data.get("version") != MANIFEST_VERSION:
+        return None
+
+    return BuildManifest(
+        doc_ids=data["doc_ids"],
+        hashes=data["hashes"],
+        generation=data.get("generation", ""),
+    )
+
+
+# (stat signature, generation) of the manifest last read by cache_generation
+_generation_cache: Tuple[Optional[Tuple[int, int, int]], str] = (None, "")
+
+
+# generation of the cache on disk, the manifest is only re-read when
+# its file changed so this is one stat() per call
+def cache_generation() -> str:
+    global _generation_cache
+
+    try:
+        stat = os.stat(MANIFEST_PATH)
+    except FileNotFoundError:
+        return ""
+
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _generation_cache[0] != signature:
+        manifest = load_manifest()
+        _generation_cache = (signature, manifest.generation if manifest else "")
+
+    return _generation_cache[1]
+
+
+def diff_movies(manifest: BuildManifest, movies: List[Movie]) -> MovieDiff:
+    cached = {
+        doc_id: (doc_ord, content)
+        for doc_ord, (doc_id, content) in enumerate(
+            zip(manifest.doc_ids, manifest.hashes),
+        )
+    }
+
+    reuse = np.full(len(movies), -1, dtype=np.int64)
+    added = changed = 0
+    for doc_ord, movie in enumerate(movies):
+        entry = cached.get(int(movie["id"]))
+        if entry is None:
+            added += 1
+        elif entry[1] != content_hash(movie):
+            changed += 1
+        else:
+            reuse[doc_ord] = entry[0]
+
+    current_ids = {int(movie["id"]) for movie in movies}
+
+    return MovieDiff(
+        reuse=reuse,
+        added=added,
+        changed=changed,
+        deleted=sum(doc_id not in current_ids for doc_id in manifest.doc_ids),
+    )
@@ -2,9 +2,13 @@ import os
 
 from config.data import (
     CACHE_DIR_PATH,
+    DOC_STORE_PATH,
     EXPECTED_CACHE_DIR_FILES,
+    INDEX_SEGMENT_PATH,
 )
 from lib.enums.cache_status import CacheStatus
+from lib.indexes.doc_store import validate_doc_store
+from lib.indexes.segment import validate_segment
 
 
 class Cache:
@@ -24,6 +28,13 @@ class Cache:
         if missing_files:
             return CacheStatus.CORRUPT
 
+        # header, version and section table of the binary index
+        if not validate_segment(INDEX_SEGMENT_PATH):
+            return CacheStatus.CORRUPT
+
+        if not validate_doc_store(DOC_STORE_PATH):
+            return CacheStatus.CORRUPT
+
         return CacheStatus.BUILT
 
     def is_broken(self) -> bool:
@@ -1,27 +1,59 @@
+import hashlib
 import os
 import json
 import numpy as np
-from config.data import CHUNK_EMBDEDDINGS_PATH, CHUNK_METADATA_PATH, SCORE_PRECISION
+from config.data import (
+    CHUNK_CODES_PATH,
+    CHUNK_EMBDEDDINGS_PATH,
+    CHUNK_IVF_PATH,
+    CHUNK_METADATA_PATH,
+    CHUNK_QUANTIZER_PATH,
+    EMBEDDING_QUANTIZATION,
+    IVF_NPROBE,
+    SCORE_PRECISION,
+    SEMANTIC_INDEX_TYPE,
+)
 from decors.handle_json_load_errors import handle_json_errors
 from lib.data_loaders import load_movie_data
-from lib.semantic_search import SemanticSearch, semantic_chunk, cosine_similarity
+from lib.embedding_build import map_documents, texts_digest
+from lib.indexes.doc_store import DocStore, get_doc_store
+from lib.indexes.flat_index import FlatIndex
+from lib.indexes.ivf_index import IVFIndex
+from lib.indexes.quantization import QuantizedIndex
+from lib.semantic_search import SemanticSearch, semantic_chunk
+from typedicts.embedding_files import EmbeddingFiles
 from typedicts.movies import Movie
 
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 
 from typedicts.search_res import ChunkMetadata, SemanticChunkSearchRes
 
 
+CHUNK_FILES = EmbeddingFiles(
+    vectors=CHUNK_EMBDEDDINGS_PATH,
+    ivf=CHUNK_IVF_PATH,
+    codes=CHUNK_CODES_PATH,
+    quantizer=CHUNK_QUANTIZER_PATH,
+)
+
+
 class ChunkedSemanticSearch(SemanticSearch):
     def __init__(
         self,
         model_name: str = "all-MiniLM-L6-v2",
+        index_type: str = SEMANTIC_INDEX_TYPE,
+        nprobe: int = IVF_NPROBE,
+        quantization: str = EMBEDDING_QUANTIZATION,
     ) -> None:
         # initialize the parent class
-        super().__init__(model_name)
+        super().__init__(model_name, index_type, nprobe, quantization)
 
-        # chunked embeddings and metadata
+        # chunked embeddings (l2 normalized) and metadata
         self.chunked_embeddings: np.ndarray = np.empty((0,))
+        # cosine index over the chunk embeddings
+        self.chunk_index: FlatIndex | IVFIndex | QuantizedIndex = FlatIndex(
+            self.chunked_embeddings
+        )
         # chunked metadata
         self.chunked_metadata: Optional[List[Dict[str, Any]]] = None
         # total number of chunks
@@ -38,22 +70,22 @@ class ChunkedSemanticSearch(SemanticSearch):
             query,
         )
 
+        chunk_idxs, scores = self.chunk_index.search(query_embedding, limit)
+
         chunk_scores = []
-        for _, (embedding, meta_data) in enumerate(
-            zip(self.chunked_embeddings, self.chunked_metadata or []),
-        ):
-            cosine_sim = cosine_similarity(embedding, query_embedding)
+        for chunk_pos, cosine_sim in zip(chunk_idxs.tolist(), scores.tolist()):
+            meta_data = (self.chunked_metadata or [])[chunk_pos]
 
             movie_idx = meta_data["movie_idx"]
             chunk_idx = meta_data["chunk_idx"]
 
-            movie = self.documents[movie_idx]
+            movie = self.docs.movie(movie_idx)
             title = movie.get("title", "Unknown")
             document_text = movie.get("description", "")
 
             chunk_scores.append(
                 SemanticChunkSearchRes(
-                    id=movie.get("id", movie_idx),
+                    id=movie["id"],
                     title=title,
                     document=document_text[:100],
                     score=round(float(cosine_sim), SCORE_PRECISION),
@@ -65,9 +97,15 @@ class ChunkedSemanticSearch(SemanticSearch):
                 )
             )
 
-        chunk_scores.sort(key=lambda x: x["score"], reverse=True)
+        return chunk_scores
 
-        return chunk_scores[:limit]
+    def set_chunk_embeddings(
+        self,
+        embeddings: np.ndarray,
+        normalized: bool = False,
+    ) -> None:
+        self.chunk_index = self.create_index(embeddings, CHUNK_FILES, normalized)
+        self.chunked_embeddings = self.chunk_index.vectors
 
     # checcks if chunked embedding cache files exist
     def check_embedding_cache_exists(self) -> bool:
@@ -76,55 +114,111 @@ class ChunkedSemanticSearch(SemanticSearch):
         )
 
     # method to build chunked embeddings
+    # documents are chunked by a pool of worker processes, twice: first
+    # for the chunk counts (metadata, size of the file) and a digest of
+    # the chunks, then again while the chunks are streamed to the model
     def build_chunk_embeddings(
         self,
         documents: List[Movie],
     ) -> None:
         print("building chunked embeddings ......")
-        self.documents = documents
+        self.docs = DocStore.from_movies(documents)
 
-        all_chunks: List[str] = []
         meta_data: List[Dict] = []
+        digest = hashlib.sha1()
+        for doc_idx, (n_chunks, chunks_digest) in enumerate(
+            map_documents(chunk_digest, documents)
+        ):
+            meta_data.extend(
+                chunk_metadata(doc_idx, chunk_idx, n_chunks)
+                for chunk_idx in range(n_chunks)
+            )
+            digest.update(chunks_digest)
+
+        print(f"encoding {len(meta_data)} chunks...")
+        self.stream_embeddings(
+            CHUNK_EMBDEDDINGS_PATH,
+            lambda: (
+                chunk
+                for chunks in map_documents(chunk_document, documents)
+                for chunk in chunks
+            ),
+            len(meta_data),
+            digest.digest(),
+        )
+        self.set_chunk_embeddings(
+            self.load_embeddings(CHUNK_EMBDEDDINGS_PATH),
+            normalized=True,
+        )
+        self.save_chunks(meta_data)
+
+    # incremental version of build_chunk_embeddings
+    # reuse[idx] is the ordinal an unchanged document had in the saved
+    # cache (or -1), its chunks and their embeddings are copied over with
+    # movie_idx renumbered, only added or changed documents are chunked
+    # and encoded
+    def update_chunk_embeddings(
+        self,
+        documents: List[Movie],
+        reuse: np.ndarray,
+    ) -> None:
+        print("updating chunked embeddings ......")
+        self.docs = DocStore.from_movies(documents)
+
+        old_metadata = (self.load_json(CHUNK_METADATA_PATH) or {}).get("chunks", [])
+        # chunks are saved grouped by movie in ordinal order
+        old_movie_idxs = np.fromiter(
+            (meta["movie_idx"] for meta in old_metadata),
+            dtype=np.int64,
+            count=len(old_metadata),
+        )
+        starts = np.searchsorted(old_movie_idxs, reuse, side="left").tolist()
+        ends = np.searchsorted(old_movie_idxs, reuse, side="right").tolist()
 
+        chunk_reuse: List[int] = []
+        new_chunks: List[str] = []
+        meta_data: List[Dict] = []
         for doc_idx, document in enumerate(documents):
-            description = document.get("description", "").strip()
-            if not description:
+            if reuse[doc_idx] >= 0:
+                rows = range(starts[doc_idx], ends[doc_idx])
+                chunk_reuse.extend(rows)
+                meta_data.extend(
+                    {**old_metadata[row], "movie_idx": doc_idx} for row in rows
+                )
                 continue
 
-            # split into 4 sentence chunks with 1 sentence overlap
-            semantic_chunks = semantic_chunk(
-                text=document.get("description"), max_chunk_size=4, overlap=1
+            semantic_chunks = chunk_document(document)
+            chunk_reuse.extend([-1] * len(semantic_chunks))
+            new_chunks.extend(semantic_chunks)
+            meta_data.extend(
+                chunk_metadata(doc_idx, chunk_idx, len(semantic_chunks))
+                for chunk_idx in range(len(semantic_chunks))
             )
 
-            for chunk_idx, chunk in enumerate(semantic_chunks):
-                print(
-                    f"\r⏳ Processing chunk {chunk_idx + 1}/{len(semantic_chunks)}...",
-                    end="",
-                )
-                all_chunks.append(chunk)
-                meta_data.append(
-                    {
-                        "movie_idx": doc_idx,
-                        "chunk_idx": chunk_idx,
-                        "total_chunks": len(semantic_chunks),
-                    }
-                )
-
-            self.doc_map[int(document["id"])] = document
-
-        print("encoding embeddings...")
-        embeddings = self.model.encode(all_chunks)
+        print(f"encoding {len(new_chunks)} new chunks...")
+        self.set_chunk_embeddings(
+            self.merge_embeddings(
+                self.load_embeddings(CHUNK_EMBDEDDINGS_PATH),
+                np.asarray(chunk_reuse, dtype=np.int64),
+                new_chunks,
+            ),
+            normalized=True,
+        )
+        self.save_chunks(meta_data)
 
-        self.chunked_embeddings = embeddings
+    def save_chunks(self, meta_data: List[Dict]) -> None:
         self.chunked_metadata = meta_data
+        self.total_chunks = len(meta_data)
 
         print("writing files to cache....")
-        np.save(CHUNK_EMBDEDDINGS_PATH, embeddings)
+        self.save_index_files(self.chunk_index, CHUNK_FILES)
 
-        with open(CHUNK_METADATA_PATH, "w", encoding="utf-8") as f:
+        tmp_path = f"{CHUNK_METADATA_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(
-                {"chunks": meta_data, "total_chunks": len(all_chunks)}, f, indent=2
+                {"chunks": meta_data, "total_chunks": len(meta_data)}, f, indent=2
             )
+        os.replace(tmp_path, CHUNK_METADATA_PATH)
 
     # utitlity method to load json with error handling
     @handle_json_errors
@@ -134,24 +228,47 @@ class ChunkedSemanticSearch(SemanticSearch):
 
     # method to load chunked embeddings from cache
     def load_chunk_embeddings(self) -> np.ndarray:
-        documents = load_movie_data()
-
-        self.documents = documents
-
-        for _, document in enumerate(documents):
-            self.doc_map[int(document["id"])] = document
+        # stored fields come from the shared doc store, nothing is parsed
+        self.docs = get_doc_store()
 
         # we are not checking if these files exist
         # cause if they don't exist, the program won't reach here
         # you'll get a cache error
-        embddings = np.load(CHUNK_EMBDEDDINGS_PATH)
         metadata_file_json = self.load_json(CHUNK_METADATA_PATH)
 
-        self.chunked_embeddings = embddings
+        self.set_chunk_embeddings(
+            self.load_embeddings(CHUNK_EMBDEDDINGS_PATH),
+            normalized=True,
+        )
         self.chunked_metadata = metadata_file_json.get("chunks", [])
         self.total_chunks = metadata_file_json.get("total_chunks", 0)
 
-        return embddings
+        return self.chunked_embeddings
+
+
+# split into 4 sentence chunks with 1 sentence overlap
+def chunk_document(document: Movie) -> List[str]:
+    description = document.get("description", "").strip()
+    if not description:
+        return []
+
+    return semantic_chunk(
+        text=document.get("description"), max_chunk_size=4, overlap=1
+    )
+
+
+# number of chunks of a document and a digest of them (pool worker)
+def chunk_digest(document: Movie) -> Tuple[int, bytes]:
+    chunks = chunk_document(document)
+    return len(chunks), texts_digest(chunks)
+
+
+def chunk_metadata(movie_idx: int, chunk_idx: int, total_chunks: int) -> Dict:
+    return {
+        "movie_idx": movie_idx,
+        "chunk_idx": chunk_idx,
+        "total_chunks": total_chunks,
+    }
 
 
 CHUNKED_SEMEANTIC_SEARCH = ChunkedSemanticSearch()
@@ -170,7 +287,12 @@ def populate_embeddings() -> np.ndarray:
 def chunked_semantic_search(
     query: str,
     limit: int = 10,
+    index_type: str = SEMANTIC_INDEX_TYPE,
+    nprobe: int = IVF_NPROBE,
 ) -> List[SemanticChunkSearchRes]:
+    CHUNKED_SEMEANTIC_SEARCH.index_type = index_type
+    CHUNKED_SEMEANTIC_SEARCH.nprobe = nprobe
+
     populate_embeddings()
     return CHUNKED_SEMEANTIC_SEARCH.search_chunks(
         query,
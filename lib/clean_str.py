@@ -1,4 +1,6 @@
 import string
+from typing import List
+
 # this function removes all
 # the puncutaiton marks from query string
 # and makes then lower case for comparison
@@ -10,9 +12,11 @@ PUNCTUATION_TRANSLATION_TABLE = str.maketrans("", "", string.punctuation)
 
 
 def get_cleaned_string(raw_string: str) -> str:
-    cleaned = raw_string.translate(
-        PUNCTUATION_TRANSLATION_TABLE,
-    ).lower()
-
     # whitespace normalization
-    return " ".join(cleaned.split())
+    return " ".join(clean_words(raw_string))
+
+
+# the words of get_cleaned_string in one pass over the string each
+# (translate, lower, split) without joining them back together
+def clean_words(raw_string: str) -> List[str]:
+    return raw_string.translate(PUNCTUATION_TRANSLATION_TABLE).lower().split()
@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from config.data import (
+    CROSS_ENCODER_BATCH_SIZE,
+    CROSS_ENCODER_CACHE_SIZE,
+    CROSS_ENCODER_MAX_BATCH_PAIRS,
+    CROSS_ENCODER_MAX_WAIT_MS,
+    CROSS_ENCODER_MODEL,
+)
+
+
+# (query, document text) pairs of one caller waiting to be scored
+@dataclass
+class ScoreRequest:
+    pairs: List[Tuple[str, str]]
+    future: Future = field(default_factory=Future)
+
+
+# one cross encoder shared by every caller of the process :-
+# 1. scores are cached per (query, document text) pair (lru)
+# 2. the uncached pairs of concurrent callers (server threads) are
+#    gathered by a single worker thread for up to max_wait and scored
+#    together, so the model always sees full batches
+# 3. before scoring, pairs are sorted by length so every batch of
+#    batch_size pairs is padded to a similar length
+class CrossEncoderService:
+    def __init__(
+        self,
+        model_name: str = CROSS_ENCODER_MODEL,
+        batch_size: int = CROSS_ENCODER_BATCH_SIZE,
+        max_batch_pairs: int = CROSS_ENCODER_MAX_BATCH_PAIRS,
+        max_wait_ms: float = CROSS_ENCODER_MAX_WAIT_MS,
+        cache_size: int = CROSS_ENCODER_CACHE_SIZE,
+    ) -> None:
+        self.model = CrossEncoder(model_name_or_path=model_name)
+        self.batch_size = batch_size
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        self.cache: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.requests: "queue.Queue[ScoreRequest]" = queue.Queue()
+        self.worker: Optional[threading.Thread] = None
+
+    # relevance score of every text for the query, in order
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        scores: List[Optional[float]] = [None] * len(texts)
+        missing: List[int] = []
+
+        with self.lock:
+            for pos, text in enumerate(texts):
+                cached = self.cache.get((query, text))
+                if cached is None:
+                    missing.append(pos)
+                else:
+                    self.cache.move_to_end((query, text))
+                    scores[pos] = cached
+
+        if missing:
+            request = ScoreRequest([(query, texts[pos]) for pos in missing])
+            self.__ensure_worker()
+            self.requests.put(request)
+
+            for pos, score in zip(missing, request.future.result()):
+                scores[pos] = score
+
+            with self.lock:
+                for pos in missing:
+                    self.cache[(query, texts[pos])] = scores[pos] or 0.0
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        return [score or 0.0 for score in scores]
+
+    # length sorted scoring of a list of pairs, scores come back in the
+    # original order
+    def predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        order = sorted(
+            range(len(pairs)),
+            key=lambda pos: len(pairs[pos][0]) + len(pairs[pos][1]),
+        )
+
+        scores = np.empty(len(pairs), dtype=np.float32)
+        scores[order] = self.model.predict(
+            sentences=[list(pairs[pos]) for pos in order],
+            batch_size=self.batch_size,
+        )
+
+        return scores
+
+    def __ensure_worker(self) -> None:
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self.__run,
+                    name="cross-encoder",
+                    daemon=True,
+                )
+                self.worker.start()
+
+    def __run(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            n_pairs = len(batch[0].pairs)
+
+            # micro batch: whatever else arrives within max_wait
+            deadline = time.monotonic() + self.max_wait
+            while n_pairs < self.max_batch_pairs:
+                try:
+                    request = self.requests.get(
+                        timeout=max(0.0, deadline - time.monotonic()),
+                    )
+                except queue.Empty:
+                    break
+
+                batch.append(request)
+                n_pairs += len(request.pairs)
+
+            try:
+                scores = self.predict(
+                    [pair for request in batch for pair in request.pairs],
+                ).tolist()
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            start = 0
+            for request in batch:
+                request.future.set_result(scores[start : start + len(request.pairs)])
+                start += len(request.pairs)
+
+
+# the model is loaded on first use and then kept for the lifetime
+# of the process
+@lru_cache(maxsize=1)
+def get_cross_encoder_service() -> CrossEncoderService:
+    return CrossEncoderService()
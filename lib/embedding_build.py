@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from config.data import (
+    EMBEDDING_BUILD_BATCH_SIZE,
+    EMBEDDING_BUILD_PROCESSES,
+    EMBEDDING_BUILD_WINDOW,
+)
+from lib.parallel import parallel_map
+
+
+D = TypeVar("D")
+R = TypeVar("R")
+
+
+# fn over every document in order, computed by a pool of worker
+# processes (see parallel_map)
+def map_documents(
+    fn: Callable[[D], R],
+    documents: Sequence[D],
+    processes: int = EMBEDDING_BUILD_PROCESSES,
+    window: int = EMBEDDING_BUILD_WINDOW,
+) -> Iterator[R]:
+    return parallel_map(fn, documents, processes, window)
+
+
+# digest of a sequence of texts, two builds over the same texts (in the
+# same order) share a checkpoint
+def texts_digest(texts: Iterable[str]) -> bytes:
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(hashlib.sha1(text.encode("utf-8")).digest())
+
+    return digest.digest()
+
+
+# writes the encodings of n_rows texts into the .npy file at path
+# 1. the file is preallocated next to path and mapped, every batch of
+#    batch_size texts is encoded and written into its rows, so the texts
+#    and vectors held in memory never exceed one batch
+# 2. after each batch the rows are flushed and a checkpoint (rows done,
+#    fingerprint of the inputs) is written, a build of the same
+#    fingerprint that finds the checkpoint continues after those rows
+# 3. the finished file is swapped in over path
+def stream_embeddings(
+    path: str,
+    texts: Iterable[str],
+    n_rows: int,
+    dim: int,
+    fingerprint: str,
+    encode: Callable[[List[str]], np.ndarray],
+    batch_size: int = EMBEDDING_BUILD_BATCH_SIZE,
+) -> None:
+    partial_path = f"{path}.partial.npy"
+    checkpoint_path = f"{path}.checkpoint.json"
+
+    done = resume_point(partial_path, checkpoint_path, fingerprint, (n_rows, dim))
+    if done is None:
+        done = 0
+        embeddings = np.lib.format.open_memmap(
+            partial_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(n_rows, dim),
+        )
+    else:
+        print(f"resuming {os.path.basename(path)} at row {done}/{n_rows}")
+        embeddings = np.lib.format.open_memmap(partial_path, mode="r+")
+
+    # rows already on disk are skipped, not encoded again
+    pending = islice(texts, done, None)
+    while done < n_rows:
+        batch = list(islice(pending, min(batch_size, n_rows - done)))
+        if not batch:
+            raise ValueError(f"expected {n_rows} texts, got {done}")
+
+        embeddings[done : done + len(batch)] = encode(batch)
+        embeddings.flush()
+        done += len(batch)
+
+        write_checkpoint(checkpoint_path, fingerprint, done)
+        print(f"\r⏳ encoded {done}/{n_rows}", end="", flush=True)
+
+    print()
+    del embeddings
+    os.replace(partial_path, path)
+    os.remove(checkpoint_path)
+
+
+# rows of the partial file written by an interrupted build of the same
+# inputs or None when there is nothing to resume
+def resume_point(
+    partial_path: str,
+    checkpoint_path: str,
+    fingerprint: str,
+    shape: tuple,
+) -> Optional[int]:
+    if not os.path.exists(partial_path) or not os.path.exists(checkpoint_path):
+        return None
+
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+
+        partial = np.load(partial_path, mmap_mode="r")
+        if partial.shape != shape or partial.dtype != np.float32:
+            return None
+    except (OSError, ValueError, json.JSONDecodeError):
+        return None
+
+    if checkpoint.get("fingerprint") != fingerprint:
+        return None
+
+    return min(int(checkpoint.get("rows", 0)), shape[0])
+
+
+def write_checkpoint(path: str, fingerprint: str, rows: int) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "rows": rows}, f)
+
+    os.replace(tmp_path, path)
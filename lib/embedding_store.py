@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from config.data import (
+    CACHE_DIR_PATH,
+    EMBEDDING_STORE_MAX_ENTRIES,
+    EMBEDDING_STORE_PATH,
+)
+from lib.indexes.flat_index import normalize_rows
+
+
+# keys looked up per sqlite statement (stays below the variable limit)
+LOOKUP_BATCH_SIZE = 500
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+# persistent content addressed embedding cache
+# (model name, sha1 of the text) -> l2 normalized float32 vector, kept in
+# one sqlite file so it survives full rebuilds and chunking experiments,
+# least recently used entries are evicted past max_entries
+class EmbeddingStore:
+    def __init__(
+        self,
+        path: str = EMBEDDING_STORE_PATH,
+        max_entries: int = EMBEDDING_STORE_MAX_ENTRIES,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+
+        os.makedirs(os.path.dirname(path) or CACHE_DIR_PATH, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # normalized embeddings of texts, only texts the store has not seen
+    # for this model are passed to encode (once each, in one call) and
+    # their vectors are stored afterwards
+    def encode(
+        self,
+        model: str,
+        texts: List[str],
+        encode: Callable[[List[str]], np.ndarray],
+        dim: int,
+        verbose: bool = True,
+    ) -> np.ndarray:
+        embeddings = np.empty((len(texts), dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        hashes = [text_hash(text) for text in texts]
+        found = self.get_many(model, list(set(hashes)))
+
+        # text hash -> rows of the texts the store does not have
+        missing: Dict[bytes, List[int]] = {}
+        for row, key in enumerate(hashes):
+            vector = found.get(key)
+            if vector is not None:
+                embeddings[row] = vector
+            else:
+                missing.setdefault(key, []).append(row)
+
+        if verbose:
+            print(f"embedding store: {len(texts)} texts, {len(missing)} to encode")
+        if missing:
+            new_vectors = normalize_rows(
+                encode([texts[rows[0]] for rows in missing.values()]),
+            )
+            for vector, rows in zip(new_vectors, missing.values()):
+                embeddings[rows] = vector
+
+            self.put_many(model, list(missing), new_vectors)
+
+        return embeddings
+
+    # text hash -> vector for every hash present, hits are marked used
+    def get_many(self, model: str, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[start : start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                (model, *batch),
+            ).fetchall()
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                ((now, model, key) for key in found),
+            )
+            self.conn.commit()
+
+        return found
+
+    def put_many(self, model: str, hashes: List[bytes], vectors: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+            (
+                (model, key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for key, vector in zip(hashes, vectors)
+            ),
+        )
+        self.evict()
+        self.conn.commit()
+
+    # drops the least recently used entries above max_entries
+    def evict(self) -> None:
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return
+
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
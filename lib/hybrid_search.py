@@ -1,15 +1,22 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Dict, List, Optional, Tuple
 
-from config.data import ALPHA, CROSS_ENCODER_MODEL
+from config.data import (
+    ALPHA,
+    RERANK_DEADLINE_SECONDS,
+    RERANK_WORKERS,
+)
 from lib.ai.action import enhance_query, generate_resp
 from lib.ai.prompt_builders import (
     build_batch_doc_rating_prompt,
     build_individual_doc_rating_prompt,
 )
 from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.cross_encoder import get_cross_encoder_service
 from lib.enums.enahnce_methods import EnhanceMethod
 from lib.enums.rerank_methods import RerankMethod
-from typedicts.movies import Movie
+from lib.result_cache import RESULT_CACHE
 from typedicts.rrf_search import DocumentRanks
 from typedicts.search_res import (
     HybridScores,
@@ -18,32 +25,30 @@ from typedicts.search_res import (
 )
 
 
-from lib.data_loaders import load_movie_data
 from utils.parse_id import parse_id_list
-from utils.safe_float import convert_to_float
 from .keyword_search import InvertedIndex
 
-from sentence_transformers import CrossEncoder
-
 
 # i know this is unrelated to the code but
 # once a wise man said "The fastest way to loop in python is to not loop in python"
 # -- Me , 2025
 class HybridSearch:
-    def __init__(self):
-        movie_data = load_movie_data()
-
-        self.documents_list: List[Movie] = movie_data
-        self.semantic_search = ChunkedSemanticSearch()
-
-        self.documents: Dict[int, Movie] = {m["id"]: m for m in movie_data}
-
-        self.semantic_search.load_or_create_embeddings(
-            movie_data,
-        )
+    # already loaded engines can be passed in (the server shares one
+    # model and one index between every search mode)
+    # both retrievers rank by doc id only, the stored fields of the fused
+    # top results are fetched from the shared doc store
+    def __init__(
+        self,
+        semantic_search: Optional[ChunkedSemanticSearch] = None,
+        inverted_idx: Optional[InvertedIndex] = None,
+    ):
+        self.semantic_search = semantic_search or ChunkedSemanticSearch()
+        self.semantic_search.load_or_create_embeddings()
+        self.docs = self.semantic_search.docs
 
-        self.inverted_idx = InvertedIndex()
-        self.inverted_idx.load()
+        self.inverted_idx = inverted_idx or InvertedIndex()
+        if not self.inverted_idx.is_loaded:
+            self.inverted_idx.load()
 
     def bm25_search(
         self,
@@ -62,56 +67,100 @@ class HybridSearch:
         alpha,
         limit: int = 5,
     ) -> List[WeightedSearchResult]:
-        keyword_search_results = self.bm25_search(
+        keyword_search_results = self.inverted_idx.bm25_rank(
             query,
             500 * limit,
         )
 
-        semantic_search_results = self.semantic_search.search(
+        semantic_search_results = self.semantic_search.rank(
             query,
             500 * limit,
         )
 
+        return self.fuse_weighted(
+            keyword_search_results,
+            semantic_search_results,
+            alpha,
+            limit,
+        )
+
+    # batch version of weighted_search, both retrievers score the
+    # whole list of queries in one go before fusing query by query
+    def weighted_search_many(
+        self,
+        queries: List[str],
+        alpha,
+        limit: int = 5,
+    ) -> List[List[WeightedSearchResult]]:
+        keyword_search_results = self.inverted_idx.bm25_rank_many(
+            queries,
+            500 * limit,
+        )
+
+        semantic_search_results = self.semantic_search.rank_many(
+            queries,
+            500 * limit,
+        )
+
+        return [
+            self.fuse_weighted(kw_res, sem_res, alpha, limit)
+            for kw_res, sem_res in zip(
+                keyword_search_results,
+                semantic_search_results,
+            )
+        ]
+
+    # combines min-max normalized bm25 and semantic scores
+    # the results are (doc id, score) rankings of both retrievers
+    def fuse_weighted(
+        self,
+        keyword_search_results: List[Tuple[int, float]],
+        semantic_search_results: List[Tuple[int, float]],
+        alpha,
+        limit: int,
+    ) -> List[WeightedSearchResult]:
         nm_kw_score = normalize_scores([s[-1] for s in keyword_search_results])
-        nm_semantic_score = normalize_scores([e.score for e in semantic_search_results])
+        nm_semantic_score = normalize_scores([s[-1] for s in semantic_search_results])
 
         scores_map_dict: Dict[int, HybridScores] = dict()
 
-        for (doc_id, _, _), nscore in zip(keyword_search_results, nm_kw_score):
-            scores_map_dict[doc_id] = HybridScores(
-                movie=self.documents[doc_id],
-                kw_score=nscore,
-            )
+        for (doc_id, _), nscore in zip(keyword_search_results, nm_kw_score):
+            scores_map_dict[doc_id] = HybridScores(kw_score=nscore)
 
-        for res, score in zip(semantic_search_results, nm_semantic_score):
-            doc_id = res.id
+        for (doc_id, _), score in zip(semantic_search_results, nm_semantic_score):
             if doc_id in scores_map_dict:
                 scores_map_dict[doc_id].sem_score = score
             else:
-                scores_map_dict[doc_id] = HybridScores(
-                    movie=self.documents[doc_id],
-                    sem_score=score,
-                )
+                scores_map_dict[doc_id] = HybridScores(sem_score=score)
 
-        return sorted(
+        fused = sorted(
             (
-                WeightedSearchResult(
-                    id=doc_id,
-                    movie=hs.movie,
-                    hybrid_score=hybrid_score(
+                (
+                    doc_id,
+                    hs,
+                    hybrid_score(
                         bm25_score=hs.kw_score,
                         semantic_score=hs.sem_score,
                         alpha=alpha,
                     ),
-                    keyword_score=hs.kw_score,
-                    semantic_score=hs.sem_score,
                 )
                 for doc_id, hs in scores_map_dict.items()
             ),
-            key=lambda w: w.hybrid_score,
+            key=lambda entry: entry[2],
             reverse=True,
         )[:limit]
 
+        return [
+            WeightedSearchResult(
+                id=doc_id,
+                movie=self.docs.get(doc_id),
+                hybrid_score=score,
+                keyword_score=hs.kw_score,
+                semantic_score=hs.sem_score,
+            )
+            for doc_id, hs, score in fused
+        ]
+
     # placeholder for RRF hybrid search
     def rrf_search(
         self,
@@ -119,22 +168,62 @@ class HybridSearch:
         k: int = 5,
         limit: int = 10,
     ) -> List[RRFSearchResult]:
-        kw_search_res = self.bm25_search(
+        kw_search_res = self.inverted_idx.bm25_rank(
             query,
             500 * limit,
         )
 
-        sem_search_res = self.semantic_search.search(
+        sem_search_res = self.semantic_search.rank(
             query,
             500 * limit,
         )
 
+        return self.fuse_rrf(
+            kw_search_res,
+            sem_search_res,
+            k,
+            limit,
+        )
+
+    # batch version of rrf_search
+    def rrf_search_many(
+        self,
+        queries: List[str],
+        k: int = 5,
+        limit: int = 10,
+    ) -> List[List[RRFSearchResult]]:
+        kw_search_res = self.inverted_idx.bm25_rank_many(
+            queries,
+            500 * limit,
+        )
+
+        sem_search_res = self.semantic_search.rank_many(
+            queries,
+            500 * limit,
+        )
+
+        return [
+            self.fuse_rrf(kw_res, sem_res, k, limit)
+            for kw_res, sem_res in zip(
+                kw_search_res,
+                sem_search_res,
+            )
+        ]
+
+    # reciprocal rank fusion of the bm25 and semantic (doc id, score)
+    # rankings
+    def fuse_rrf(
+        self,
+        kw_search_res: List[Tuple[int, float]],
+        sem_search_res: List[Tuple[int, float]],
+        k: int,
+        limit: int,
+    ) -> List[RRFSearchResult]:
         score_map: Dict[int, DocumentRanks] = dict()
 
-        for rank, (doc_id, _, _) in enumerate(kw_search_res, start=1):
+        for rank, (doc_id, _) in enumerate(kw_search_res, start=1):
             if doc_id not in score_map:
                 score_map[doc_id] = DocumentRanks(
-                    document=self.documents[doc_id],
                     semantic_rank=0,
                     keyword_rank=rank,
                 )
@@ -142,11 +231,9 @@ class HybridSearch:
             else:
                 score_map[doc_id].keyword_rank = rank
 
-        for rank, res in enumerate(sem_search_res, start=1):
-            doc_id = res.id
+        for rank, (doc_id, _) in enumerate(sem_search_res, start=1):
             if doc_id not in score_map:
                 score_map[doc_id] = DocumentRanks(
-                    document=self.documents[doc_id],
                     keyword_rank=0,
                     semantic_rank=rank,
                 )
@@ -161,7 +248,7 @@ class HybridSearch:
         return [
             RRFSearchResult(
                 id=doc_id,
-                movie=self.documents[doc_id],
+                movie=self.docs.get(doc_id),
                 rrf_score=fused,
                 keyword_rank=score_map[doc_id].keyword_rank,
                 semantic_rank=score_map[doc_id].semantic_rank,
@@ -231,8 +318,42 @@ def exec_rrf_search(
     k: int = 60,
     enahnce_method: EnhanceMethod | None = None,
     rerank_method: RerankMethod | None = None,
+    hybrid_search_instance: HybridSearch | None = None,
 ) -> List[RRFSearchResult]:
-    hybrid_search_instance = HybridSearch()
+    # repeat queries skip retrieval and the llm calls of enhancement
+    # and reranking until the next build, a rerank with ratings missing
+    # is served but not cached
+    results, _ = RESULT_CACHE.get_or_compute(
+        (
+            "rrf",
+            query,
+            limit,
+            k,
+            EnhanceMethod(enahnce_method).value if enahnce_method else None,
+            RerankMethod(rerank_method).value if rerank_method else None,
+        ),
+        lambda: compute_rrf_search(
+            query,
+            limit,
+            k,
+            enahnce_method,
+            rerank_method,
+            hybrid_search_instance,
+        ),
+        cacheable=lambda response: response[1],
+    )
+    return results
+
+
+def compute_rrf_search(
+    query: str,
+    limit: int,
+    k: int,
+    enahnce_method: EnhanceMethod | None,
+    rerank_method: RerankMethod | None,
+    hybrid_search_instance: HybridSearch | None,
+) -> Tuple[List[RRFSearchResult], bool]:
+    hybrid_search_instance = hybrid_search_instance or HybridSearch()
 
     enahanced_query = enhance_query(
         query,
@@ -248,46 +369,40 @@ def exec_rrf_search(
     )
 
     if rerank_method is None:
-        return search_res
+        return search_res, True
 
-    return rerank_results(query, results=search_res, method=rerank_method)[:limit]
+    reranked, complete = rerank_results(
+        query,
+        results=search_res,
+        method=rerank_method,
+    )
+    return reranked[:limit], complete
 
 
+# reranked results and whether every result got its rating (False when
+# the llm failed, timed out or left documents out)
 def rerank_results(
     query: str,
     results: List[RRFSearchResult],
     method: RerankMethod,
-) -> List[RRFSearchResult]:
+) -> Tuple[List[RRFSearchResult], bool]:
     stripped_query = query.strip()
 
     result_map = {doc.id: doc for doc in results}
 
     reranked_items = []
+    complete = True
 
     match RerankMethod(method):
         case RerankMethod.INDIVIDUAL:
-            for doc in results:
-                resp = generate_resp(
-                    build_individual_doc_rating_prompt(query=stripped_query, doc=doc),
-                    delay=4,
-                )
-
-                reranked_items.append(
-                    (
-                        doc.id,
-                        convert_to_float(
-                            value=resp.text.strip() if (resp and resp.text) else "",
-                            fallback=0.0,
-                        ),
-                    )
-                )
-
-            reranked_items.sort(key=lambda x: x[1], reverse=True)
+            reranked, complete = rerank_individual(stripped_query, results)
+            reranked_items = [(doc.id, None) for doc in reranked]
 
         case RerankMethod.BATCH:
             resp = generate_resp(
                 build_batch_doc_rating_prompt(query=stripped_query, docs=results),
                 delay=4,
+                method=RerankMethod.BATCH.value,
             )
 
             id_list = parse_id_list(
@@ -295,19 +410,16 @@ def rerank_results(
             )
 
             reranked_items = [(doc_id, None) for doc_id in id_list]
+            complete = result_map.keys() <= set(id_list)
 
         case RerankMethod.CROSS_ENCODER:
-            pairs = [
+            scores = get_cross_encoder_service().score(
+                stripped_query,
                 [
-                    stripped_query,
-                    f"{doc.movie.get('title', '')} - {doc.movie.get('document', '')}",
-                ]
-                for doc in results
-            ]
-
-            cross_ecoder = CrossEncoder(model_name_or_path=CROSS_ENCODER_MODEL)
-
-            scores = cross_ecoder.predict(sentences=pairs)
+                    f"{doc.movie.get('title', '')} - {doc.movie.get('document', '')}"
+                    for doc in results
+                ],
+            )
 
             reranked_items = [
                 (doc.id, float(score))
@@ -318,18 +430,94 @@ def rerank_results(
             ]
             reranked_items.sort(key=lambda x: x[1], reverse=True)
 
-    return [result_map[doc_id] for doc_id, _ in reranked_items if doc_id in result_map]
+    return [
+        result_map[doc_id] for doc_id, _ in reranked_items if doc_id in result_map
+    ], complete
+
+
+# rating threads shared by every rerank, a call still running at its
+# deadline times out there (see request_resp) so none outlives it
+RERANK_EXECUTOR = ThreadPoolExecutor(
+    max_workers=RERANK_WORKERS,
+    thread_name_prefix="rerank",
+)
+
+
+# rates every document concurrently on RERANK_WORKERS threads, the
+# llm calls themselves are paced by the shared token bucket
+# documents without a rating by the deadline (timed out, failed or not
+# a number) keep their rrf slot and the rated ones fill the remaining
+# slots by score, so with no ratings at all this is the rrf order
+# returned with whether every document was rated
+def rerank_individual(
+    query: str,
+    results: List[RRFSearchResult],
+    deadline_seconds: float = RERANK_DEADLINE_SECONDS,
+) -> Tuple[List[RRFSearchResult], bool]:
+    deadline = time.monotonic() + deadline_seconds
+
+    futures: List[Future] = [
+        RERANK_EXECUTOR.submit(rate_document, query, doc, deadline)
+        for doc in results
+    ]
+    wait(futures, timeout=deadline_seconds)
+    # ratings that have not started by the deadline are dropped
+    for future in futures:
+        future.cancel()
+
+    scores: List[Optional[float]] = [
+        future.result()
+        if future.done() and not future.cancelled() and future.exception() is None
+        else None
+        for future in futures
+    ]
+
+    # stable, equal scores stay in rrf order
+    rated = iter(
+        sorted(
+            (pos for pos, score in enumerate(scores) if score is not None),
+            key=lambda pos: -(scores[pos] or 0.0),
+        )
+    )
+
+    return [
+        results[pos] if score is None else results[next(rated)]
+        for pos, score in enumerate(scores)
+    ], all(score is not None for score in scores)
+
+
+# llm relevance rating (0-10) of one document, None when there is none
+def rate_document(
+    query: str,
+    doc: RRFSearchResult,
+    deadline: float,
+) -> Optional[float]:
+    resp = generate_resp(
+        build_individual_doc_rating_prompt(query=query, doc=doc),
+        delay=1,
+        method=RerankMethod.INDIVIDUAL.value,
+        deadline=deadline,
+    )
+    if not resp or not resp.text:
+        return None
+
+    try:
+        return float(resp.text.strip())
+    except ValueError:
+        return None
 
 
 def exec_weighted_search(
     query: str,
     alpha,
     limit: int = 5,
+    hybrid_search_instance: HybridSearch | None = None,
 ) -> List[WeightedSearchResult]:
-    hybrid_search_instance = HybridSearch()
-
-    return hybrid_search_instance.weighted_search(
-        query,
-        alpha,
-        limit,
+    return RESULT_CACHE.get_or_compute(
+        ("weighted", query, limit, float(alpha)),
+        lambda: (hybrid_search_instance or HybridSearch()).weighted_search(
+            query,
+            alpha,
+            limit,
+        ),
     )
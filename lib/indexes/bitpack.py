@@ -0,0 +1,89 @@
+from typing import Tuple
+
+import numpy as np
+
+
+# zero bytes after the last block so every value can be read as one
+# unaligned 8 byte word
+PADDING = 8
+
+
+def bit_widths(max_values: np.ndarray) -> np.ndarray:
+    widths = np.zeros(len(max_values), dtype=np.uint8)
+    positive = max_values > 0
+    widths[positive] = (
+        np.floor(np.log2(max_values[positive].astype(np.float64))).astype(np.uint8)
+        + 1
+    )
+    return widths
+
+
+# bit packing of blocks of unsigned integers (at most 32 bits)
+# every block is stored with the bit width of its largest value, values
+# least significant bit first, each block starting on a byte boundary
+# block_starts are the positions where blocks begin in values (sorted,
+# the first one 0), returns the packed bytes, the byte offset of every
+# block and its bit width
+def pack_blocks(
+    values: np.ndarray,
+    block_starts: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    values = values.astype(np.uint64)
+    counts = np.diff(np.append(block_starts, len(values)))
+
+    widths = (
+        bit_widths(np.maximum.reduceat(values, block_starts))
+        if len(values)
+        else np.zeros(len(block_starts), dtype=np.uint8)
+    )
+    block_bytes = (counts * widths.astype(np.int64) + 7) // 8
+    byte_offsets = np.zeros(len(block_starts) + 1, dtype=np.int64)
+    np.cumsum(block_bytes, out=byte_offsets[1:])
+
+    # bit position of every value: start of its block plus its rank
+    # inside the block times the block width
+    value_blocks = np.repeat(np.arange(len(block_starts)), counts)
+    value_widths = widths[value_blocks].astype(np.int64)
+    ranks = np.arange(len(values)) - np.repeat(block_starts, counts)
+    bit_starts = byte_offsets[value_blocks] * 8 + ranks * value_widths
+
+    bits = np.zeros(int(byte_offsets[-1]) * 8, dtype=np.uint8)
+    for bit in range(int(widths.max(initial=0))):
+        wide = value_widths > bit
+        bits[bit_starts[wide] + bit] = (values[wide] >> np.uint64(bit)) & np.uint64(1)
+
+    data = np.concatenate(
+        (np.packbits(bits, bitorder="little"), np.zeros(PADDING, dtype=np.uint8))
+    )
+    return data, byte_offsets[:-1], widths
+
+
+# values of the given blocks, concatenated in block order
+# byte_offsets, widths and counts describe the wanted blocks only
+def unpack_blocks(
+    data: np.ndarray,
+    byte_offsets: np.ndarray,
+    widths: np.ndarray,
+    counts: np.ndarray,
+) -> np.ndarray:
+    n_values = int(counts.sum())
+    if not n_values:
+        return np.empty(0, dtype=np.uint64)
+
+    block_starts = np.cumsum(counts) - counts
+    value_widths = np.repeat(widths.astype(np.uint64), counts)
+    ranks = np.arange(n_values, dtype=np.uint64) - np.repeat(
+        block_starts, counts
+    ).astype(np.uint64)
+    bit_starts = (
+        np.repeat(byte_offsets, counts).astype(np.uint64) * np.uint64(8)
+        + ranks * value_widths
+    )
+
+    # little endian 8 byte window starting at the byte of every value
+    byte_starts = (bit_starts >> np.uint64(3)).astype(np.int64)
+    words = data[byte_starts[:, None] + np.arange(8)].view("<u8").ravel()
+
+    return (words >> (bit_starts & np.uint64(7))) & (
+        (np.uint64(1) << value_widths) - np.uint64(1)
+    )
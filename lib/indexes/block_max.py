@@ -0,0 +1,199 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import numpy as np
+
+from lib.indexes.boolean_query import difference
+from lib.indexes.postings import Postings
+from lib.indexes.top_k import top_k
+
+
+# relative tolerance used when comparing bounds against the threshold
+PRUNING_SLACK = 1e-9
+
+
+# block-max metadata for dynamic pruning
+# the document ordinal space is cut into fixed size blocks and for every
+# (term, block) pair that has postings we keep :-
+# 1. block_ids    => the block the entry belongs to
+# 2. block_maxes  => highest impact of the term inside that block
+# entries of a term live at block_offsets[row]:block_offsets[row + 1]
+@dataclass
+class BlockMaxIndex:
+    block_size: int = 64
+    n_blocks: int = 0
+    term_max: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.float32),
+    )
+    block_offsets: np.ndarray = field(
+        default_factory=lambda: np.zeros(1, dtype=np.int64),
+    )
+    block_ids: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int32),
+    )
+    block_maxes: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.float32),
+    )
+
+    # upper bound of the score of every block under query_rows[i:], one
+    # row per i (the last one, no terms left, is all zeros)
+    def suffix_bounds(self, query_rows: List[Tuple[int, int]]) -> np.ndarray:
+        bounds = np.zeros((len(query_rows) + 1, self.n_blocks), dtype=np.float64)
+        for i in range(len(query_rows) - 1, -1, -1):
+            row, query_tf = query_rows[i]
+            start, end = self.block_offsets[row], self.block_offsets[row + 1]
+            bounds[i] = bounds[i + 1]
+            bounds[i, self.block_ids[start:end]] += query_tf * self.block_maxes[
+                start:end
+            ].astype(np.float64)
+
+        return bounds
+
+
+def build_block_max(
+    postings: Postings,
+    n_docs: int,
+    block_size: int,
+) -> BlockMaxIndex:
+    doc_ords, _, weights = postings.flat()
+    n_postings = len(doc_ords)
+    if not n_postings:
+        return BlockMaxIndex(
+            block_size=block_size,
+            term_max=np.zeros(len(postings), dtype=np.float32),
+            block_offsets=np.zeros(len(postings) + 1, dtype=np.int64),
+        )
+
+    blocks = doc_ords // block_size
+    term_rows = np.repeat(
+        np.arange(len(postings), dtype=np.int64),
+        np.diff(postings.offsets),
+    )
+
+    # a new entry starts wherever the term or the block changes
+    is_start = np.ones(n_postings, dtype=bool)
+    is_start[1:] = (blocks[1:] != blocks[:-1]) | (term_rows[1:] != term_rows[:-1])
+    starts = np.flatnonzero(is_start)
+
+    return BlockMaxIndex(
+        block_size=block_size,
+        n_blocks=-(-n_docs // block_size),
+        term_max=np.maximum.reduceat(weights, postings.offsets[:-1]),
+        block_offsets=np.searchsorted(starts, postings.offsets).astype(np.int64),
+        block_ids=blocks[starts].astype(np.int32),
+        block_maxes=np.maximum.reduceat(weights, starts),
+    )
+
+
+# block-max maxscore top-k, term at a time
+# terms are taken by max score, highest first, and remaining[i] is the
+# most a document can still gain from term i onwards, the threshold is
+# a lower bound of the final k-th score (the k-th best partial score,
+# every partial score is a sum of positive impacts of a real document)
+# 1. essential terms are decoded whole into a dense accumulator, after
+#    each of them the threshold is raised and once remaining drops below
+#    it the split advances for good: a document no essential term holds
+#    can not reach the top-k any more
+# 2. non-essential terms only score the candidates whose partial score
+#    plus the block-max bound of the terms still to come reaches the
+#    threshold, the candidates shrink after every term so the common
+#    terms (lowest max scores, longest lists) are looked up for few
+#    documents and most of their blocks are never decoded
+# 3. survivors are scored exactly, summed in the same term order as the
+#    exhaustive scorer so the results are identical to it
+def block_max_top_k(
+    postings: Postings,
+    block_max: BlockMaxIndex,
+    query_rows: List[Tuple[int, int]],
+    limit: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if limit <= 0 or not query_rows:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+    max_scores = np.array(
+        [query_tf * float(block_max.term_max[row]) for row, query_tf in query_rows],
+        dtype=np.float64,
+    )
+    order = np.argsort(-max_scores, kind="stable")
+    remaining = np.cumsum(max_scores[order][::-1])[::-1]
+
+    threshold = -np.inf
+    scores = np.zeros(len(postings.doc_lengths), dtype=np.float64)
+    best_ords = np.empty(0, dtype=np.int64)
+    split = 0
+    while split < len(order) and remaining[split] >= reachable(threshold):
+        row, query_tf = query_rows[order[split]]
+        doc_ords, _, weights = postings.row(row)
+        scores[doc_ords] += query_tf * weights.astype(np.float64)
+        split += 1
+
+        # only the documents of this term changed, the k-th best is
+        # among them and the previous best
+        pool = np.concatenate([doc_ords, difference(best_ords, doc_ords)])
+        best_ords, kth = best_of(pool, scores[pool], limit)
+        threshold = max(threshold, kth)
+
+    candidate_ords = np.flatnonzero(scores)
+    partial_scores = scores[candidate_ords]
+    non_essential = [query_rows[term_idx] for term_idx in order[split:]]
+    rest_bounds = block_max.suffix_bounds(non_essential)
+    for pos, (row, query_tf) in enumerate(non_essential):
+        blocks = candidate_ords // block_max.block_size
+        keep = partial_scores + rest_bounds[pos][blocks] >= reachable(threshold)
+        candidate_ords, partial_scores = candidate_ords[keep], partial_scores[keep]
+        if not len(candidate_ords):
+            break
+
+        partial_scores = partial_scores + query_tf * postings.lookup(
+            row,
+            candidate_ords,
+        ).astype(np.float64)
+        _, kth = best_of(candidate_ords, partial_scores, limit)
+        threshold = max(threshold, kth)
+
+    candidate_ords = candidate_ords[partial_scores >= reachable(threshold)]
+
+    return top_k(
+        candidate_ords,
+        score_candidates(postings, query_rows, candidate_ords),
+        limit,
+    )
+
+
+# the bound a document has to reach to possibly tie the threshold
+# bounds are summed in a different order than the exact scores so a
+# relative slack far above float rounding keeps ties from being dropped
+def reachable(threshold: float) -> float:
+    return threshold - PRUNING_SLACK * abs(threshold)
+
+
+# the best `limit` ordinals and the lowest score among them, -inf while
+# there are fewer than `limit`
+def best_of(
+    ords: np.ndarray,
+    scores: np.ndarray,
+    limit: int,
+) -> Tuple[np.ndarray, float]:
+    if len(ords) < limit:
+        return ords, -np.inf
+
+    best = np.argpartition(scores, len(scores) - limit)[len(scores) - limit :]
+    return ords[best], float(scores[best].min())
+
+
+# exact scores of the given documents, terms are added in query order
+# and a missing term adds an exact 0.0 so every sum matches the
+# exhaustive accumulate bit for bit
+# candidates are looked up through the skip data, the posting blocks of
+# a term that hold no candidate are not decoded unless the candidates
+# cover most of the term (Postings.lookup)
+def score_candidates(
+    postings: Postings,
+    query_rows: List[Tuple[int, int]],
+    candidate_ords: np.ndarray,
+) -> np.ndarray:
+    scores = np.zeros(len(candidate_ords), dtype=np.float64)
+    for row, query_tf in query_rows:
+        scores += query_tf * postings.lookup(row, candidate_ords).astype(np.float64)
+
+    return scores
@@ -0,0 +1,308 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+import numpy as np
+
+from lib.indexes.postings import Postings
+from lib.tokenize import tokenize
+
+
+# boolean query language of the keyword filters :-
+# 1. a word matches the documents holding it, words are tokenized like
+#    the indexed text so stop words match everything and are dropped
+# 2. "quoted words" is a phrase, the words next to each other in order
+#    (stop words are not indexed so "lord of the rings" = "lord rings")
+# 3. "quoted words"~N is a proximity query, every word within N index
+#    tokens of the first one, on either side
+# 4. NOT binds tighter than AND which binds tighter than OR, parentheses
+#    group and words with no operator between them are OR'ed like the
+#    plain keyword search always did
+class QuerySyntaxError(ValueError):
+    pass
+
+
+# a word, phrase or proximity query over index tokens
+# slop is None for words and phrases
+@dataclass
+class Terms:
+    tokens: List[str]
+    slop: Optional[int] = None
+
+
+@dataclass
+class Not:
+    child: "Node"
+
+
+@dataclass
+class And:
+    children: List["Node"] = field(default_factory=list)
+
+
+@dataclass
+class Or:
+    children: List["Node"] = field(default_factory=list)
+
+
+Node = Union[Terms, Not, And, Or]
+
+OPERATORS = ("AND", "OR", "NOT")
+
+TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"(?:~\d+)?|"|[^\s()"]+')
+PROXIMITY_PATTERN = re.compile(r'"([^"]*)"~(\d+)')
+
+# ordinal and position packed into one sortable key, positions fit 32 bits
+POSITION_BITS = 32
+
+
+def lex(query: str) -> List[str]:
+    tokens = TOKEN_PATTERN.findall(query)
+    if '"' in tokens:
+        raise QuerySyntaxError("unterminated phrase")
+
+    return tokens
+
+
+# recursive descent over the lexed query, None when nothing in the
+# query can match (only stop words)
+def parse(query: str) -> Optional[Node]:
+    parser = Parser(lex(query))
+    if not parser.tokens:
+        return None
+
+    node = parser.parse_or()
+    if parser.pos < len(parser.tokens):
+        raise QuerySyntaxError(f"unexpected {parser.tokens[parser.pos]!r}")
+
+    return node
+
+
+class Parser:
+    def __init__(self, tokens: List[str]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    # or_expr := and_expr ([OR] and_expr)*
+    def parse_or(self) -> Optional[Node]:
+        children = [self.parse_and()]
+        while self.peek() not in (None, ")"):
+            if self.peek() == "OR":
+                self.take()
+            children.append(self.parse_and())
+
+        return combine(Or, children)
+
+    # and_expr := not_expr (AND not_expr)*
+    def parse_and(self) -> Optional[Node]:
+        children = [self.parse_not()]
+        while self.peek() == "AND":
+            self.take()
+            children.append(self.parse_not())
+
+        return combine(And, children)
+
+    # not_expr := NOT not_expr | atom
+    def parse_not(self) -> Optional[Node]:
+        if self.peek() == "NOT":
+            self.take()
+            child = self.parse_not()
+            return None if child is None else Not(child)
+
+        return self.parse_atom()
+
+    # atom := ( or_expr ) | phrase | word
+    def parse_atom(self) -> Optional[Node]:
+        token = self.peek()
+        if token is None or token in OPERATORS or token == ")":
+            raise QuerySyntaxError(
+                f"expected a word, phrase or ( but got {token or 'the end'!r}"
+            )
+
+        self.take()
+        if token == "(":
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise QuerySyntaxError("missing )")
+            self.take()
+            return node
+
+        proximity = PROXIMITY_PATTERN.fullmatch(token)
+        if proximity:
+            tokens = tokenize(proximity.group(1))
+            # a repeated word adds nothing to "within n of the first"
+            tokens = list(dict.fromkeys(tokens))
+            return Terms(tokens, int(proximity.group(2))) if tokens else None
+
+        tokens = tokenize(token.strip('"'))
+        return Terms(tokens) if tokens else None
+
+
+# drops the children that match everything (stop words), a single
+# child stands for itself
+def combine(kind: type, children: List[Optional[Node]]) -> Optional[Node]:
+    kept = [child for child in children if child is not None]
+    if not kept:
+        return None
+    if len(kept) == 1:
+        return kept[0]
+
+    return kind(kept)
+
+
+# intersection of two sorted ordinal lists, every ordinal of the
+# shorter one is binary searched in the longer one so a rare list
+# filters a common one in O(short * log(long)) without walking it
+def intersect(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    return a[b[pos] == a]
+
+
+# sorted ordinals of a that are not in b
+def difference(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if not len(a) or not len(b):
+        return a
+
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    return a[b[pos] != a]
+
+
+# evaluates a query tree into the sorted ordinals of the matching
+# documents :-
+# 1. AND intersects rarest first: the rarest word is decoded, every
+#    other word only filters the surviving candidates through the skip
+#    data of its postings (blocks that can not hold a candidate are
+#    never decoded), sub queries are intersected with intersect()
+# 2. NOT under an AND is a difference from the other children, only a
+#    NOT on its own is taken against every document
+# 3. phrases and proximity queries check the positions of candidates
+#    that hold all of their words
+class BooleanMatcher:
+    def __init__(self, postings: Postings, n_docs: int) -> None:
+        self.postings = postings
+        self.n_docs = n_docs
+
+    def match(self, node: Optional[Node]) -> np.ndarray:
+        if node is None:
+            return np.empty(0, dtype=np.int32)
+
+        if isinstance(node, Not):
+            return difference(self.everything(), self.match(node.child))
+
+        if isinstance(node, Or):
+            matches = [self.match(child) for child in node.children]
+            return np.unique(np.concatenate(matches)).astype(np.int32)
+
+        if isinstance(node, And):
+            return self.match_all(node.children)
+
+        return self.match_all([node])
+
+    # documents matching every node of an AND
+    def match_all(self, nodes: List[Node]) -> np.ndarray:
+        rows: List[int] = []
+        positional: List[Terms] = []
+        included: List[Node] = []
+        excluded: List[Node] = []
+
+        for node in nodes:
+            if isinstance(node, Not):
+                excluded.append(node.child)
+            elif isinstance(node, Terms):
+                node_rows = [self.postings.terms.get(token) for token in node.tokens]
+                if any(row is None for row in node_rows):
+                    return np.empty(0, dtype=np.int32)
+                rows.extend(row for row in node_rows if row is not None)
+                if len(node.tokens) > 1:
+                    positional.append(node)
+            else:
+                included.append(node)
+
+        candidates = self.match_rows(sorted(set(rows)))
+        for node in included:
+            if candidates is not None and not len(candidates):
+                break
+            matches = self.match(node)
+            candidates = (
+                matches if candidates is None else intersect(candidates, matches)
+            )
+
+        if candidates is None:
+            candidates = self.everything()
+
+        for node in positional:
+            candidates = self.match_positions(node, candidates)
+
+        for node in excluded:
+            if not len(candidates):
+                break
+            candidates = difference(candidates, self.match(node))
+
+        return candidates
+
+    # documents holding every row, None for no rows
+    def match_rows(self, rows: List[int]) -> Optional[np.ndarray]:
+        if not rows:
+            return None
+
+        offsets = self.postings.offsets
+        rows = sorted(rows, key=lambda row: offsets[row + 1] - offsets[row])
+        candidates = self.postings.row(rows[0])[0]
+        for row in rows[1:]:
+            if not len(candidates):
+                break
+            candidates = candidates[self.postings.contains(row, candidates)]
+
+        return candidates
+
+    # candidates where the words of a phrase (or proximity query) occur
+    # as asked, (ordinal, position) pairs are compared as packed keys
+    def match_positions(self, node: Terms, candidates: np.ndarray) -> np.ndarray:
+        keys = [
+            self.position_keys(self.postings.terms[token], candidates)
+            for token in node.tokens
+        ]
+
+        if node.slop is None:
+            # word i of the phrase sits i positions after where the
+            # phrase starts, a shared start means the phrase is there
+            starts = keys[0]
+            for offset, word_keys in enumerate(keys[1:], start=1):
+                starts = np.intersect1d(
+                    starts,
+                    word_keys - offset,
+                    assume_unique=True,
+                )
+        else:
+            # an occurrence of the first word with every other word
+            # somewhere in [position - slop, position + slop]
+            starts = keys[0]
+            for word_keys in keys[1:]:
+                pos = np.searchsorted(word_keys, starts - node.slop)
+                near = pos < len(word_keys)
+                near[near] = word_keys[pos[near]] <= starts[near] + node.slop
+                starts = starts[near]
+
+        return np.unique(starts >> POSITION_BITS).astype(np.int32)
+
+    def position_keys(self, row: int, candidates: np.ndarray) -> np.ndarray:
+        doc_ords, positions = self.postings.positions(row, candidates)
+        return (doc_ords.astype(np.int64) << POSITION_BITS) + positions
+
+    def everything(self) -> np.ndarray:
+        return np.arange(self.n_docs, dtype=np.int32)
@@ -0,0 +1,259 @@
+import mmap
+import os
+import struct
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config.data import DOC_STORE_PATH
+from lib.indexes.segment import SegmentFormatError
+from typedicts.movies import Movie
+
+
+# on-disk columnar store of the stored fields of the movies
+#
+# layout (little endian) :-
+# 1. fixed header  => magic, format version, section count, doc count
+# 2. section table => (byte offset, element count) for every section
+# 3. sections      => flat arrays, each aligned to STORE_ALIGNMENT
+#
+# titles and descriptions are utf-8 blobs cut by offsets (document
+# ordinal i owns blob[offsets[i]:offsets[i + 1]]), so opening the store
+# is an mmap and a movie's text is only decoded when it is fetched
+DOC_STORE_MAGIC = b"XUVEDOC\x00"
+DOC_STORE_VERSION = 1
+STORE_ALIGNMENT = 8
+
+DOC_STORE_SECTIONS: List[Tuple[str, np.dtype]] = [
+    ("doc_ids", np.dtype(np.int64)),
+    ("id_order", np.dtype(np.int32)),
+    ("title_offsets", np.dtype(np.int64)),
+    ("title_blob", np.dtype(np.uint8)),
+    ("description_offsets", np.dtype(np.int64)),
+    ("description_blob", np.dtype(np.uint8)),
+]
+
+# magic, version, section count, doc count
+STORE_HEADER = struct.Struct("<8sIIQ")
+STORE_ENTRY = struct.Struct("<QQ")
+STORE_TABLE_END = STORE_HEADER.size + STORE_ENTRY.size * len(DOC_STORE_SECTIONS)
+
+
+# movies by document ordinal (the order they were indexed in)
+# ids are kept as an array with their sorted order so id -> ordinal
+# is a binary search, text fields are read from the blobs on demand
+@dataclass(eq=False)
+class DocStore:
+    doc_ids: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64),
+    )
+    id_order: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int32),
+    )
+    title_offsets: np.ndarray = field(
+        default_factory=lambda: np.zeros(1, dtype=np.int64),
+    )
+    title_blob: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.uint8),
+    )
+    description_offsets: np.ndarray = field(
+        default_factory=lambda: np.zeros(1, dtype=np.int64),
+    )
+    description_blob: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.uint8),
+    )
+    # keeps the mapping alive for as long as the views are in use
+    buffer: Optional[mmap.mmap] = None
+
+    @classmethod
+    def from_movies(cls, movies: List[Movie]) -> "DocStore":
+        doc_ids = np.fromiter(
+            (int(movie["id"]) for movie in movies),
+            dtype=np.int64,
+            count=len(movies),
+        )
+        title_offsets, title_blob = pack_strings(
+            [movie.get("title", "") for movie in movies]
+        )
+        description_offsets, description_blob = pack_strings(
+            [movie.get("description", "") for movie in movies]
+        )
+
+        return cls(
+            doc_ids=doc_ids,
+            id_order=np.argsort(doc_ids, kind="stable").astype(np.int32),
+            title_offsets=title_offsets,
+            title_blob=title_blob,
+            description_offsets=description_offsets,
+            description_blob=description_blob,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self) -> Iterator[Movie]:
+        return (self.movie(doc_ord) for doc_ord in range(len(self)))
+
+    # binary search of a document id through the sorted id order
+    def ordinal(self, doc_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.doc_ids, doc_id, sorter=self.id_order))
+        if pos == len(self.doc_ids):
+            return None
+
+        doc_ord = int(self.id_order[pos])
+        return doc_ord if self.doc_ids[doc_ord] == doc_id else None
+
+    def title(self, doc_ord: int) -> str:
+        return read_string(self.title_offsets, self.title_blob, doc_ord)
+
+    def description(self, doc_ord: int) -> str:
+        return read_string(self.description_offsets, self.description_blob, doc_ord)
+
+    def movie(self, doc_ord: int) -> Movie:
+        return {
+            "id": int(self.doc_ids[doc_ord]),
+            "title": self.title(doc_ord),
+            "description": self.description(doc_ord),
+        }
+
+    def movies(self, doc_ords: List[int]) -> List[Movie]:
+        return [self.movie(doc_ord) for doc_ord in doc_ords]
+
+    # movie by id, KeyError for unknown ids
+    def get(self, doc_id: int) -> Movie:
+        doc_ord = self.ordinal(doc_id)
+        if doc_ord is None:
+            raise KeyError(f"doc with the id : {doc_id} does not exist")
+
+        return self.movie(doc_ord)
+
+    def write(self, path: str) -> None:
+        arrays = {name: getattr(self, name) for name, _ in DOC_STORE_SECTIONS}
+
+        table: List[Tuple[int, int]] = []
+        position = _aligned(STORE_TABLE_END)
+        for name, dtype in DOC_STORE_SECTIONS:
+            table.append((position, len(arrays[name])))
+            position = _aligned(position + len(arrays[name]) * dtype.itemsize)
+
+        # written next to the target and swapped in, readers that mapped
+        # the old file keep reading it
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                STORE_HEADER.pack(
+                    DOC_STORE_MAGIC,
+                    DOC_STORE_VERSION,
+                    len(DOC_STORE_SECTIONS),
+                    len(self),
+                )
+            )
+            for offset, count in table:
+                f.write(STORE_ENTRY.pack(offset, count))
+
+            for (name, dtype), (offset, _) in zip(DOC_STORE_SECTIONS, table):
+                f.write(b"\x00" * (offset - f.tell()))
+                f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+
+            f.write(b"\x00" * (position - f.tell()))
+
+        os.replace(tmp_path, path)
+
+    # maps the store, every array is a read only view into the mapping
+    @classmethod
+    def open(cls, path: str) -> "DocStore":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        arrays = map_sections(buffer)
+        return cls(**arrays, buffer=buffer)
+
+
+def _aligned(position: int) -> int:
+    return -(-position // STORE_ALIGNMENT) * STORE_ALIGNMENT
+
+
+# checks the header and section table and views every section
+def map_sections(buffer: mmap.mmap) -> Dict[str, np.ndarray]:
+    if len(buffer) < STORE_TABLE_END:
+        raise SegmentFormatError("doc store is truncated")
+
+    magic, version, section_count, n_docs = STORE_HEADER.unpack_from(buffer, 0)
+    if magic != DOC_STORE_MAGIC:
+        raise SegmentFormatError("not a doc store")
+    if version != DOC_STORE_VERSION:
+        raise SegmentFormatError(
+            f"unsupported doc store version {version}, expected {DOC_STORE_VERSION}"
+        )
+    if section_count != len(DOC_STORE_SECTIONS):
+        raise SegmentFormatError("unexpected section count")
+
+    arrays: Dict[str, np.ndarray] = {}
+    for i, (name, dtype) in enumerate(DOC_STORE_SECTIONS):
+        offset, count = STORE_ENTRY.unpack_from(
+            buffer,
+            STORE_HEADER.size + i * STORE_ENTRY.size,
+        )
+        if offset % STORE_ALIGNMENT or offset + count * dtype.itemsize > len(buffer):
+            raise SegmentFormatError(f"section {name} is out of bounds")
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+    if (
+        len(arrays["doc_ids"]) != n_docs
+        or len(arrays["id_order"]) != n_docs
+        or len(arrays["title_offsets"]) != n_docs + 1
+        or len(arrays["description_offsets"]) != n_docs + 1
+        or int(arrays["title_offsets"][-1]) != len(arrays["title_blob"])
+        or int(arrays["description_offsets"][-1]) != len(arrays["description_blob"])
+    ):
+        raise SegmentFormatError("doc store sections do not match")
+
+    return arrays
+
+
+# utf-8 blob of the strings and the offsets cutting it
+def pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [string.encode("utf-8") for string in strings]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def read_string(offsets: np.ndarray, blob: np.ndarray, doc_ord: int) -> str:
+    return blob[offsets[doc_ord] : offsets[doc_ord + 1]].tobytes().decode("utf-8")
+
+
+# structural validation of the store at path
+def validate_doc_store(path: str) -> bool:
+    try:
+        DocStore.open(path)
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+# path -> open store
+OPEN_DOC_STORES: Dict[str, DocStore] = {}
+OPEN_DOC_STORES_LOCK = threading.Lock()
+
+
+# the store of the cache, mapped once per process and shared by every
+# search engine, reopen_doc_store(path) after the file is rewritten
+def get_doc_store(path: str = DOC_STORE_PATH) -> DocStore:
+    with OPEN_DOC_STORES_LOCK:
+        store = OPEN_DOC_STORES.get(path)
+        if store is None:
+            store = OPEN_DOC_STORES[path] = DocStore.open(path)
+
+        return store
+
+
+# only the store of path is dropped, stores of other files stay mapped
+def reopen_doc_store(path: str = DOC_STORE_PATH) -> None:
+    with OPEN_DOC_STORES_LOCK:
+        OPEN_DOC_STORES.pop(path, None)
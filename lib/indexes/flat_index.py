@@ -0,0 +1,80 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from lib.indexes.top_k import top_k
+
+
+# l2 normalizes every row so cosine similarity becomes a dot product
+# zero rows stay zero and therefore score 0 against any query
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    return np.divide(
+        vectors,
+        norms,
+        out=np.zeros_like(vectors),
+        where=norms > 0,
+    )
+
+
+def unit_rows(vectors: np.ndarray, normalized: bool) -> np.ndarray:
+    if normalized and vectors.dtype == np.float32:
+        return vectors
+
+    return normalize_rows(vectors)
+
+
+# exact cosine search over a matrix of embeddings
+# rows are normalized once when the index is created, a query is
+# then one matrix-vector product plus a partial sort for the top-k
+class FlatIndex:
+    # normalized=True keeps already unit length float32 rows as they are,
+    # a read-only memmap then stays shared with every other process that
+    # maps the same file instead of being copied into this one
+    def __init__(self, vectors: np.ndarray, normalized: bool = False) -> None:
+        self.vectors: np.ndarray = unit_rows(vectors, normalized)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if not len(self.vectors) or not query_embedding.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = self.vectors @ normalize_rows(query_embedding)
+
+        return top_k(
+            np.arange(len(scores)),
+            scores,
+            limit,
+        )
+
+    # one (queries x embeddings) matrix product for a batch of queries
+    # all zero query rows (empty queries) get no results like search
+    def search_many(
+        self,
+        query_embeddings: np.ndarray,
+        limit: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if not len(self.vectors) or not query_embeddings.size:
+            return [
+                (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+                for _ in range(len(query_embeddings))
+            ]
+
+        scores = normalize_rows(query_embeddings) @ self.vectors.T
+        doc_idxs = np.arange(len(self.vectors))
+
+        return [
+            top_k(doc_idxs, query_scores, limit if has_query else 0)
+            for query_scores, has_query in zip(
+                scores,
+                np.any(query_embeddings != 0, axis=1),
+            )
+        ]
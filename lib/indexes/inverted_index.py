@@ -1,88 +1,202 @@
-import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Counter, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass
+from typing import Counter, Dict, List, Optional, Set, Tuple
 
-from nltk import defaultdict
+import numpy as np
 
 from config.data import (
-    AVG_DOC_LENGTH,
+    BATCH_SEARCH_SIZE,
     BM25_B,
+    BM25_BLOCK_SIZE,
     BM25_K1,
+    BM25_PRUNING_MIN_DOCS,
     CACHE_DIR_PATH,
-    DOC_LENGTH_PATH,
-    EXPECTED_CACHE_DIR_FILES,
-    INDEX_CACHE_PATH,
-    TERM_FREQUENCIES_PATH,
+    DEFAULT_SEARCH_LIMIT,
+    DOC_STORE_PATH,
+    INDEX_BUILD_PROCESSES,
+    INDEX_BUILD_SHARD_SIZE,
+    INDEX_SEGMENT_PATH,
 )
 from decors.handle_file_errors import handle_file_errors, raise_error
-from lib.tokenize import tokenize
-from typedicts.files_to_write import CacheFilesToWrite
+from lib.clean_str import clean_words
+from lib.indexes.boolean_query import BooleanMatcher
+from lib.indexes.boolean_query import parse as parse_query
+from lib.indexes.block_max import BlockMaxIndex, block_max_top_k, build_block_max
+from lib.indexes.doc_store import DocStore, get_doc_store, reopen_doc_store
+from lib.indexes.postings import (
+    Postings,
+    bm25_idf,
+    bm25_tf,
+    exhaustive_top_k,
+    exhaustive_top_k_many,
+    postings_from_triples,
+)
+from lib.indexes.segment import Segment, SegmentStats, open_segment, write_segment
+from lib.indexes.term_table import SortedTermTable
+from lib.parallel import parallel_map
+from lib.tokenize import tokenize, tokenize_many
 from typedicts.movies import Movie
 
 
 class InvertedIndex:
     def __init__(self) -> None:
-        # index
-        self.index: Dict[str, Set[int]] = {}
-        # document map
-        self.docmap: Dict[int, Movie] = {}
-        # term frequencies
-        self.term_frequencies: Dict[int, Counter] = defaultdict(Counter)
+        # stored fields, read only for the results that are returned
+        self.docs: DocStore = DocStore()
+        # document ordinal -> document id
+        self.doc_ids: np.ndarray = np.empty(0, dtype=np.int64)
+        # ordinals sorted by document id, for id -> ordinal lookups
+        self.doc_id_order: np.ndarray = np.empty(0, dtype=np.int32)
+
+        # compressed postings, bm25 impacts are computed when decoded
+        self.postings: Postings = Postings()
+        # bm25 constants the impacts were computed with
+        self.k1: float = BM25_K1
+        self.b: float = BM25_B
+        # per term and per block max impacts for pruning
+        self.block_max: BlockMaxIndex = BlockMaxIndex()
 
         # is cache loaded status
         self.is_loaded: bool = False
 
-        # document lengths mapped to document ids
-        self.doc_lengths: Dict[int, int] = defaultdict(int)
+        # document lengths indexed by document ordinal
+        self.doc_lengths: np.ndarray = np.empty(0, dtype=np.int32)
 
         self.avg_doc_length: float = 0.0
 
-    def bm25_search(self, query: str, limit: int) -> List[Tuple[int, str, float]]:
-        tokenized_query = tokenize(query)
-        scores: Dict[int, float] = defaultdict(float)
+        # mapped segment backing the arrays above once loaded
+        self.segment: Optional[Segment] = None
+
+    # bm25 top-k search over the impact postings
+    # exhaustive=True scores every posting of every query term, False
+    # skips blocks of documents that can not make it into the top-k
+    # (block-max pruning), both return identical results and by default
+    # indexes of fewer than BM25_PRUNING_MIN_DOCS documents are exhaustive
+    def bm25_search(
+        self,
+        query: str,
+        limit: int,
+        exhaustive: Optional[bool] = None,
+    ) -> List[Tuple[int, str, float]]:
+        return self.__titled(*self.__top_k(query, limit, exhaustive))
+
+    # bm25_search without the titles: (doc id, score) pairs, for
+    # fusing long candidate lists without touching the stored fields
+    def bm25_rank(
+        self,
+        query: str,
+        limit: int,
+        exhaustive: Optional[bool] = None,
+    ) -> List[Tuple[int, float]]:
+        ranked_ords, ranked_scores = self.__top_k(query, limit, exhaustive)
+        return list(
+            zip(self.doc_ids[ranked_ords].tolist(), ranked_scores.tolist()),
+        )
+
+    def __top_k(
+        self,
+        query: str,
+        limit: int,
+        exhaustive: Optional[bool],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        query_rows = self.__query_rows(query)
+
+        if exhaustive is None:
+            exhaustive = len(self.doc_ids) < BM25_PRUNING_MIN_DOCS
 
-        for doc_id in self.docmap.keys():
-            current_score = 0.0
-            for token in tokenized_query:
-                current_score += self.bm25(doc_id, token)
+        if exhaustive:
+            return exhaustive_top_k(self.postings, query_rows, limit)
 
-            scores[doc_id] = current_score
+        return block_max_top_k(self.postings, self.block_max, query_rows, limit)
 
-        # returning ranked docs with limit
-        ranked_res = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+    # (doc id, title, score) of ranked ordinals
+    def __titled(
+        self,
+        ranked_ords: np.ndarray,
+        ranked_scores: np.ndarray,
+    ) -> List[Tuple[int, str, float]]:
         return [
-            (
-                doc_id,
-                self.docmap[doc_id]["title"],
-                score,
+            (doc_id, self.docs.title(doc_ord), score)
+            for doc_ord, doc_id, score in zip(
+                ranked_ords.tolist(),
+                self.doc_ids[ranked_ords].tolist(),
+                ranked_scores.tolist(),
             )
-            for doc_id, score in ranked_res
+        ]
+
+    # bm25 search for many queries at once, postings of a term shared
+    # by several queries of a batch are traversed once for all of them
+    # results match bm25_search query for query
+    def bm25_search_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int = BATCH_SEARCH_SIZE,
+    ) -> List[List[Tuple[int, str, float]]]:
+        return [
+            self.__titled(ranked_ords, ranked_scores)
+            for ranked_ords, ranked_scores in self.__top_k_many(
+                queries,
+                limit,
+                batch_size,
+            )
+        ]
+
+    # batch bm25_rank
+    def bm25_rank_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int = BATCH_SEARCH_SIZE,
+    ) -> List[List[Tuple[int, float]]]:
+        return [
+            list(zip(self.doc_ids[ranked_ords].tolist(), ranked_scores.tolist()))
+            for ranked_ords, ranked_scores in self.__top_k_many(
+                queries,
+                limit,
+                batch_size,
+            )
+        ]
+
+    def __top_k_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        queries_rows = [self.__query_rows(query) for query in queries]
+
+        ranked: List[Tuple[np.ndarray, np.ndarray]] = []
+        for start in range(0, len(queries_rows), batch_size):
+            ranked.extend(
+                exhaustive_top_k_many(
+                    self.postings,
+                    queries_rows[start : start + batch_size],
+                    limit,
+                    len(self.doc_ids),
+                )
+            )
+
+        return ranked
+
+    # tokenizes the query once and maps every distinct
+    # term present in the index to (postings row, query tf)
+    def __query_rows(self, query: str) -> List[Tuple[int, int]]:
+        return [
+            (self.postings.terms[term], query_tf)
+            for term, query_tf in Counter(tokenize(query)).items()
+            if term in self.postings.terms
         ]
 
     def bm25(self, doc_id: int, term: str) -> float:
-        return self.get_bm25_tf(doc_id, term) * self.get_bm25_idf(
-            term,
-        )
+        token = self.__single_token(term)
+        return self.__bm25_tf(doc_id, token) * self.__bm25_idf(token)
 
     # method to get the BM25 IDF for a term
     #  handles more cases then normal IDF
     # and this one is  (recommended)
     def get_bm25_idf(self, term: str) -> float:
-        tokenized_term = tokenize(term)
-        if len(tokenized_term) != 1:
-            raise ValueError(
-                "term must be a single token",
-            )
-
-        df = len(self.get_doc_ids(tokenized_term[0]))
-        total_docs = len(self.docmap)
-
-        import math
-
-        # bm25 idf formula
-        return math.log(
-            (total_docs - df + 0.5) / (df + 0.5) + 1,
+        return self.__bm25_idf(
+            self.__single_token(term),
         )
 
     # method to get bm25tf which handles term saturation
@@ -95,54 +209,86 @@ class InvertedIndex:
         k1: float = BM25_K1,
         b: float = BM25_B,
     ) -> float:
-        raw_term_freq = self.get_token_frequencies(
+        return self.__bm25_tf(
             doc_id,
-            term,
+            self.__single_token(term),
+            k1,
+            b,
         )
 
-        doc_len = self.doc_lengths.get(doc_id)
-        if doc_len is None:
-            raise KeyError(f"doc with the id : {doc_id} does not exist")
-
-        doc_length_normalization = 1 - b + b * (doc_len / self.avg_doc_length)
+    # tokenizes a user supplied term and makes sure
+    # it maps to exactly one index token
+    @staticmethod
+    def __single_token(term: str) -> str:
+        tokenized_term = tokenize(term)
+        if len(tokenized_term) != 1:
+            raise ValueError(
+                "term must be a single token",
+            )
+        return tokenized_term[0]
+
+    # bm25 idf for an already tokenized term
+    def __bm25_idf(self, token: str) -> float:
+        return float(
+            bm25_idf(
+                np.float64(self.postings.doc_freq(token)),
+                len(self.doc_ids),
+            )
+        )
 
-        return (raw_term_freq * (k1 + 1)) / (
-            raw_term_freq + k1 * doc_length_normalization
+    # bm25 tf for an already tokenized term
+    def __bm25_tf(
+        self,
+        doc_id: int,
+        token: str,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> float:
+        doc_ord = self.__doc_ordinal(doc_id)
+
+        return float(
+            bm25_tf(
+                np.float64(self.postings.term_freq(token, doc_ord)),
+                np.float64(self.doc_lengths[doc_ord]),
+                self.avg_doc_length,
+                k1,
+                b,
+            )
         )
 
-    # method to add documents to the structures we are playing with
-    def __add_document(self, doc_id: int, text: str):
-        tokenized_text = tokenize(text)
+    def __doc_ordinal(self, doc_id: int) -> int:
+        doc_ord = self.get_doc_ordinal(doc_id)
+        if doc_ord is None:
+            raise KeyError(f"doc with the id : {doc_id} does not exist")
 
-        self.doc_lengths[doc_id] = len(tokenized_text)
+        return doc_ord
 
-        for token in set(tokenized_text):
-            self.index.setdefault(
-                token,
-                set(),
-            )
-            self.index[token].add(doc_id)
+    # binary search of a document id through the sorted id order
+    def get_doc_ordinal(self, doc_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.doc_ids, doc_id, sorter=self.doc_id_order))
+        if pos == len(self.doc_ids):
+            return None
 
-        self.term_frequencies.setdefault(doc_id, Counter())
-        self.term_frequencies[doc_id].update(
-            tokenized_text,
-        )
+        doc_ord = int(self.doc_id_order[pos])
+        return doc_ord if self.doc_ids[doc_ord] == doc_id else None
 
     def get_token_frequencies(self, doc_id: int, text: str) -> int:
-        tokens = tokenize(text)
-        if len(tokens) != 1:
-            raise ValueError(
-                "term must be a single token",
-            )
-        return self.term_frequencies.get(
-            doc_id,
-            Counter(),
-        ).get(tokens[0], 0)
+        doc_ord = self.get_doc_ordinal(doc_id)
+        if doc_ord is None:
+            return 0
+
+        return self.postings.term_freq(
+            self.__single_token(text),
+            doc_ord,
+        )
+
+    def get_doc_freq(self, term: str) -> int:
+        return self.postings.doc_freq(term)
 
     def get_doc_ids(self, term: str) -> Set[int]:
-        return self.index.get(
-            term,
-            set(),
+        doc_ords, _, _ = self.postings.get(term)
+        return set(
+            self.doc_ids[doc_ords].tolist(),
         )
 
     def get_documents(
@@ -150,29 +296,250 @@ class InvertedIndex:
         term: str,
         limit: Optional[int] = 5,
     ) -> List[Movie]:
-        doc_ids = self.get_doc_ids(term)
-        docs = [self.docmap[doc_id] for doc_id in list(doc_ids)[:limit]]
+        doc_ords, _, _ = self.postings.get(term)
+        return self.docs.movies(doc_ords[:limit].tolist())
 
-        if limit is None:
-            return docs
+    # movies matching a boolean query (AND / OR / NOT, "phrases" and
+    # "proximity"~N, see boolean_query.py) in catalogue order, an exact
+    # filter so nothing is scored
+    def boolean_search(
+        self,
+        query: str,
+        limit: Optional[int] = DEFAULT_SEARCH_LIMIT,
+    ) -> List[Movie]:
+        doc_ords = BooleanMatcher(self.postings, len(self.doc_ids)).match(
+            parse_query(query),
+        )
+        return self.docs.movies(doc_ords[:limit].tolist())
 
-        return docs[:limit]
+    # index terms starting with prefix and their document frequencies,
+    # most frequent first (for autocomplete), terms are stems so the
+    # prefix is only cleaned, a partial word is not stemmed
+    def complete(
+        self,
+        prefix: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+    ) -> List[Tuple[str, int]]:
+        words = clean_words(prefix)
+        if len(words) != 1:
+            return []
+
+        rows = self.postings.terms.prefix_rows(words[0])
+        doc_freqs = np.diff(self.postings.offsets[rows.start : rows.stop + 1])
+        top = np.argsort(-doc_freqs, kind="stable")[:limit]
+
+        return [
+            (self.postings.terms.term(rows.start + pos), int(doc_freqs[pos]))
+            for pos in top.tolist()
+        ]
 
     # Builder
-    def build(self, movies: List[Movie]) -> None:
+    # movies are tokenized in shards by a pool of processes (see
+    # tokenize_movies), the result does not depend on the pool size
+    def build(
+        self,
+        movies: List[Movie],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        block_size: int = BM25_BLOCK_SIZE,
+        processes: int = INDEX_BUILD_PROCESSES,
+    ) -> None:
         print("Building index.....")
 
-        for movie in movies:
-            movie_id = int(movie["id"])
-            self.docmap[movie_id] = movie
-            self.__add_document(
-                movie_id, f"{movie.get('title')} {movie.get('description')}"
-            )
+        terms, rows, doc_ords, tfs, positions, doc_lengths = tokenize_movies(
+            movies,
+            processes,
+        )
+
+        self.k1, self.b = k1, b
+        self.__set_documents(movies, doc_lengths)
+        self.__set_postings(
+            postings_from_triples(
+                terms.tolist(),
+                rows,
+                doc_ords,
+                tfs,
+                positions,
+                self.doc_lengths,
+                k1,
+                b,
+            ),
+            block_size,
+        )
 
         print("Index built.....")
 
+    # incremental build on top of the loaded index
+    # reuse[new_ord] is the current ordinal of a movie whose content did
+    # not change (or -1), the postings and length of those movies are
+    # carried over from the index as they are and only added or changed
+    # movies are tokenized, movies missing from `movies` are dropped
+    # the result is identical to build(movies)
+    def update(
+        self,
+        movies: List[Movie],
+        reuse: np.ndarray,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        block_size: int = BM25_BLOCK_SIZE,
+    ) -> None:
+        print("Updating index.....")
+
+        kept = np.flatnonzero(reuse >= 0)
+        old_to_new = np.full(len(self.doc_ids), -1, dtype=np.int64)
+        old_to_new[reuse[kept]] = kept
+
+        # postings of unchanged documents, renumbered to the new ordinals
+        old_rows = np.repeat(
+            np.arange(len(self.postings), dtype=np.int64),
+            np.diff(self.postings.offsets),
+        )
+        old_doc_ords, old_tfs, _ = self.postings.flat()
+        old_positions = self.postings.flat_positions()
+        old_new_ords = old_to_new[old_doc_ords]
+        keep = old_new_ords >= 0
+
+        doc_lengths = np.zeros(len(movies), dtype=np.int32)
+        doc_lengths[kept] = self.doc_lengths[reuse[kept]]
+
+        # postings of added and changed documents
+        added = np.flatnonzero(reuse < 0)
+        (
+            new_terms,
+            added_rows,
+            added_ords,
+            added_tfs,
+            added_positions,
+            added_lengths,
+        ) = tokenize_movies([movies[doc_ord] for doc_ord in added.tolist()])
+        doc_lengths[added] = added_lengths
+
+        # numpy orders unicode by code point like sorted() does
+        old_terms = np.array(list(self.postings.terms), dtype=str)
+        vocabulary = np.union1d(old_terms, new_terms)
+
+        self.k1, self.b = k1, b
+        self.__set_documents(movies, doc_lengths)
+        self.__set_postings(
+            postings_from_triples(
+                vocabulary.tolist(),
+                np.concatenate(
+                    (
+                        np.searchsorted(vocabulary, old_terms)[old_rows[keep]],
+                        np.searchsorted(vocabulary, new_terms)[added_rows],
+                    )
+                ),
+                np.concatenate((old_new_ords[keep], added[added_ords])),
+                np.concatenate((old_tfs[keep], added_tfs)),
+                np.concatenate(
+                    (old_positions[np.repeat(keep, old_tfs)], added_positions)
+                ),
+                self.doc_lengths,
+                k1,
+                b,
+            ),
+            block_size,
+        )
+
+        # the arrays no longer point into the mapped segment
+        self.segment = None
+
+        print("Index updated.....")
+
+    # one index holding the live documents of several indexes, in order
+    # postings are renumbered and merged without tokenizing anything
+    # parts are (index, live mask over its ordinals) pairs
+    @classmethod
+    def merged(
+        cls,
+        parts: List[Tuple["InvertedIndex", np.ndarray]],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        block_size: int = BM25_BLOCK_SIZE,
+    ) -> "InvertedIndex":
+        movies: List[Movie] = []
+        doc_lengths: List[np.ndarray] = []
+        terms: List[np.ndarray] = []
+        rows: List[np.ndarray] = []
+        doc_ords: List[np.ndarray] = []
+        tfs: List[np.ndarray] = []
+        positions: List[np.ndarray] = []
+
+        for index, live in parts:
+            old_to_new = np.full(len(index.doc_ids), -1, dtype=np.int64)
+            old_to_new[live] = len(movies) + np.arange(np.count_nonzero(live))
+
+            movies.extend(index.docs.movies(np.flatnonzero(live).tolist()))
+            doc_lengths.append(index.doc_lengths[live])
+
+            part_rows = np.repeat(
+                np.arange(len(index.postings), dtype=np.int64),
+                np.diff(index.postings.offsets),
+            )
+            part_doc_ords, part_tfs, _ = index.postings.flat()
+            new_ords = old_to_new[part_doc_ords]
+            keep = new_ords >= 0
+
+            terms.append(np.array(list(index.postings.terms), dtype=str))
+            rows.append(part_rows[keep])
+            doc_ords.append(new_ords[keep])
+            tfs.append(part_tfs[keep])
+            positions.append(
+                index.postings.flat_positions()[np.repeat(keep, part_tfs)]
+            )
+
+        vocabulary = np.unique(np.concatenate(terms or [np.array([], dtype=str)]))
+
+        merged = cls()
+        merged.k1, merged.b = k1, b
+        merged.__set_documents(
+            movies,
+            np.concatenate(doc_lengths).astype(np.int32)
+            if doc_lengths
+            else np.empty(0, dtype=np.int32),
+        )
+        merged.__set_postings(
+            postings_from_triples(
+                vocabulary.tolist(),
+                np.concatenate(
+                    [
+                        np.searchsorted(vocabulary, part_terms)[part_rows]
+                        for part_terms, part_rows in zip(terms, rows)
+                    ]
+                    or [np.empty(0, dtype=np.int64)]
+                ),
+                np.concatenate(doc_ords or [np.empty(0, dtype=np.int64)]),
+                np.concatenate(tfs or [np.empty(0, dtype=np.int32)]),
+                np.concatenate(positions or [np.empty(0, dtype=np.int32)]),
+                merged.doc_lengths,
+                k1,
+                b,
+            ),
+            block_size,
+        )
+
+        return merged
+
+    def __set_documents(self, movies: List[Movie], doc_lengths: np.ndarray) -> None:
+        self.docs = DocStore.from_movies(movies)
+        self.doc_ids = self.docs.doc_ids
+        self.doc_id_order = self.docs.id_order
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = self.calc_avg_doclen()
+
+    def __set_postings(self, postings: Postings, block_size: int) -> None:
+        self.postings = postings
+        self.block_max = build_block_max(
+            self.postings,
+            len(self.doc_ids),
+            block_size,
+        )
+
     def calc_avg_doclen(self) -> float:
-        return sum(self.doc_lengths.values()) / len(self.doc_lengths)
+        if not len(self.doc_lengths):
+            return 0.0
+
+        return float(self.doc_lengths.mean())
 
     def get_avg_doc_len(self) -> float:
         if not self.avg_doc_length:
@@ -181,84 +548,205 @@ class InvertedIndex:
         return self.calc_avg_doclen()
 
     # Save method
+    # the whole index goes out as one binary segment (see segment.py)
+    # and the stored fields as a doc store next to it (see doc_store.py)
     @handle_file_errors(custom_handlers=None)
-    def save(self, cache_path: str = CACHE_DIR_PATH) -> None:
-        import json
-
+    def save(
+        self,
+        cache_path: str = CACHE_DIR_PATH,
+        segment_path: str = INDEX_SEGMENT_PATH,
+        docs_path: str = DOC_STORE_PATH,
+    ) -> None:
         print("Saving index to path...")
 
         os.makedirs(cache_path, exist_ok=True)
 
-        files_to_be_written: List[CacheFilesToWrite] = [
-            {
-                "path": INDEX_CACHE_PATH,
-                "data": {
-                    "index": {token: list(ids) for token, ids in self.index.items()},
-                    "docmap": self.docmap,
-                },
-            },
-            {"path": TERM_FREQUENCIES_PATH, "data": self.term_frequencies},
-            {"path": DOC_LENGTH_PATH, "data": self.doc_lengths},
+        self.docs.write(docs_path)
+        reopen_doc_store(docs_path)
+
+        write_segment(
+            segment_path,
+            SegmentStats(
+                n_docs=len(self.doc_ids),
+                k1=self.k1,
+                b=self.b,
+                avg_doc_length=self.calc_avg_doclen(),
+                block_size=self.block_max.block_size,
+                postings_block_size=self.postings.block_size,
+            ),
             {
-                "path": AVG_DOC_LENGTH,
-                "data": {"value": self.calc_avg_doclen()},
+                "term_blob": self.postings.terms.blob,
+                "term_offsets": self.postings.terms.offsets,
+                "offsets": self.postings.offsets,
+                "term_blocks": self.postings.term_blocks,
+                "block_first": self.postings.block_first,
+                "block_data": self.postings.block_data,
+                "block_ord_bits": self.postings.block_ord_bits,
+                "block_tf_bits": self.postings.block_tf_bits,
+                "postings_data": self.postings.data,
+                "block_pos_data": self.postings.block_pos_data,
+                "block_pos_bits": self.postings.block_pos_bits,
+                "positions_data": self.postings.positions_data,
+                "doc_ids": self.doc_ids,
+                "doc_id_order": self.doc_id_order,
+                "doc_lengths": self.doc_lengths,
+                "term_max": self.block_max.term_max,
+                "block_offsets": self.block_max.block_offsets,
+                "block_ids": self.block_max.block_ids,
+                "block_maxes": self.block_max.block_maxes,
             },
-        ]
-
-        for file in files_to_be_written:
-            with open(file.get("path"), "w", encoding="utf-8") as f:
-                json.dump(
-                    file.get("data"),
-                    f,
-                    ensure_ascii=False,
-                    indent=2,
-                )
+        )
 
         print("Index saved to path...")
 
-    @staticmethod
-    def load_file(file_path: str) -> Tuple[str, Any]:
-        with open(file_path, "r") as f:
-            data = json.load(f)
-
-        return file_path, data
-
+    # maps the segment, every array below is a read only view into
+    # the mapping so nothing is parsed or copied up front
+    # docs are the stored fields of the segment (the shared doc store of
+    # the cache by default)
     @handle_file_errors({FileNotFoundError: raise_error})
-    def load(self) -> None:
-        """Load all cache files concurrently."""
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(self.load_file, f) for f in EXPECTED_CACHE_DIR_FILES
-            ]
-
-            for future in as_completed(futures):
-                file_path, data = future.result()
-
-                if os.path.samefile(
-                    file_path,
-                    INDEX_CACHE_PATH,
-                ):
-                    self.index = {
-                        token: set(ids) for token, ids in data["index"].items()
-                    }
-                    self.docmap = {int(k): v for k, v in data["docmap"].items()}
-                elif os.path.samefile(
-                    file_path,
-                    TERM_FREQUENCIES_PATH,
-                ):
-                    self.term_frequencies = {
-                        int(k): Counter(v) for k, v in data.items()
-                    }
-                elif os.path.samefile(
-                    file_path,
-                    DOC_LENGTH_PATH,
-                ):
-                    self.doc_lengths = {int(k): int(v) for k, v in data.items()}
-                elif os.path.samefile(
-                    file_path,
-                    AVG_DOC_LENGTH,
-                ):
-                    self.avg_doc_length = data["value"]
+    def load(
+        self,
+        segment_path: str = INDEX_SEGMENT_PATH,
+        docs: Optional[DocStore] = None,
+    ) -> None:
+        segment = open_segment(segment_path)
+        arrays = segment.arrays
+
+        self.segment = segment
+        self.postings = Postings(
+            terms=SortedTermTable(arrays["term_blob"], arrays["term_offsets"]),
+            offsets=arrays["offsets"],
+            term_blocks=arrays["term_blocks"],
+            block_first=arrays["block_first"],
+            block_data=arrays["block_data"],
+            block_ord_bits=arrays["block_ord_bits"],
+            block_tf_bits=arrays["block_tf_bits"],
+            data=arrays["postings_data"],
+            block_pos_data=arrays["block_pos_data"],
+            block_pos_bits=arrays["block_pos_bits"],
+            positions_data=arrays["positions_data"],
+            doc_lengths=arrays["doc_lengths"],
+            avg_doc_length=segment.stats.avg_doc_length,
+            k1=segment.stats.k1,
+            b=segment.stats.b,
+            block_size=segment.stats.postings_block_size,
+        )
+        self.doc_ids = arrays["doc_ids"]
+        self.doc_id_order = arrays["doc_id_order"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.avg_doc_length = segment.stats.avg_doc_length
+        self.k1, self.b = segment.stats.k1, segment.stats.b
+        self.block_max = BlockMaxIndex(
+            block_size=segment.stats.block_size,
+            n_blocks=-(-segment.stats.n_docs // segment.stats.block_size),
+            term_max=arrays["term_max"],
+            block_offsets=arrays["block_offsets"],
+            block_ids=arrays["block_ids"],
+            block_maxes=arrays["block_maxes"],
+        )
+
+        # stored fields are not part of the segment
+        self.docs = get_doc_store() if docs is None else docs
 
         self.is_loaded = True
         print("Index loaded successfully!")
+
+
+# postings of a run of consecutive movies with run local ordinals
+# rows point into terms (the distinct tokens of the run, unsorted) and
+# positions holds the tf token offsets of every posting in order
+@dataclass
+class ShardPostings:
+    terms: np.ndarray
+    rows: np.ndarray
+    doc_ords: np.ndarray
+    tfs: np.ndarray
+    positions: np.ndarray
+    doc_lengths: np.ndarray
+
+
+# the text of a movie that is tokenized into the index
+def index_text(movie: Movie) -> str:
+    return f"{movie.get('title')} {movie.get('description')}"
+
+
+# tokenizes one shard of movie texts (pool worker)
+def tokenize_shard(texts: List[str]) -> ShardPostings:
+    terms: Dict[str, int] = {}
+    rows: List[int] = []
+    doc_ords: List[int] = []
+    tfs: List[int] = []
+    positions: List[int] = []
+    doc_lengths: List[int] = []
+
+    for doc_ord, tokenized_text in enumerate(tokenize_many(texts)):
+        doc_lengths.append(len(tokenized_text))
+
+        # token -> its offsets in the text, in order of first occurrence
+        token_positions: Dict[str, List[int]] = {}
+        for position, token in enumerate(tokenized_text):
+            token_positions.setdefault(token, []).append(position)
+
+        for token, offsets in token_positions.items():
+            rows.append(terms.setdefault(token, len(terms)))
+            doc_ords.append(doc_ord)
+            tfs.append(len(offsets))
+            positions.extend(offsets)
+
+    return ShardPostings(
+        terms=np.array(list(terms), dtype=str),
+        rows=np.asarray(rows, dtype=np.int64),
+        doc_ords=np.asarray(doc_ords, dtype=np.int64),
+        tfs=np.asarray(tfs, dtype=np.int32),
+        positions=np.asarray(positions, dtype=np.int32),
+        doc_lengths=np.asarray(doc_lengths, dtype=np.int32),
+    )
+
+
+# tokenizes movies in shards of shard_size consecutive movies spread
+# over a pool of processes and merges the shards in movie order
+# returns the sorted vocabulary and the (term row, doc ordinal, tf)
+# triples over it, their positions and the document lengths, ready for
+# postings_from_triples which orders the postings, so the merge is
+# deterministic whatever the number of processes
+def tokenize_movies(
+    movies: List[Movie],
+    processes: int = INDEX_BUILD_PROCESSES,
+    shard_size: int = INDEX_BUILD_SHARD_SIZE,
+) -> Tuple[
+    np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray
+]:
+    shard_texts = [
+        [index_text(movie) for movie in movies[start : start + shard_size]]
+        for start in range(0, len(movies), shard_size)
+    ]
+    shards = list(
+        parallel_map(tokenize_shard, shard_texts, processes, len(shard_texts))
+    )
+
+    # numpy orders unicode by code point like sorted() does
+    vocabulary = np.unique(
+        np.concatenate([shard.terms for shard in shards] or [np.array([], dtype=str)])
+    )
+
+    starts = np.cumsum([0] + [len(texts) for texts in shard_texts])
+    return (
+        vocabulary,
+        np.concatenate(
+            [np.searchsorted(vocabulary, shard.terms)[shard.rows] for shard in shards]
+            or [np.empty(0, dtype=np.int64)]
+        ),
+        np.concatenate(
+            [shard.doc_ords + start for shard, start in zip(shards, starts)]
+            or [np.empty(0, dtype=np.int64)]
+        ),
+        np.concatenate(
+            [shard.tfs for shard in shards] or [np.empty(0, dtype=np.int32)]
+        ),
+        np.concatenate(
+            [shard.positions for shard in shards] or [np.empty(0, dtype=np.int32)]
+        ),
+        np.concatenate(
+            [shard.doc_lengths for shard in shards] or [np.empty(0, dtype=np.int32)]
+        ),
+    )
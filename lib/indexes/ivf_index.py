@@ -0,0 +1,209 @@
+import math
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config.data import (
+    IVF_KMEANS_ITERATIONS,
+    IVF_NPROBE,
+    IVF_TRAIN_POINTS_PER_LIST,
+)
+from lib.indexes.flat_index import normalize_rows, unit_rows
+from lib.indexes.top_k import top_k
+
+
+IVF_FORMAT_VERSION = 1
+
+# rows scored per matrix product while assigning vectors to lists
+ASSIGN_CHUNK_SIZE = 8192
+
+
+# inverted file index for approximate cosine search
+# the normalized vectors are clustered with spherical k-means and every
+# vector is filed under its closest centroid :-
+# 1. centroids    => (n_lists x dim) unit vectors
+# 2. list_ids     => vector ordinals grouped by list
+# 3. list_offsets => list i is list_ids[list_offsets[i]:list_offsets[i + 1]]
+# a query only scans the nprobe lists whose centroids are closest to it,
+# nprobe = n_lists is an exact (flat) search
+class IVFIndex:
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = IVF_NPROBE,
+        normalized: bool = False,
+    ) -> None:
+        self.vectors: np.ndarray = unit_rows(vectors, normalized)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        # recall / latency knob, more probed lists => more vectors scanned
+        self.nprobe = nprobe
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: Optional[int] = None,
+        nprobe: int = IVF_NPROBE,
+        seed: int = 0,
+        normalized: bool = False,
+    ) -> "IVFIndex":
+        vectors = unit_rows(vectors, normalized)
+        n_lists = max(1, min(n_lists or default_n_lists(len(vectors)), len(vectors)))
+
+        centroids = train_centroids(vectors, n_lists, seed)
+        assignments = assign_lists(vectors, centroids)
+
+        list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(assignments, minlength=len(centroids)),
+            out=list_offsets[1:],
+        )
+
+        return cls(
+            vectors,
+            centroids,
+            list_offsets,
+            np.argsort(assignments, kind="stable").astype(np.int64),
+            nprobe,
+            normalized=True,
+        )
+
+    def save(self, path: str) -> None:
+        # np.savez appends .npz to paths without it, write next to the
+        # target and swap it in like the index segment
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.int64(IVF_FORMAT_VERSION),
+            n_vectors=np.int64(len(self.vectors)),
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+        )
+        os.replace(tmp_path, path)
+
+    # raises ValueError when the file was built for other vectors
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        vectors: np.ndarray,
+        nprobe: int = IVF_NPROBE,
+        normalized: bool = False,
+    ) -> "IVFIndex":
+        with np.load(path) as data:
+            if int(data["version"]) != IVF_FORMAT_VERSION:
+                raise ValueError(f"unsupported ivf index version in {path}")
+            if int(data["n_vectors"]) != len(vectors):
+                raise ValueError(f"ivf index {path} is stale, rebuild the cache")
+
+            return cls(
+                vectors,
+                data["centroids"],
+                data["list_offsets"],
+                data["list_ids"],
+                nprobe,
+                normalized,
+            )
+
+    # ordinals of every vector filed under the nprobe closest lists
+    def candidates(self, query_embedding: np.ndarray) -> np.ndarray:
+        centroid_scores = self.centroids @ query_embedding
+        nprobe = min(max(self.nprobe, 1), self.n_lists)
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        return np.concatenate(
+            [
+                self.list_ids[self.list_offsets[lst] : self.list_offsets[lst + 1]]
+                for lst in probed.tolist()
+            ]
+        )
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if not len(self.vectors) or not query_embedding.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query_embedding = normalize_rows(query_embedding)
+        ids = self.candidates(query_embedding)
+
+        return top_k(ids, self.vectors[ids] @ query_embedding, limit)
+
+    # candidate sets differ per query so only the normalization is shared
+    def search_many(
+        self,
+        query_embeddings: np.ndarray,
+        limit: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        normalized = normalize_rows(query_embeddings)
+
+        return [
+            self.search(query, limit if has_query else 0)
+            for query, has_query in zip(
+                normalized,
+                np.any(query_embeddings != 0, axis=1),
+            )
+        ]
+
+
+# the usual sqrt(n) sized lists keep probing and scanning balanced
+def default_n_lists(n_vectors: int) -> int:
+    return max(1, min(n_vectors, round(4 * math.sqrt(n_vectors))))
+
+
+# closest centroid of every row (cosine, both sides normalized)
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = vectors[start : start + ASSIGN_CHUNK_SIZE]
+        assignments[start : start + len(chunk)] = np.argmax(
+            chunk @ centroids.T,
+            axis=1,
+        )
+
+    return assignments
+
+
+# spherical k-means on a sample of the vectors, lists that end up
+# empty are re-seeded with random sample points
+def train_centroids(vectors: np.ndarray, n_lists: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if not len(vectors):
+        return np.empty((0, vectors.shape[-1]), dtype=np.float32)
+
+    n_sample = min(len(vectors), n_lists * IVF_TRAIN_POINTS_PER_LIST)
+    sample = vectors[np.sort(rng.choice(len(vectors), n_sample, replace=False))]
+    centroids = sample[rng.choice(n_sample, n_lists, replace=False)].copy()
+
+    for _ in range(IVF_KMEANS_ITERATIONS):
+        assignments = assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[non_empty])[:-1]))
+        centroids[non_empty] = normalize_rows(
+            np.add.reduceat(sample[order], starts, axis=0),
+        )
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(n_sample, len(empty), replace=False)]
+
+    return centroids
@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+
+# .npy files are mapped read-only by every search process so they are
+# never rewritten in place (truncating a mapped file crashes readers),
+# the new file is written next to the target and swapped in
+def save_npy(path: str, array: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+# read-only mapping, pages are loaded on first touch and shared through
+# the page cache between every process mapping the same file
+def load_npy(path: str) -> np.ndarray:
+    return np.load(path, mmap_mode="r")
+
+
+# true when array is (a view of) a mapping of the file at path, saving
+# it there again would only rewrite the same bytes
+def is_mapping_of(array: np.ndarray, path: str) -> bool:
+    filename = getattr(array, "filename", None)
+    return (
+        filename is not None
+        and os.path.exists(path)
+        and os.path.samefile(filename, path)
+    )
@@ -0,0 +1,584 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.data import (
+    BM25_B,
+    BM25_K1,
+    POSTINGS_BLOCK_SIZE,
+    POSTINGS_CACHE_SIZE,
+    POSTINGS_SPARSE_LOOKUP,
+)
+from lib.indexes.bitpack import PADDING, pack_blocks, unpack_blocks
+from lib.indexes.term_table import SortedTermTable
+from lib.indexes.top_k import top_k
+
+
+# compressed postings layout
+# terms is the sorted term table mapping a term to its row and every
+# row owns the postings offsets[row]:offsets[row + 1] (sorted by
+# document ordinal), cut into blocks of block_size postings (the last
+# block of a row may be shorter), the blocks of a row are
+# term_blocks[row]:term_blocks[row + 1] and every block stores :-
+# 1. block_first    => its first document ordinal (skip data, finding
+#                      a document only decodes the block that can hold it)
+# 2. block_data     => where its bytes start in data: the gaps between
+#                      consecutive document ordinals minus one bit packed
+#                      with block_ord_bits bits, then the term frequencies
+#                      minus one bit packed with block_tf_bits bits
+# bm25 impacts are not stored, decoding a row recomputes them from the
+# tfs and the document lengths, bit for bit what precomputing gave
+# positions (token offsets of the term inside a document, tf of them per
+# posting) follow the same blocks: the positions of the postings of a
+# block start at block_pos_data in positions_data, bit packed with
+# block_pos_bits bits, every posting's first position as is and the
+# next ones as the gap to the previous position minus one
+# recently decoded rows are kept in an lru of up to cache_size postings
+@dataclass(eq=False)
+class Postings:
+    terms: SortedTermTable = field(
+        default_factory=lambda: SortedTermTable.from_terms([]),
+    )
+    offsets: np.ndarray = field(
+        default_factory=lambda: np.zeros(1, dtype=np.int64),
+    )
+    term_blocks: np.ndarray = field(
+        default_factory=lambda: np.zeros(1, dtype=np.int64),
+    )
+    block_first: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int32),
+    )
+    block_data: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64),
+    )
+    block_ord_bits: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.uint8),
+    )
+    block_tf_bits: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.uint8),
+    )
+    data: np.ndarray = field(
+        default_factory=lambda: np.zeros(PADDING, dtype=np.uint8),
+    )
+    block_pos_data: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int64),
+    )
+    block_pos_bits: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.uint8),
+    )
+    positions_data: np.ndarray = field(
+        default_factory=lambda: np.zeros(PADDING, dtype=np.uint8),
+    )
+    # bm25 inputs of the impacts
+    doc_lengths: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.int32),
+    )
+    avg_doc_length: float = 0.0
+    k1: float = BM25_K1
+    b: float = BM25_B
+    block_size: int = POSTINGS_BLOCK_SIZE
+    cache_size: int = POSTINGS_CACHE_SIZE
+
+    def __post_init__(self) -> None:
+        doc_freqs = np.diff(self.offsets)
+        self.idf: np.ndarray = bm25_idf(doc_freqs, len(self.doc_lengths))
+
+        # postings in every block
+        block_rows = np.repeat(
+            np.arange(len(doc_freqs), dtype=np.int64),
+            np.diff(self.term_blocks),
+        )
+        ranks = np.arange(len(block_rows), dtype=np.int64) - self.term_blocks[
+            block_rows
+        ]
+        self.block_counts: np.ndarray = np.minimum(
+            self.block_size,
+            doc_freqs[block_rows] - ranks * self.block_size,
+        )
+
+        # row -> decoded (doc ordinals, tfs, impacts), least recent first
+        self.cache: OrderedDict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = (
+            OrderedDict()
+        )
+        self.cached_postings = 0
+        self.lock = threading.Lock()
+
+    # compresses sorted postings (offsets, doc ordinals and tfs as the
+    # flat parallel arrays postings_from_triples produces, positions
+    # holds the tf positions of every posting one after the other)
+    @classmethod
+    def pack(
+        cls,
+        terms: SortedTermTable,
+        offsets: np.ndarray,
+        doc_ords: np.ndarray,
+        tfs: np.ndarray,
+        positions: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float,
+        b: float,
+        block_size: int = POSTINGS_BLOCK_SIZE,
+    ) -> "Postings":
+        doc_freqs = np.diff(offsets)
+        term_blocks = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+        np.cumsum(-(-doc_freqs // block_size), out=term_blocks[1:])
+
+        block_rows = np.repeat(
+            np.arange(len(doc_freqs), dtype=np.int64),
+            np.diff(term_blocks),
+        )
+        ranks = np.arange(len(block_rows), dtype=np.int64) - term_blocks[block_rows]
+        block_starts = offsets[block_rows] + ranks * block_size
+        block_counts = np.diff(np.append(block_starts, len(doc_ords)))
+
+        doc_ords = doc_ords.astype(np.int64)
+        gaps = np.zeros(len(doc_ords), dtype=np.int64)
+        gaps[1:] = doc_ords[1:] - doc_ords[:-1] - 1
+        gaps[block_starts] = 0
+
+        # the gaps of a block followed by its tfs, block after block
+        stream_starts = 2 * block_starts
+        values = np.empty(2 * len(doc_ords), dtype=np.int64)
+        posting_shift = np.repeat(block_starts, block_counts)
+        slots = np.arange(len(doc_ords), dtype=np.int64) + posting_shift
+        values[slots] = gaps
+        values[slots + np.repeat(block_counts, block_counts)] = tfs - 1
+
+        data, byte_offsets, widths = pack_blocks(
+            values,
+            np.sort(np.concatenate((stream_starts, stream_starts + block_counts))),
+        )
+
+        # gaps between the positions of a posting minus one, the first
+        # position of every posting kept as is
+        tfs = tfs.astype(np.int64)
+        posting_pos_starts = np.cumsum(tfs) - tfs
+        positions = positions.astype(np.int64)
+        position_gaps = positions.copy()
+        position_gaps[1:] -= positions[:-1] + 1
+        position_gaps[posting_pos_starts] = positions[posting_pos_starts]
+
+        positions_data, block_pos_data, block_pos_bits = pack_blocks(
+            position_gaps,
+            posting_pos_starts[block_starts],
+        )
+
+        return cls(
+            terms=terms,
+            offsets=offsets,
+            term_blocks=term_blocks,
+            block_first=doc_ords[block_starts].astype(np.int32),
+            block_data=byte_offsets[0::2],
+            block_ord_bits=widths[0::2],
+            block_tf_bits=widths[1::2],
+            data=data,
+            block_pos_data=block_pos_data,
+            block_pos_bits=block_pos_bits,
+            positions_data=positions_data,
+            doc_lengths=doc_lengths,
+            avg_doc_length=float(doc_lengths.mean()) if len(doc_lengths) else 0.0,
+            k1=k1,
+            b=b,
+            block_size=block_size,
+        )
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def span(self, term: str) -> Tuple[int, int]:
+        row = self.terms.get(term)
+        if row is None:
+            return 0, 0
+
+        return int(self.offsets[row]), int(self.offsets[row + 1])
+
+    def doc_freq(self, term: str) -> int:
+        start, end = self.span(term)
+        return end - start
+
+    def get(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        row = self.terms.get(term)
+        if row is None:
+            return (
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.float32),
+            )
+
+        return self.row(row)
+
+    # raw term frequency of a term inside one document
+    # postings are sorted so this is a binary search
+    def term_freq(self, term: str, doc_ord: int) -> int:
+        doc_ords, tfs, _ = self.get(term)
+        pos = int(np.searchsorted(doc_ords, doc_ord))
+        if pos < len(doc_ords) and doc_ords[pos] == doc_ord:
+            return int(tfs[pos])
+
+        return 0
+
+    # decoded (doc ordinals, tfs, impacts) of a row, read only
+    def row(self, row: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self.lock:
+            decoded = self.cache.get(row)
+            if decoded is not None:
+                self.cache.move_to_end(row)
+                return decoded
+
+        doc_ords, tfs = self.decode(
+            np.arange(self.term_blocks[row], self.term_blocks[row + 1])
+        )
+        decoded = (doc_ords, tfs, self.impacts(self.idf[row], doc_ords, tfs))
+        for array in decoded:
+            array.setflags(write=False)
+
+        if len(doc_ords) <= self.cache_size:
+            with self.lock:
+                if row not in self.cache:
+                    self.cache[row] = decoded
+                    self.cached_postings += len(doc_ords)
+                while self.cached_postings > self.cache_size:
+                    _, (evicted, _, _) = self.cache.popitem(last=False)
+                    self.cached_postings -= len(evicted)
+
+        return decoded
+
+    # impacts of a row for the given (sorted) documents, 0 for documents
+    # without the term, unless the row is cached or the documents are
+    # spread over most of it only the blocks that can hold one of the
+    # documents are decoded
+    def lookup(self, row: int, doc_ords: np.ndarray) -> np.ndarray:
+        # a plain read, recency is only refreshed by row()
+        decoded = self.cache.get(row)
+        blocks = None if decoded is not None else self.sparse_blocks(row, doc_ords)
+        if blocks is None:
+            row_ords, _, row_weights = decoded if decoded is not None else self.row(row)
+        else:
+            row_ords, row_tfs = self.decode(blocks)
+            row_weights = self.impacts(self.idf[row], row_ords, row_tfs)
+
+        if not len(row_ords):
+            return np.zeros(len(doc_ords), dtype=np.float32)
+
+        pos = np.searchsorted(row_ords, doc_ords)
+        pos[pos == len(row_ords)] = 0
+
+        weights = row_weights[pos]
+        weights[row_ords[pos] != doc_ords] = 0
+        return weights
+
+    # every posting decoded into flat arrays parallel to offsets
+    # (doc ordinals, tfs, impacts), for rebuilds and merges
+    def flat(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        doc_ords, tfs = self.decode(np.arange(len(self.block_first)))
+        return (
+            doc_ords,
+            tfs,
+            self.impacts(
+                np.repeat(self.idf, np.diff(self.offsets)),
+                doc_ords,
+                tfs,
+            ),
+        )
+
+    # mask of the given (sorted) documents that hold the term of a row,
+    # decoded like lookup does
+    def contains(self, row: int, doc_ords: np.ndarray) -> np.ndarray:
+        decoded = self.cache.get(row)
+        blocks = None if decoded is not None else self.sparse_blocks(row, doc_ords)
+        if blocks is None:
+            row_ords = (decoded if decoded is not None else self.row(row))[0]
+        else:
+            row_ords, _ = self.decode(blocks)
+
+        if not len(row_ords):
+            return np.zeros(len(doc_ords), dtype=bool)
+
+        pos = np.searchsorted(row_ords, doc_ords)
+        pos[pos == len(row_ords)] = 0
+        return row_ords[pos] == doc_ords
+
+    # candidate_blocks of a lookup, None when they are more than
+    # POSTINGS_SPARSE_LOOKUP of the blocks of the row or there are more
+    # documents than postings (searching them costs more than decoding)
+    def sparse_blocks(self, row: int, doc_ords: np.ndarray) -> Optional[np.ndarray]:
+        if len(doc_ords) >= self.offsets[row + 1] - self.offsets[row]:
+            return None
+
+        blocks = self.candidate_blocks(row, doc_ords)
+        n_blocks = int(self.term_blocks[row + 1] - self.term_blocks[row])
+        return None if len(blocks) > POSTINGS_SPARSE_LOOKUP * n_blocks else blocks
+
+    # blocks of a row whose document range can hold one of the given
+    # (sorted) documents, ascending (skip data of the row)
+    def candidate_blocks(self, row: int, doc_ords: np.ndarray) -> np.ndarray:
+        first, end = int(self.term_blocks[row]), int(self.term_blocks[row + 1])
+        blocks = first - 1 + np.searchsorted(
+            self.block_first[first:end],
+            doc_ords,
+            side="right",
+        )
+        return np.unique(blocks[blocks >= first])
+
+    # positions of a row inside the given (sorted) documents as flat
+    # (doc ordinal, position) pairs sorted by both, documents without
+    # the term have no pairs, only the blocks that can hold one of the
+    # documents are decoded
+    def positions(
+        self,
+        row: int,
+        doc_ords: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        blocks = self.candidate_blocks(row, doc_ords)
+
+        row_ords, row_tfs = self.decode(blocks)
+        row_positions = self.decode_positions(blocks, row_tfs)
+        pair_ords = np.repeat(row_ords, row_tfs)
+
+        pos = np.searchsorted(doc_ords, pair_ords)
+        pos[pos == len(doc_ords)] = 0
+        wanted = doc_ords[pos] == pair_ords
+
+        return pair_ords[wanted], row_positions[wanted]
+
+    # every position decoded, the positions of each posting of flat()
+    # one after the other
+    def flat_positions(self) -> np.ndarray:
+        blocks = np.arange(len(self.block_first))
+        _, tfs = self.decode(blocks)
+        return self.decode_positions(blocks, tfs)
+
+    # positions of the given blocks (ascending) concatenated, tfs are
+    # the decoded tfs of the same blocks
+    def decode_positions(self, blocks: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        if not len(blocks):
+            return np.empty(0, dtype=np.int32)
+
+        tfs = tfs.astype(np.int64)
+        block_starts = np.cumsum(self.block_counts[blocks]) - self.block_counts[blocks]
+        gaps = unpack_blocks(
+            self.positions_data,
+            self.block_pos_data[blocks],
+            self.block_pos_bits[blocks],
+            np.add.reduceat(tfs, block_starts),
+        ).astype(np.int64)
+
+        # gaps were stored minus one, the first of every posting as is
+        posting_starts = np.cumsum(tfs) - tfs
+        firsts = gaps[posting_starts]
+        gaps += 1
+        gaps[posting_starts] = firsts
+        sums = np.cumsum(gaps)
+
+        return (
+            sums - np.repeat(sums[posting_starts] - firsts, tfs)
+        ).astype(np.int32)
+
+    # doc ordinals and tfs of the given blocks (ascending) concatenated
+    def decode(self, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        counts = self.block_counts[blocks]
+        ord_bits = self.block_ord_bits[blocks]
+
+        gaps = unpack_blocks(
+            self.data,
+            self.block_data[blocks],
+            ord_bits,
+            counts,
+        ).astype(np.int64)
+        tfs = unpack_blocks(
+            self.data,
+            self.block_data[blocks] + (counts * ord_bits.astype(np.int64) + 7) // 8,
+            self.block_tf_bits[blocks],
+            counts,
+        ).astype(np.int32)
+
+        # gaps were stored minus one, the first of every block as 0
+        block_starts = np.cumsum(counts) - counts
+        gaps += 1
+        gaps[block_starts] = 0
+        sums = np.cumsum(gaps)
+        doc_ords = (
+            np.repeat(self.block_first[blocks].astype(np.int64), counts)
+            + sums
+            - np.repeat(sums[block_starts], counts)
+        )
+
+        return doc_ords.astype(np.int32), tfs + 1
+
+    # bm25 impacts, idf is the idf of the row or one per posting
+    def impacts(
+        self,
+        idf: np.ndarray | np.float64,
+        doc_ords: np.ndarray,
+        tfs: np.ndarray,
+    ) -> np.ndarray:
+        return (
+            idf
+            * bm25_tf(
+                tfs,
+                self.doc_lengths[doc_ords],
+                self.avg_doc_length,
+                self.k1,
+                self.b,
+            )
+        ).astype(np.float32)
+
+
+# bm25 idf for every posting list at once
+def bm25_idf(doc_freqs: np.ndarray, total_docs: int) -> np.ndarray:
+    return np.log(
+        (total_docs - doc_freqs + 0.5) / (doc_freqs + 0.5) + 1,
+    )
+
+
+# bm25 saturated term frequency, vectorized over postings
+def bm25_tf(
+    tfs: np.ndarray,
+    doc_lengths: np.ndarray,
+    avg_doc_length: float,
+    k1: float,
+    b: float,
+) -> np.ndarray:
+    doc_length_normalization = 1 - b + b * (doc_lengths / avg_doc_length)
+
+    return (tfs * (k1 + 1)) / (tfs + k1 * doc_length_normalization)
+
+
+# postings from flat (term row, doc ordinal, tf) triples in any
+# order, terms is the sorted vocabulary the rows point into and terms
+# left without postings are dropped
+# positions holds the tf positions of every triple one after the other
+def postings_from_triples(
+    terms: List[str],
+    rows: np.ndarray,
+    doc_ords: np.ndarray,
+    tfs: np.ndarray,
+    positions: np.ndarray,
+    doc_lengths: np.ndarray,
+    k1: float,
+    b: float,
+) -> Postings:
+    order = np.lexsort((doc_ords, rows))
+    tfs = tfs.astype(np.int64)
+    triple_pos_starts = np.cumsum(tfs) - tfs
+    rows, doc_ords, tfs = rows[order], doc_ords[order], tfs[order]
+
+    # positions follow their triples into postings order
+    sorted_pos_starts = np.cumsum(tfs) - tfs
+    positions = positions[
+        np.arange(int(tfs.sum()), dtype=np.int64)
+        + np.repeat(triple_pos_starts[order] - sorted_pos_starts, tfs)
+    ]
+
+    counts = np.bincount(rows, minlength=len(terms))
+    present = np.flatnonzero(counts)
+
+    offsets = np.zeros(len(present) + 1, dtype=np.int64)
+    np.cumsum(counts[present], out=offsets[1:])
+
+    return Postings.pack(
+        terms=SortedTermTable.from_terms([terms[row] for row in present.tolist()]),
+        offsets=offsets,
+        doc_ords=doc_ords,
+        tfs=tfs.astype(np.int32),
+        positions=positions,
+        doc_lengths=doc_lengths,
+        k1=k1,
+        b=b,
+    )
+
+
+# sparse accumulate of the weighted postings of the query terms
+# the sum for every document is done in query term order
+def accumulate(
+    doc_ords: List[np.ndarray],
+    weights: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not doc_ords:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+
+    candidates, positions = np.unique(
+        np.concatenate(doc_ords),
+        return_inverse=True,
+    )
+    scores = np.bincount(
+        positions,
+        weights=np.concatenate(weights),
+        minlength=len(candidates),
+    )
+    return candidates, scores
+
+
+# exhaustive term-at-a-time top-k over full posting lists
+def exhaustive_top_k(
+    postings: Postings,
+    query_rows: List[Tuple[int, int]],
+    limit: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    matched_ords: List[np.ndarray] = []
+    matched_weights: List[np.ndarray] = []
+    for row, query_tf in query_rows:
+        doc_ords, _, term_weights = postings.row(row)
+        matched_ords.append(doc_ords)
+        matched_weights.append(query_tf * term_weights.astype(np.float64))
+
+    candidates, scores = accumulate(matched_ords, matched_weights)
+    return top_k(candidates, scores, limit)
+
+
+# exhaustive top-k for a batch of queries
+# every distinct term is read once for the whole batch and its postings
+# are fanned out to the queries using it into one dense (query, doc)
+# accumulator, entries are laid out term position by term position so
+# each query is summed in its own term order and gets exactly the
+# scores exhaustive_top_k would give it
+def exhaustive_top_k_many(
+    postings: Postings,
+    queries_rows: List[List[Tuple[int, int]]],
+    limit: int,
+    n_docs: int,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    term_postings: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    keys: List[np.ndarray] = []
+    weights: List[np.ndarray] = []
+
+    max_terms = max((len(query_rows) for query_rows in queries_rows), default=0)
+    for term_pos in range(max_terms):
+        for query_idx, query_rows in enumerate(queries_rows):
+            if term_pos >= len(query_rows):
+                continue
+
+            row, query_tf = query_rows[term_pos]
+            if row not in term_postings:
+                doc_ords, _, term_weights = postings.row(row)
+                term_postings[row] = (
+                    doc_ords.astype(np.int64),
+                    term_weights.astype(np.float64),
+                )
+
+            doc_ords, term_weights = term_postings[row]
+            keys.append(query_idx * n_docs + doc_ords)
+            weights.append(query_tf * term_weights)
+
+    if not keys:
+        return [
+            (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+            for _ in queries_rows
+        ]
+
+    scores = np.bincount(
+        np.concatenate(keys),
+        weights=np.concatenate(weights),
+        minlength=len(queries_rows) * n_docs,
+    ).reshape(len(queries_rows), n_docs)
+
+    results = []
+    for query_scores in scores:
+        # every posting weight is positive so touched means non zero
+        candidates = np.flatnonzero(query_scores)
+        results.append(top_k(candidates, query_scores[candidates], limit))
+
+    return results
@@ -0,0 +1,323 @@
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config.data import (
+    IVF_KMEANS_ITERATIONS,
+    PQ_SUBSPACES,
+    QUANTIZED_RESCORE_FACTOR,
+)
+from lib.indexes.flat_index import normalize_rows, unit_rows
+from lib.indexes.npy import load_npy, save_npy
+from lib.indexes.top_k import top_k
+
+
+QUANTIZATION_FORMAT_VERSION = 1
+
+# rows decoded per step while scoring, bounds the float temporaries
+SCORE_CHUNK_SIZE = 16384
+
+# codebook size of every product quantizer subspace (one uint8 code)
+PQ_CENTROIDS = 256
+
+# training points per pq centroid
+PQ_TRAIN_POINTS_PER_CENTROID = 64
+
+
+# per dimension int8 scalar quantization
+# x ~ low + scale * code with code in [0, 255], 4x smaller than float32
+# a query is scored asymmetrically (float query against integer codes):
+# q . x ~ q . low + (q * scale) . code
+class ScalarQuantizer:
+    kind = "int8"
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray) -> None:
+        self.low = low
+        self.scale = scale
+
+    @classmethod
+    def train(cls, vectors: np.ndarray) -> "ScalarQuantizer":
+        low = vectors.min(axis=0)
+        scale = (vectors.max(axis=0) - low) / 255.0
+
+        return cls(
+            low.astype(np.float32),
+            np.where(scale > 0, scale, 1.0).astype(np.float32),
+        )
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(
+            np.rint((vectors - self.low) / self.scale),
+            0,
+            255,
+        ).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        weights = query * self.scale
+        offset = np.float32(query @ self.low)
+
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_SIZE):
+            chunk = codes[start : start + SCORE_CHUNK_SIZE]
+            scores[start : start + len(chunk)] = (
+                chunk.astype(np.float32) @ weights + offset
+            )
+
+        return scores
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ScalarQuantizer":
+        return cls(state["low"], state["scale"])
+
+
+# product quantization
+# the vector is split into m subspaces and every sub-vector is replaced
+# by the id of its nearest centroid in that subspace (one byte each),
+# 384 float32 dims with m = 48 become 48 bytes (32x smaller)
+# asymmetric distance: the query is split the same way, a (m x 256)
+# table of sub-dot-products is computed once and a vector's score is the
+# sum of m table lookups
+class ProductQuantizer:
+    kind = "pq"
+
+    def __init__(self, centroids: np.ndarray) -> None:
+        # (m, PQ_CENTROIDS, dim / m)
+        self.centroids = centroids
+
+    @property
+    def n_subspaces(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(
+        cls,
+        vectors: np.ndarray,
+        n_subspaces: int = PQ_SUBSPACES,
+        seed: int = 0,
+    ) -> "ProductQuantizer":
+        dim = vectors.shape[1]
+        if dim % n_subspaces:
+            raise ValueError(
+                f"embedding dimension {dim} is not divisible by {n_subspaces} subspaces"
+            )
+
+        rng = np.random.default_rng(seed)
+        n_sample = min(len(vectors), PQ_CENTROIDS * PQ_TRAIN_POINTS_PER_CENTROID)
+        sample = vectors[np.sort(rng.choice(len(vectors), n_sample, replace=False))]
+
+        return cls(
+            np.stack(
+                [
+                    train_kmeans(sub, PQ_CENTROIDS, rng)
+                    for sub in np.split(sample, n_subspaces, axis=1)
+                ]
+            )
+        )
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        for sub_idx, sub in enumerate(np.split(vectors, self.n_subspaces, axis=1)):
+            codes[:, sub_idx] = nearest_centroids(sub, self.centroids[sub_idx])
+
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        table = np.einsum(
+            "mkd,md->mk",
+            self.centroids,
+            query.reshape(self.n_subspaces, -1),
+        )
+        subspaces = np.arange(self.n_subspaces)
+
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_SIZE):
+            chunk = codes[start : start + SCORE_CHUNK_SIZE]
+            scores[start : start + len(chunk)] = table[subspaces, chunk].sum(axis=1)
+
+        return scores
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ProductQuantizer":
+        return cls(state["centroids"])
+
+
+QUANTIZERS = {
+    ScalarQuantizer.kind: ScalarQuantizer,
+    ProductQuantizer.kind: ProductQuantizer,
+}
+
+
+# searches the compact codes, then optionally re-scores a shortlist of
+# rescore_factor * limit candidates exactly against the float vectors
+# (which are only read for those rows, so they can stay on disk)
+class QuantizedIndex:
+    def __init__(
+        self,
+        quantizer: ScalarQuantizer | ProductQuantizer,
+        codes: np.ndarray,
+        vectors: np.ndarray,
+        rescore_factor: int = QUANTIZED_RESCORE_FACTOR,
+    ) -> None:
+        self.quantizer = quantizer
+        self.codes = codes
+        # l2 normalized float vectors (usually a read-only memmap)
+        self.vectors = vectors
+        self.rescore_factor = rescore_factor
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        kind: str,
+        rescore_factor: int = QUANTIZED_RESCORE_FACTOR,
+        normalized: bool = False,
+    ) -> "QuantizedIndex":
+        if kind not in QUANTIZERS:
+            raise ValueError(f"unknown quantization {kind}")
+
+        vectors = unit_rows(vectors, normalized)
+        quantizer = QUANTIZERS[kind].train(vectors)
+
+        return cls(
+            quantizer,
+            quantizer.encode(vectors),
+            vectors,
+            rescore_factor,
+        )
+
+    # the codes go to a plain .npy so they can be mapped like the float
+    # vectors, the small quantizer state goes to an .npz next to them
+    def save(self, codes_path: str, quantizer_path: str) -> None:
+        save_npy(codes_path, self.codes)
+
+        tmp_path = f"{quantizer_path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.int64(QUANTIZATION_FORMAT_VERSION),
+            kind=np.array(self.quantizer.kind),
+            n_vectors=np.int64(len(self.codes)),
+            **self.quantizer.state(),
+        )
+        os.replace(tmp_path, quantizer_path)
+
+    # raises ValueError when the codes do not match the vectors or kind
+    @classmethod
+    def load(
+        cls,
+        codes_path: str,
+        quantizer_path: str,
+        vectors: np.ndarray,
+        kind: str,
+        rescore_factor: int = QUANTIZED_RESCORE_FACTOR,
+    ) -> "QuantizedIndex":
+        with np.load(quantizer_path) as data:
+            state = {name: data[name] for name in data.files}
+
+        if int(state["version"]) != QUANTIZATION_FORMAT_VERSION:
+            raise ValueError(
+                f"unsupported quantized index version in {quantizer_path}"
+            )
+        if str(state["kind"]) != kind or kind not in QUANTIZERS:
+            raise ValueError(f"{quantizer_path} holds {state['kind']} codes, not {kind}")
+
+        codes = load_npy(codes_path)
+        if len(codes) != len(vectors) or int(state["n_vectors"]) != len(codes):
+            raise ValueError(f"quantized index {codes_path} is stale, rebuild the cache")
+
+        return cls(
+            QUANTIZERS[kind].from_state(state),
+            codes,
+            vectors,
+            rescore_factor,
+        )
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if not len(self.codes) or not query_embedding.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query_embedding = normalize_rows(query_embedding)
+        ids, scores = top_k(
+            np.arange(len(self.codes)),
+            self.quantizer.scores(self.codes, query_embedding),
+            limit * self.rescore_factor if self.rescore_factor > 0 else limit,
+        )
+        if self.rescore_factor <= 0:
+            return ids, scores
+
+        # rows are gathered in file order so a memmap reads sequentially
+        ids = np.sort(ids)
+        exact = normalize_rows(np.asarray(self.vectors[ids])) @ query_embedding
+
+        return top_k(ids, exact, limit)
+
+    def search_many(
+        self,
+        query_embeddings: np.ndarray,
+        limit: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [
+            self.search(query, limit if has_query else 0)
+            for query, has_query in zip(
+                query_embeddings,
+                np.any(query_embeddings != 0, axis=1),
+            )
+        ]
+
+
+# plain (euclidean) k-means used for the pq codebooks
+def train_kmeans(
+    vectors: np.ndarray,
+    n_centroids: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    if len(vectors) < n_centroids:
+        # fewer points than centroids: every point is its own centroid
+        return np.resize(vectors, (n_centroids, vectors.shape[1])).astype(np.float32)
+
+    centroids = vectors[rng.choice(len(vectors), n_centroids, replace=False)].copy()
+    for _ in range(IVF_KMEANS_ITERATIONS):
+        assignments = nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_centroids)
+
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[non_empty])[:-1]))
+        centroids[non_empty] = (
+            np.add.reduceat(vectors[order], starts, axis=0)
+            / counts[non_empty, None]
+        )
+
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+    return centroids.astype(np.float32)
+
+
+# argmin ||x - c||^2 = argmax (x . c - ||c||^2 / 2)
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    half_norms = 0.5 * np.einsum("kd,kd->k", centroids, centroids)
+
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCORE_CHUNK_SIZE):
+        chunk = vectors[start : start + SCORE_CHUNK_SIZE]
+        assignments[start : start + len(chunk)] = np.argmax(
+            chunk @ centroids.T - half_norms,
+            axis=1,
+        )
+
+    return assignments
@@ -0,0 +1,217 @@
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+# on-disk index segment
+#
+# layout (little endian) :-
+# 1. fixed header  => magic, format version, corpus stats, bm25 params
+# 2. section table => (byte offset, element count) for every section
+# 3. sections      => flat arrays, each aligned to SECTION_ALIGNMENT
+#
+# every section is a plain numpy array so opening a segment is just an
+# mmap plus np.frombuffer views, nothing is parsed or copied until a
+# query actually touches the pages it needs
+SEGMENT_MAGIC = b"XUVESEG\x00"
+SEGMENT_VERSION = 3
+SECTION_ALIGNMENT = 8
+
+# section name -> dtype, the order here is the order on disk
+SEGMENT_SECTIONS: List[Tuple[str, np.dtype]] = [
+    # sorted term dictionary
+    ("term_blob", np.dtype(np.uint8)),
+    ("term_offsets", np.dtype(np.int64)),
+    # compressed postings (see postings.py)
+    ("offsets", np.dtype(np.int64)),
+    ("term_blocks", np.dtype(np.int64)),
+    ("block_first", np.dtype(np.int32)),
+    ("block_data", np.dtype(np.int64)),
+    ("block_ord_bits", np.dtype(np.uint8)),
+    ("block_tf_bits", np.dtype(np.uint8)),
+    ("postings_data", np.dtype(np.uint8)),
+    # positional index, same blocks as the postings
+    ("block_pos_data", np.dtype(np.int64)),
+    ("block_pos_bits", np.dtype(np.uint8)),
+    ("positions_data", np.dtype(np.uint8)),
+    # documents
+    ("doc_ids", np.dtype(np.int64)),
+    ("doc_id_order", np.dtype(np.int32)),
+    ("doc_lengths", np.dtype(np.int32)),
+    # block-max metadata
+    ("term_max", np.dtype(np.float32)),
+    ("block_offsets", np.dtype(np.int64)),
+    ("block_ids", np.dtype(np.int32)),
+    ("block_maxes", np.dtype(np.float32)),
+]
+
+# magic, version, section count, doc count, k1, b, avg doc length,
+# block-max block size, postings block size
+HEADER = struct.Struct("<8sIIQdddQQ")
+SECTION_ENTRY = struct.Struct("<QQ")
+TABLE_END = HEADER.size + SECTION_ENTRY.size * len(SEGMENT_SECTIONS)
+
+
+class SegmentFormatError(ValueError):
+    pass
+
+
+@dataclass
+class SegmentStats:
+    n_docs: int
+    k1: float
+    b: float
+    avg_doc_length: float
+    block_size: int
+    postings_block_size: int
+
+
+@dataclass
+class Segment:
+    stats: SegmentStats
+    arrays: Dict[str, np.ndarray] = field(default_factory=dict)
+    # keeps the mapping alive for as long as the views are in use
+    buffer: mmap.mmap | None = None
+
+
+def _aligned(position: int) -> int:
+    return -(-position // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def write_segment(
+    path: str,
+    stats: SegmentStats,
+    arrays: Dict[str, np.ndarray],
+) -> None:
+    table: List[Tuple[int, int]] = []
+    position = _aligned(TABLE_END)
+    for name, dtype in SEGMENT_SECTIONS:
+        table.append((position, len(arrays[name])))
+        position = _aligned(position + len(arrays[name]) * dtype.itemsize)
+
+    # written next to the target and swapped in so a reader never
+    # maps a half written segment
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                SEGMENT_MAGIC,
+                SEGMENT_VERSION,
+                len(SEGMENT_SECTIONS),
+                stats.n_docs,
+                stats.k1,
+                stats.b,
+                stats.avg_doc_length,
+                stats.block_size,
+                stats.postings_block_size,
+            )
+        )
+        for offset, count in table:
+            f.write(SECTION_ENTRY.pack(offset, count))
+
+        for (name, dtype), (offset, _) in zip(SEGMENT_SECTIONS, table):
+            f.write(b"\x00" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+
+        f.write(b"\x00" * (position - f.tell()))
+
+    os.replace(tmp_path, path)
+
+
+# parses and checks the header and section table against the file size
+def read_layout(
+    buffer: bytes | mmap.mmap,
+) -> Tuple[SegmentStats, List[Tuple[int, int]]]:
+    if len(buffer) < TABLE_END:
+        raise SegmentFormatError("segment is truncated")
+
+    (
+        magic,
+        version,
+        section_count,
+        n_docs,
+        k1,
+        b,
+        avg_doc_length,
+        block_size,
+        postings_block_size,
+    ) = HEADER.unpack_from(buffer, 0)
+
+    if magic != SEGMENT_MAGIC:
+        raise SegmentFormatError("not an index segment")
+    if version != SEGMENT_VERSION:
+        raise SegmentFormatError(
+            f"unsupported segment version {version}, expected {SEGMENT_VERSION}"
+        )
+    if section_count != len(SEGMENT_SECTIONS):
+        raise SegmentFormatError("unexpected section count")
+
+    table = [
+        SECTION_ENTRY.unpack_from(buffer, HEADER.size + i * SECTION_ENTRY.size)
+        for i in range(section_count)
+    ]
+    for (name, dtype), (offset, count) in zip(SEGMENT_SECTIONS, table):
+        if offset % SECTION_ALIGNMENT or offset + count * dtype.itemsize > len(buffer):
+            raise SegmentFormatError(f"section {name} is out of bounds")
+
+    return (
+        SegmentStats(n_docs, k1, b, avg_doc_length, block_size, postings_block_size),
+        table,
+    )
+
+
+def open_segment(path: str) -> Segment:
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    stats, table = read_layout(buffer)
+    arrays = {
+        name: np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        for (name, dtype), (offset, count) in zip(SEGMENT_SECTIONS, table)
+    }
+
+    return Segment(stats=stats, arrays=arrays, buffer=buffer)
+
+
+# structural validation that only reads the header, the section table
+# and the few boundary entries it cross checks
+def validate_segment(path: str) -> bool:
+    try:
+        segment = open_segment(path)
+    except (OSError, ValueError):
+        return False
+
+    arrays = segment.arrays
+    n_terms = len(arrays["offsets"]) - 1
+    n_blocks = len(arrays["block_first"])
+    if n_terms < 0 or not len(arrays["term_blocks"]):
+        return False
+
+    return (
+        len(arrays["term_offsets"]) == n_terms + 1
+        and len(arrays["term_blocks"]) == n_terms + 1
+        and len(arrays["block_data"]) == n_blocks
+        and len(arrays["block_ord_bits"]) == n_blocks
+        and len(arrays["block_tf_bits"]) == n_blocks
+        and len(arrays["block_pos_data"]) == n_blocks
+        and len(arrays["block_pos_bits"]) == n_blocks
+        and len(arrays["doc_ids"]) == segment.stats.n_docs
+        and len(arrays["doc_id_order"]) == segment.stats.n_docs
+        and len(arrays["doc_lengths"]) == segment.stats.n_docs
+        and len(arrays["term_max"]) == n_terms
+        and len(arrays["block_offsets"]) == n_terms + 1
+        and int(arrays["term_offsets"][-1]) == len(arrays["term_blob"])
+        and int(arrays["term_blocks"][-1]) == n_blocks
+        and int(arrays["block_offsets"][-1]) == len(arrays["block_ids"])
+        and (
+            not n_blocks
+            or (
+                int(arrays["block_data"][-1]) < len(arrays["postings_data"])
+                and int(arrays["block_pos_data"][-1]) < len(arrays["positions_data"])
+            )
+        )
+    )
@@ -0,0 +1,447 @@
+import json
+import math
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Counter, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.data import (
+    BM25_B,
+    BM25_BLOCK_SIZE,
+    BM25_K1,
+    SEGMENT_BUFFER_SIZE,
+    SEGMENT_MERGE_FACTOR,
+    SEGMENTS_DIR_PATH,
+)
+from decors.handle_json_load_errors import handle_json_errors
+from lib.indexes.doc_store import DocStore
+from lib.indexes.inverted_index import InvertedIndex
+from lib.indexes.postings import accumulate, bm25_idf, bm25_tf
+from lib.indexes.top_k import top_k
+from lib.tokenize import tokenize
+from typedicts.movies import Movie
+
+
+SEGMENTS_FORMAT_VERSION = 2
+
+# commit point listing the live segments and their deleted ordinals
+SEGMENTS_FILE = "segments.json"
+
+
+# one immutable InvertedIndex plus the mask of its documents that are
+# still live, deleting a document swaps in a new mask (copy on write)
+# so searches holding an older snapshot are never affected
+@dataclass(frozen=True)
+class IndexPart:
+    name: str
+    index: InvertedIndex
+    live: np.ndarray
+
+    @property
+    def n_live(self) -> int:
+        return int(np.count_nonzero(self.live))
+
+    @property
+    def live_length(self) -> int:
+        return int(self.index.doc_lengths[self.live].sum(dtype=np.int64))
+
+    # live doc ordinals and tfs of a term
+    def matches(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        doc_ords, tfs, _ = self.index.postings.get(term)
+        live = self.live[doc_ords]
+
+        return doc_ords[live], tfs[live]
+
+
+# log structured bm25 index :-
+# 1. new and updated movies go to an in-memory write buffer that is
+#    searchable as soon as add_movies returns, every ingest is a small
+#    part of its own and the parts are merged once, by the next search
+#    or flush
+# 2. a full buffer is flushed as a new immutable segment (an ordinary
+#    index.seg file plus its doc store), deletes only flip live masks
+# 3. segments of the same size tier are merged in a background thread,
+#    the merged segment drops deleted documents and is swapped in
+#    atomically, searches keep running on their snapshot meanwhile
+# the per segment impacts depend on per segment statistics, so searches
+# recompute bm25 with df, N and avgdl summed over the live documents of
+# every segment and the buffer, scores are the ones a single index over
+# the same movies gives
+# the buffer and deletes are only durable after flush()
+class SegmentedIndex:
+    def __init__(
+        self,
+        path: str = SEGMENTS_DIR_PATH,
+        buffer_size: int = SEGMENT_BUFFER_SIZE,
+        merge_factor: int = SEGMENT_MERGE_FACTOR,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        self.merge_factor = merge_factor
+        self.k1 = k1
+        self.b = b
+
+        # flushed segments, replaced (never mutated) under the lock
+        self.parts: Tuple[IndexPart, ...] = ()
+        # the write buffer, in-memory parts that are not on disk yet
+        self.buffer: Tuple[IndexPart, ...] = ()
+
+        self.next_segment = 0
+        self.lock = threading.RLock()
+        self.merge_thread: Optional[threading.Thread] = None
+
+    # opens the segments of the last commit (an empty index if none)
+    @classmethod
+    def open(cls, path: str = SEGMENTS_DIR_PATH, **kwargs: Any) -> "SegmentedIndex":
+        index = cls(path, **kwargs)
+
+        commit = read_segments_file(os.path.join(path, SEGMENTS_FILE))
+        if not commit:
+            return index
+        if commit.get("version") != SEGMENTS_FORMAT_VERSION:
+            raise ValueError(f"unsupported segments version in {path}")
+
+        parts: List[IndexPart] = []
+        for entry in commit["segments"]:
+            segment = InvertedIndex()
+            segment.load(
+                os.path.join(path, f"{entry['name']}.seg"),
+                docs=DocStore.open(os.path.join(path, f"{entry['name']}.docs")),
+            )
+
+            live = np.ones(len(segment.doc_ids), dtype=bool)
+            live[np.asarray(entry["deleted"], dtype=np.int64)] = False
+            parts.append(IndexPart(entry["name"], segment, live))
+
+        index.parts = tuple(parts)
+        index.next_segment = commit["next_segment"]
+
+        return index
+
+    def __len__(self) -> int:
+        return sum(part.n_live for part in self.__snapshot())
+
+    @property
+    def buffered(self) -> int:
+        return sum(part.n_live for part in self.buffer)
+
+    # add or replace movies (by id), older versions are deleted
+    # only the new movies are tokenized, they are appended to the buffer
+    # as a part of their own, a full buffer is flushed as a new segment
+    def add_movies(self, movies: List[Movie]) -> None:
+        # the last version of a movie wins
+        added = list({int(movie["id"]): movie for movie in movies}.values())
+        if not added:
+            return
+
+        # tokenized in process, ingests run on the threads of the server
+        # and forking a pool from a threaded process can deadlock
+        added_index = InvertedIndex()
+        added_index.build(added, self.k1, self.b, processes=1)
+
+        with self.lock:
+            self.delete_movies([int(movie["id"]) for movie in added])
+
+            self.buffer = self.buffer + (
+                IndexPart("buffer", added_index, np.ones(len(added), dtype=bool)),
+            )
+
+            if self.buffered >= self.buffer_size:
+                self.flush()
+
+    # returns the number of movies that were live
+    def delete_movies(self, doc_ids: List[int]) -> int:
+        with self.lock:
+            deleted = 0
+            parts = list(self.__snapshot())
+            for part_pos, part in enumerate(parts):
+                live = None
+                for doc_id in doc_ids:
+                    doc_ord = part.index.get_doc_ordinal(int(doc_id))
+                    if doc_ord is None or not part.live[doc_ord]:
+                        continue
+
+                    if live is None:
+                        live = part.live.copy()
+                    live[doc_ord] = False
+                    deleted += 1
+
+                if live is not None:
+                    parts[part_pos] = replace(part, live=live)
+
+            self.parts = tuple(parts[: len(self.parts)])
+            self.buffer = tuple(parts[len(self.parts) :])
+
+            return deleted
+
+    # writes the buffer as a new segment, commits, and starts a
+    # background merge when a size tier is full
+    def flush(self) -> None:
+        with self.lock:
+            self.__merge_buffer()
+            if self.buffer:
+                part = replace(self.buffer[0], name=self.__next_name())
+                self.__write_part(part)
+                self.parts = self.parts + (part,)
+
+            self.buffer = ()
+            self.__commit()
+
+        self.maybe_merge()
+
+    # at most one merge runs at a time, a finished merge checks again
+    # so merges cascade up the tiers
+    def maybe_merge(self) -> None:
+        with self.lock:
+            if self.merge_thread is not None and self.merge_thread.is_alive():
+                return
+
+            sources = self.__pick_merge()
+            if not sources:
+                return
+
+            self.merge_thread = threading.Thread(
+                target=self.__merge,
+                args=(sources,),
+                name="segment-merge",
+            )
+            self.merge_thread.start()
+
+    def wait_for_merges(self) -> None:
+        while True:
+            thread = self.merge_thread
+            if thread is None or not thread.is_alive():
+                return
+            thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        parts = self.__snapshot()
+        n_docs = sum(part.n_live for part in parts)
+
+        return {
+            "segments": len(self.parts),
+            "buffered": self.buffered,
+            "documents": n_docs,
+            "deleted": sum(len(part.live) - part.n_live for part in self.parts),
+            "avg_doc_length": (
+                sum(part.live_length for part in parts) / n_docs if n_docs else 0.0
+            ),
+        }
+
+    def bm25_search(self, query: str, limit: int) -> List[Tuple[int, str, float]]:
+        with self.lock:
+            self.__merge_buffer()
+            parts = self.__snapshot()
+        n_docs = sum(part.n_live for part in parts)
+        query_terms = list(Counter(tokenize(query)).items())
+        if not n_docs or not query_terms or limit <= 0:
+            return []
+
+        # the doc lengths are integers so this is exactly their mean
+        avg_doc_length = sum(part.live_length for part in parts) / n_docs
+
+        # matches[part][term] => live (doc ordinals, tfs)
+        matches = [[part.matches(term) for term, _ in query_terms] for part in parts]
+        idf = bm25_idf(
+            np.array(
+                [
+                    sum(len(part_matches[term_idx][0]) for part_matches in matches)
+                    for term_idx in range(len(query_terms))
+                ],
+                dtype=np.int64,
+            ),
+            n_docs,
+        )
+
+        # (score, part position, ordinal, doc id) of every part's top-k
+        ranked: List[Tuple[float, int, int, int]] = []
+        for part_pos, (part, part_matches) in enumerate(zip(parts, matches)):
+            matched_ords: List[np.ndarray] = []
+            matched_weights: List[np.ndarray] = []
+            for term_idx, (doc_ords, tfs) in enumerate(part_matches):
+                if not len(doc_ords):
+                    continue
+
+                # rounded through float32 like the impacts of a single index
+                weights = (
+                    idf[term_idx]
+                    * bm25_tf(
+                        tfs,
+                        part.index.doc_lengths[doc_ords],
+                        avg_doc_length,
+                        self.k1,
+                        self.b,
+                    )
+                ).astype(np.float32)
+
+                matched_ords.append(doc_ords)
+                matched_weights.append(
+                    query_terms[term_idx][1] * weights.astype(np.float64),
+                )
+
+            part_ords, part_scores = top_k(
+                *accumulate(matched_ords, matched_weights),
+                limit,
+            )
+            ranked.extend(
+                (score, part_pos, doc_ord, doc_id)
+                for doc_ord, doc_id, score in zip(
+                    part_ords.tolist(),
+                    part.index.doc_ids[part_ords].tolist(),
+                    part_scores.tolist(),
+                )
+            )
+
+        ranked.sort(key=lambda entry: (-entry[0], entry[1], entry[2]))
+
+        return [
+            (doc_id, parts[part_pos].index.docs.title(doc_ord), score)
+            for score, part_pos, doc_ord, doc_id in ranked[:limit]
+        ]
+
+    # segments first, then the buffer (newest documents last)
+    def __snapshot(self) -> Tuple[IndexPart, ...]:
+        with self.lock:
+            return self.parts + self.buffer
+
+    # the parts of the buffer as one part without deleted documents (or
+    # no part when every buffered document was deleted), called with the
+    # lock held
+    def __merge_buffer(self) -> None:
+        if len(self.buffer) == 1 and self.buffered == len(self.buffer[0].live):
+            return
+        if not self.buffered:
+            self.buffer = ()
+            return
+
+        merged = InvertedIndex.merged(
+            [(part.index, part.live) for part in self.buffer],
+            self.k1,
+            self.b,
+        )
+        self.buffer = (
+            IndexPart("buffer", merged, np.ones(len(merged.doc_ids), dtype=bool)),
+        )
+
+    # tiered policy: a segment's tier is log_merge_factor of its live
+    # documents in buffers, merge_factor segments of one tier are merged
+    def __pick_merge(self) -> List[IndexPart]:
+        tiers: Dict[int, List[IndexPart]] = {}
+        for part in self.parts:
+            tier = int(
+                math.log(
+                    max(part.n_live, 1) / self.buffer_size,
+                    self.merge_factor,
+                )
+                if part.n_live > self.buffer_size
+                else 0
+            )
+            tiers.setdefault(tier, []).append(part)
+
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][: self.merge_factor]
+
+        return []
+
+    def __merge(self, sources: List[IndexPart]) -> None:
+        merged = InvertedIndex.merged(
+            [(part.index, part.live) for part in sources],
+            self.k1,
+            self.b,
+            BM25_BLOCK_SIZE,
+        )
+
+        with self.lock:
+            name = self.__next_name()
+
+        merged_part = IndexPart(name, merged, np.ones(len(merged.doc_ids), dtype=bool))
+        if len(merged.doc_ids):
+            self.__write_part(merged_part)
+
+        with self.lock:
+            current = {part.name: part for part in self.parts}
+
+            # documents deleted while the merge was running
+            live = merged_part.live.copy()
+            offset = 0
+            for source in sources:
+                now = current[source.name].live
+                new_ords = offset + np.cumsum(source.live) - 1
+                live[new_ords[source.live & ~now]] = False
+                offset += source.n_live
+            merged_part = replace(merged_part, live=live)
+
+            # the merged segment takes the place of the first source
+            source_names = {source.name for source in sources}
+            parts: List[IndexPart] = []
+            for part in self.parts:
+                if part.name == sources[0].name and merged_part.n_live:
+                    parts.append(merged_part)
+                elif part.name not in source_names:
+                    parts.append(part)
+
+            self.parts = tuple(parts)
+            self.__commit()
+
+            # open snapshots keep their mappings, unlinking is safe
+            for source in sources:
+                for suffix in (".seg", ".docs"):
+                    os.remove(os.path.join(self.path, f"{source.name}{suffix}"))
+
+            self.merge_thread = None
+
+        self.maybe_merge()
+
+    def __next_name(self) -> str:
+        name = f"{self.next_segment:06d}"
+        self.next_segment += 1
+
+        return name
+
+    # segment files are written before the commit that references them
+    def __write_part(self, part: IndexPart) -> None:
+        part.index.save(
+            self.path,
+            os.path.join(self.path, f"{part.name}.seg"),
+            os.path.join(self.path, f"{part.name}.docs"),
+        )
+
+    def __commit(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        write_json(
+            os.path.join(self.path, SEGMENTS_FILE),
+            {
+                "version": SEGMENTS_FORMAT_VERSION,
+                "next_segment": self.next_segment,
+                "segments": [
+                    {
+                        "name": part.name,
+                        "deleted": np.flatnonzero(~part.live).tolist(),
+                    }
+                    for part in self.parts
+                ],
+            },
+        )
+
+
+def write_json(path: str, data: Any) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    os.replace(tmp_path, path)
+
+
+@handle_json_errors
+def read_segments_file(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
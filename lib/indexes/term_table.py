@@ -0,0 +1,79 @@
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+
+# sorted term dictionary over a flat utf-8 blob
+# term i is blob[offsets[i]:offsets[i + 1]] and its row is i, lookups
+# are binary searches straight on the (possibly mmapped) bytes so no
+# python dict of the vocabulary is ever materialized
+class SortedTermTable(Mapping):
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_terms(cls, terms: List[str]) -> "SortedTermTable":
+        encoded = [term.encode("utf-8") for term in sorted(terms)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+
+        return cls(
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            offsets,
+        )
+
+    def term_bytes(self, row: int) -> bytes:
+        return self.blob[self.offsets[row] : self.offsets[row + 1]].tobytes()
+
+    def term(self, row: int) -> str:
+        return self.term_bytes(row).decode("utf-8")
+
+    # utf-8 byte order is code point order, the same order sorted() uses
+    # for str, so bisecting the raw bytes finds the row of a term
+    def __getitem__(self, term: str) -> int:
+        key = term.encode("utf-8")
+        row = bisect_left(_TermBytes(self), key)
+        if row < len(self) and self.term_bytes(row) == key:
+            return row
+
+        raise KeyError(term)
+
+    # rows of the terms starting with prefix, a contiguous run of the
+    # sorted table found with two binary searches, "" matches every term
+    def prefix_rows(self, prefix: str) -> range:
+        key = prefix.encode("utf-8")
+        if not key:
+            return range(len(self))
+
+        terms = _TermBytes(self)
+        start = bisect_left(terms, key)
+        # utf-8 never contains 0xff, so bumping the last byte gives the
+        # first key sorting after every term that starts with key
+        end = bisect_left(terms, key[:-1] + bytes([key[-1] + 1]), lo=start)
+
+        return range(start, end)
+
+    # (term, row) of every term starting with prefix in sorted order
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        return ((self.term(row), row) for row in self.prefix_rows(prefix))
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.term(row) for row in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+# sequence view used by bisect
+class _TermBytes:
+    def __init__(self, table: SortedTermTable) -> None:
+        self.table = table
+
+    def __getitem__(self, row: int) -> bytes:
+        return self.table.term_bytes(row)
+
+    def __len__(self) -> int:
+        return len(self.table)
@@ -0,0 +1,22 @@
+from typing import Tuple
+
+import numpy as np
+
+
+# top-k selection over (ordinal, score) pairs, ties are broken
+# towards the lower ordinal so results stay deterministic
+def top_k(
+    ords: np.ndarray,
+    scores: np.ndarray,
+    limit: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if limit <= 0 or not len(ords):
+        return ords[:0], scores[:0]
+
+    if limit < len(scores):
+        kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        keep = scores >= kth
+        ords, scores = ords[keep], scores[keep]
+
+    order = np.lexsort((ords, -scores))[:limit]
+    return ords[order], scores[order]
@@ -1,44 +1,31 @@
-from itertools import islice
-from typing import List, Tuple
+import json
+from typing import Any, Dict, List, Optional, Tuple
 
 from config.data import DEFAULT_SEARCH_LIMIT
+from lib.indexes.boolean_query import QuerySyntaxError
 from lib.indexes.inverted_index import InvertedIndex
+from lib.indexes.segmented_index import SegmentedIndex
 from typedicts.movies import Movie
 
 
-from .tokenize import tokenize
-
-
 CURRENT_INVERTED_INDEX = InvertedIndex()
 
+# opened on first use by populate_segmented_index
+SEGMENTED_INDEX: Optional[SegmentedIndex] = None
+
 
+# boolean keyword filter, see InvertedIndex.boolean_search
 def search(
     query: str,
     limit: int = DEFAULT_SEARCH_LIMIT,
 ) -> List[Movie]:
-    global index
-
     populate_index()
-
-    tokenized_query = tokenize(query)
-
-    if not tokenized_query:
+    try:
+        return CURRENT_INVERTED_INDEX.boolean_search(query, limit)
+    except QuerySyntaxError as e:
+        print(f"Invalid query '{query}': {str(e)}")
         return []
 
-    result_list: List[Movie] = []
-
-    for token in tokenized_query:
-        matching_docs = CURRENT_INVERTED_INDEX.get_documents(token)
-        result_list.extend(matching_docs)
-
-    result_list = list(
-        {movie["id"]: movie for movie in result_list}.values(),
-    )
-
-    return list(
-        islice(result_list, limit),
-    )
-
 
 # bm25search function
 def bm25search(
@@ -52,6 +39,15 @@ def bm25search(
     )
 
 
+# index terms completing a prefix, see InvertedIndex.complete
+def complete_terms(
+    prefix: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+) -> List[Tuple[str, int]]:
+    populate_index()
+    return CURRENT_INVERTED_INDEX.complete(prefix, limit)
+
+
 def calc_bm25_idf(term: str) -> float:
     populate_index()
     try:
@@ -99,10 +95,8 @@ def tf_idf(doc_id: int, term: str) -> float:
 def inverse_document_freq(term: str) -> float:
     populate_index()
 
-    term_doc_count = len(
-        CURRENT_INVERTED_INDEX.get_doc_ids(term),
-    )
-    total_doc_count = len(CURRENT_INVERTED_INDEX.docmap)
+    term_doc_count = CURRENT_INVERTED_INDEX.get_doc_freq(term)
+    total_doc_count = len(CURRENT_INVERTED_INDEX.docs)
 
     import math
 
@@ -126,6 +120,50 @@ def populate_index() -> None:
     print("Index loaded from cache.")
 
 
+# opens the segmented index once (empty until movies are ingested)
+def populate_segmented_index() -> SegmentedIndex:
+    global SEGMENTED_INDEX
+
+    if SEGMENTED_INDEX is None:
+        SEGMENTED_INDEX = SegmentedIndex.open()
+
+    return SEGMENTED_INDEX
+
+
+# adds or replaces the movies of a movies.json style file in the
+# segmented index and makes them durable
+def ingest_movies(movies_file: str) -> Dict[str, Any]:
+    with open(movies_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    index = populate_segmented_index()
+    index.add_movies(data["movies"] if isinstance(data, dict) else data)
+    index.flush()
+    index.wait_for_merges()
+
+    return index.stats()
+
+
+def unindex_movies(doc_ids: List[int]) -> int:
+    index = populate_segmented_index()
+    deleted = index.delete_movies(doc_ids)
+    index.flush()
+    index.wait_for_merges()
+
+    return deleted
+
+
+def segmented_search(
+    query: str,
+    limit: int,
+) -> List[Tuple[int, str, float]]:
+    return populate_segmented_index().bm25_search(query, limit)
+
+
+def segment_stats() -> Dict[str, Any]:
+    return populate_segmented_index().stats()
+
+
 def process_dot_exit():
     import sys
 
@@ -0,0 +1,35 @@
+import multiprocessing
+from typing import Callable, Iterator, Sequence, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+# fn over every item in order, computed by a pool of worker processes
+# one window of items at a time so results never pile up ahead of the
+# consumer, fn has to be a module level function
+# workers are forked: the parent has the models and the stemmer loaded
+# already and a spawned worker would import (and load) them again, on
+# platforms without fork (windows) fn runs in process instead
+def parallel_map(
+    fn: Callable[[T], R],
+    items: Sequence[T],
+    processes: int,
+    window: int,
+) -> Iterator[R]:
+    if (
+        processes <= 1
+        or len(items) <= 1
+        or "fork" not in multiprocessing.get_all_start_methods()
+    ):
+        yield from map(fn, items)
+        return
+
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        for start in range(0, len(items), window):
+            yield from pool.map(
+                fn,
+                items[start : start + window],
+                chunksize=max(1, window // (4 * processes)),
+            )
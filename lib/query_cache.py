@@ -0,0 +1,139 @@
+import atexit
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from config.data import (
+    QUERY_CACHE_MAX_BYTES,
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_PATH,
+    QUERY_CACHE_PERSIST,
+)
+
+
+# queries differing only in surrounding or repeated whitespace embed alike
+def normalize_query(text: str) -> str:
+    return " ".join(text.split())
+
+
+# lru cache of query embeddings keyed by (model name, normalized query)
+# bounded by both the number of entries and the bytes of the vectors,
+# thread safe so server workers share it, with a path it is loaded on
+# creation and written back at exit so head queries survive restarts
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+
+        # least recently used first
+        self.entries: OrderedDict[Tuple[str, str], np.ndarray] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = (model, normalize_query(text))
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, model: str, text: str, embedding: np.ndarray) -> None:
+        # cached arrays are shared between callers
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        if self.max_entries <= 0 or embedding.nbytes > self.max_bytes:
+            return
+
+        key = (model, normalize_query(text))
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+
+            self.entries[key] = embedding
+            self.bytes += embedding.nbytes
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    # entries are written in lru order so a reload keeps the recency
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        with self.lock:
+            keys = list(self.entries)
+            vectors = list(self.entries.values())
+
+        # vector i is values[offsets[i]:offsets[i + 1]] (models may differ
+        # in dimension)
+        offsets = np.zeros(len(vectors) + 1, dtype=np.int64)
+        np.cumsum([len(vector) for vector in vectors], out=offsets[1:])
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            models=np.array([model for model, _ in keys], dtype=str),
+            texts=np.array([text for _, text in keys], dtype=str),
+            offsets=offsets,
+            values=(
+                np.concatenate(vectors) if vectors else np.empty(0, dtype=np.float32)
+            ),
+        )
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with np.load(self.path) as data:
+                offsets = data["offsets"]
+                values = data["values"]
+                entries = zip(data["models"].tolist(), data["texts"].tolist())
+                for idx, (model, text) in enumerate(entries):
+                    self.put(model, text, values[offsets[idx] : offsets[idx + 1]])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: could not load query cache {self.path}: {e}")
+
+
+# shared by every SemanticSearch of the process (keys carry the model)
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(
+    path=QUERY_CACHE_PATH if QUERY_CACHE_PERSIST else None,
+)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+
+from config.data import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS
+from lib.build_manifest import cache_generation
+
+
+T = TypeVar("T")
+
+
+# lru + ttl cache of complete search responses
+# everything a response depends on has to be part of the key, the
+# generation of the cache on disk is checked on every lookup and a new
+# build (cli/build.py writes a new generation) drops every entry
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl: float = RESULT_CACHE_TTL_SECONDS,
+        generation: Callable[[], str] = cache_generation,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = generation
+
+        # key -> (expiry time, response), least recently used first
+        self.entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self.current_generation = generation()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    # cached response for key or compute() stored under it, unless
+    # cacheable(response) is False (degraded responses are served but
+    # never stored)
+    # compute runs outside the lock, concurrent misses of one key may
+    # both compute, the last one wins
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], T],
+        cacheable: Callable[[T], bool] = lambda response: True,
+    ) -> T:
+        generation = self.generation()
+        now = time.monotonic()
+
+        with self.lock:
+            if generation != self.current_generation:
+                self.entries.clear()
+                self.current_generation = generation
+
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        response = compute()
+        if self.max_entries <= 0 or not cacheable(response):
+            return response
+
+        # a build finished while computing, the response may be stale
+        if self.generation() != generation:
+            return response
+
+        with self.lock:
+            if generation != self.current_generation:
+                return response
+
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return response
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "generation": self.current_generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# shared by the hybrid search entry points of the process
+RESULT_CACHE = ResultCache()
@@ -1,101 +1,386 @@
+import hashlib
+import os
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Iterable, List, Optional, Tuple
 from numpy._typing import ArrayLike
 from sentence_transformers import SentenceTransformer
 import numpy as np
 
-from config.data import MOVIE_EMBDEDDINGS_PATH
-from lib.data_loaders import load_movie_data
+from config.data import (
+    BATCH_SEARCH_SIZE,
+    EMBEDDING_QUANTIZATION,
+    IVF_NPROBE,
+    MOVIE_CODES_PATH,
+    MOVIE_EMBDEDDINGS_PATH,
+    MOVIE_IVF_PATH,
+    MOVIE_QUANTIZER_PATH,
+    SEMANTIC_INDEX_TYPE,
+)
+from lib.embedding_build import stream_embeddings, texts_digest
+from lib.embedding_store import EmbeddingStore
+from lib.indexes.doc_store import DocStore, get_doc_store
+from lib.indexes.flat_index import FlatIndex
+from lib.indexes.ivf_index import IVFIndex
+from lib.indexes.npy import is_mapping_of, load_npy, save_npy
+from lib.indexes.quantization import QuantizedIndex
+from lib.query_cache import QUERY_EMBEDDING_CACHE, QueryEmbeddingCache
+from typedicts.embedding_files import EmbeddingFiles
 from typedicts.movies import Movie
 from typedicts.search_res import SemanticSearchRes
 
 
+MOVIE_FILES = EmbeddingFiles(
+    vectors=MOVIE_EMBDEDDINGS_PATH,
+    ivf=MOVIE_IVF_PATH,
+    codes=MOVIE_CODES_PATH,
+    quantizer=MOVIE_QUANTIZER_PATH,
+)
+
+
 class SemanticSearch:
-    def __init__(self, model_name: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        index_type: str = SEMANTIC_INDEX_TYPE,
+        nprobe: int = IVF_NPROBE,
+        quantization: str = EMBEDDING_QUANTIZATION,
+        query_cache: QueryEmbeddingCache = QUERY_EMBEDDING_CACHE,
+    ) -> None:
         # model that is used for embedding
+        self.model_name = model_name or "all-MiniLM-L6-v2"
         self.model = SentenceTransformer(
-            model_name or "all-MiniLM-L6-v2",
+            self.model_name,
         )
-
-        # n- dimensional array of embeddings
+        # opened by the first build that encodes documents
+        self.embedding_store: Optional[EmbeddingStore] = None
+        # lru cache of query embeddings (shared process wide by default)
+        self.query_cache = query_cache
+
+        # "flat" (exact) or "ivf" (approximate) vector index
+        self.index_type = index_type
+        # lists scanned per query when the index is ivf
+        self.nprobe = nprobe
+        # "none", "int8" or "pq" codes searched instead of float vectors
+        self.quantization = quantization
+
+        # n- dimensional array of l2 normalized embeddings
         self.embeddings: np.ndarray = np.empty((0,))
-        # list of documents
-        self.documents: List[Movie] = []
-        # map for doucment_id -> Movie
-        self.doc_map: Dict[int, Movie] = {}
+        # cosine index over the embeddings
+        self.index: FlatIndex | IVFIndex | QuantizedIndex = FlatIndex(self.embeddings)
+        # stored fields of the embedded documents (row = ordinal), only
+        # read for the results that are returned
+        self.docs: DocStore = DocStore()
 
     # this one is actual search function now
+    # one matrix-vector product over the normalized embeddings
     def search(self, query: str, limit: int) -> List[SemanticSearchRes]:
+        return self.results(*self.__search_index(query, limit))
+
+    # search without the stored fields: (doc id, score) pairs, for
+    # fusing long candidate lists without touching the doc store
+    def rank(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        return self.ranks(*self.__search_index(query, limit))
+
+    def __search_index(self, query: str, limit: int) -> Tuple[np.ndarray, np.ndarray]:
         if not self.embeddings.size > 0:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
             )
 
-        query_embedding = self.generate_embedding(query)
+        return self.index.search(
+            self.generate_embedding(query),
+            limit,
+        )
+
+    # batch version of search: all queries are encoded with a single
+    # model call and scored with one matrix product per batch
+    def search_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int = BATCH_SEARCH_SIZE,
+    ) -> List[List[SemanticSearchRes]]:
+        return [
+            self.results(doc_idxs, scores)
+            for doc_idxs, scores in self.__search_index_many(
+                queries,
+                limit,
+                batch_size,
+            )
+        ]
+
+    # batch version of rank
+    def rank_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int = BATCH_SEARCH_SIZE,
+    ) -> List[List[Tuple[int, float]]]:
+        return [
+            self.ranks(doc_idxs, scores)
+            for doc_idxs, scores in self.__search_index_many(
+                queries,
+                limit,
+                batch_size,
+            )
+        ]
 
-        smilarity_res: List[Tuple[float, Movie]] = []
-        for embedding, document in zip(self.embeddings, self.documents):
-            similiarity_score = cosine_similarity(query_embedding, embedding)
-            smilarity_res.append(
-                (
-                    similiarity_score,
-                    document,
+    def __search_index_many(
+        self,
+        queries: List[str],
+        limit: int,
+        batch_size: int,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if not self.embeddings.size > 0:
+            raise ValueError(
+                "No embeddings loaded. Call `load_or_create_embeddings` first."
+            )
+
+        query_embeddings = self.generate_embeddings(queries)
+
+        ranked: List[Tuple[np.ndarray, np.ndarray]] = []
+        for start in range(0, len(queries), batch_size):
+            ranked.extend(
+                self.index.search_many(
+                    query_embeddings[start : start + batch_size],
+                    limit,
                 )
             )
 
-        sorted_res = sorted(smilarity_res, key=lambda mem: mem[0], reverse=True)[:limit]
+        return ranked
 
+    # search results of ranked rows, stored fields are fetched here
+    def results(
+        self,
+        doc_idxs: np.ndarray,
+        scores: np.ndarray,
+    ) -> List[SemanticSearchRes]:
         return [
             SemanticSearchRes(
                 id=doc["id"],
-                score=round(score, 4),
+                score=round(float(score), 4),
                 title=doc["title"],
                 description=doc["description"],
             )
-            for score, doc in sorted_res
+            for doc, score in zip(self.docs.movies(doc_idxs.tolist()), scores)
+        ]
+
+    # (doc id, score) of ranked rows, scores rounded like results()
+    def ranks(
+        self,
+        doc_idxs: np.ndarray,
+        scores: np.ndarray,
+    ) -> List[Tuple[int, float]]:
+        return [
+            (doc_id, round(float(score), 4))
+            for doc_id, score in zip(self.docs.doc_ids[doc_idxs].tolist(), scores)
         ]
 
+    def set_embeddings(
+        self,
+        embeddings: np.ndarray,
+        normalized: bool = False,
+    ) -> None:
+        self.index = self.create_index(embeddings, MOVIE_FILES, normalized)
+        self.embeddings = self.index.vectors
+
+    # embeddings are saved l2 normalized so they are searched straight
+    # from a read-only mapping: startup reads nothing and forked or
+    # separately started workers share one copy through the page cache
+    def load_embeddings(self, path: str) -> np.ndarray:
+        return load_npy(path)
+
+    # quantized, flat or ivf index over the embeddings, quantization
+    # takes precedence over index_type, missing or stale ivf / code
+    # files are rebuilt in memory
+    def create_index(
+        self,
+        embeddings: np.ndarray,
+        files: EmbeddingFiles,
+        normalized: bool = False,
+    ) -> FlatIndex | IVFIndex | QuantizedIndex:
+        if self.quantization != "none":
+            if os.path.exists(files.codes) and os.path.exists(files.quantizer):
+                try:
+                    return QuantizedIndex.load(
+                        files.codes,
+                        files.quantizer,
+                        embeddings,
+                        self.quantization,
+                    )
+                except ValueError as e:
+                    print(f"Warning: {e}")
+
+            print(f"building {self.quantization} codes in memory.....")
+            return QuantizedIndex.build(
+                embeddings,
+                self.quantization,
+                normalized=normalized,
+            )
+
+        if self.index_type != "ivf":
+            return FlatIndex(embeddings, normalized)
+
+        if os.path.exists(files.ivf):
+            try:
+                return IVFIndex.load(files.ivf, embeddings, self.nprobe, normalized)
+            except ValueError as e:
+                print(f"Warning: {e}")
+
+        print("building ivf index in memory.....")
+        return IVFIndex.build(embeddings, nprobe=self.nprobe, normalized=normalized)
+
     # this function does not check if
     # the cache dir for MOVIE_EMBDEDDINGS_PATH exists
     # because that's the starting point of the application
     # if cache is missing files the main function will exit
     # therefore the flow won't reach the function in the fist place
+    # docs are the stored fields of the embedded documents, the shared
+    # doc store of the cache by default
     def load_or_create_embeddings(
         self,
-        documents: List[Movie],
+        docs: Optional[DocStore] = None,
     ) -> np.ndarray:
-        if len(self.embeddings) == len(documents):
+        self.docs = get_doc_store() if docs is None else docs
+        if len(self.embeddings) == len(self.docs):
             return self.embeddings
 
-        self.documents = documents
-
-        for document in documents:
-            self.doc_map[int(document["id"])] = document
-
-        self.embeddings = np.load(MOVIE_EMBDEDDINGS_PATH)
+        self.set_embeddings(
+            self.load_embeddings(MOVIE_EMBDEDDINGS_PATH),
+            normalized=True,
+        )
         return self.embeddings
 
     def build_embeddings(
         self,
         documents: List[Movie],
     ) -> np.ndarray:
-        self.documents = documents
+        self.docs = DocStore.from_movies(documents)
 
-        content_list = []
-        for document in documents:
-            self.doc_map[int(document["id"])] = document
-            content_list.append(
-                f"{document['title']}:{document['description']}",
-            )
+        # written (already normalized) to the cache path batch by batch
+        self.stream_embeddings(
+            MOVIE_EMBDEDDINGS_PATH,
+            lambda: (embedding_text(document) for document in documents),
+            len(documents),
+        )
+        self.set_embeddings(
+            self.load_embeddings(MOVIE_EMBDEDDINGS_PATH),
+            normalized=True,
+        )
+        return self.embeddings
 
-        self.embeddings = self.model.encode(content_list, show_progress_bar=True)
+    # incremental version of build_embeddings
+    # reuse[idx] is the row of an unchanged document in the saved
+    # embeddings (or -1), those rows are copied and only the added or
+    # changed documents are encoded
+    def update_embeddings(
+        self,
+        documents: List[Movie],
+        reuse: np.ndarray,
+    ) -> np.ndarray:
+        self.docs = DocStore.from_movies(documents)
+
+        self.set_embeddings(
+            self.merge_embeddings(
+                self.load_embeddings(MOVIE_EMBDEDDINGS_PATH),
+                reuse,
+                [embedding_text(documents[idx]) for idx in np.flatnonzero(reuse < 0)],
+            ),
+            normalized=True,
+        )
         return self.embeddings
 
+    # rows reuse >= 0 come from old_embeddings, the remaining rows (in
+    # order) are the normalized encodings of new_texts
+    def merge_embeddings(
+        self,
+        old_embeddings: np.ndarray,
+        reuse: np.ndarray,
+        new_texts: List[str],
+    ) -> np.ndarray:
+        embeddings = np.empty(
+            (len(reuse), self.model.get_sentence_embedding_dimension() or 0),
+            dtype=np.float32,
+        )
+
+        kept = np.flatnonzero(reuse >= 0)
+        embeddings[kept] = old_embeddings[reuse[kept]]
+        if new_texts:
+            embeddings[reuse < 0] = self.encode_documents(new_texts)
+
+        return embeddings
+
+    # l2 normalized embeddings of document texts, texts this model has
+    # encoded before (in any build) come from the embedding store
+    def encode_documents(self, texts: List[str], verbose: bool = True) -> np.ndarray:
+        if self.embedding_store is None:
+            self.embedding_store = EmbeddingStore()
+
+        return self.embedding_store.encode(
+            self.model_name,
+            texts,
+            lambda batch: self.model.encode(batch, show_progress_bar=verbose),
+            self.model.get_sentence_embedding_dimension() or 0,
+            verbose=verbose,
+        )
+
+    # encodes the n_rows texts of texts() into the .npy file at path
+    # without holding them all in memory (see stream_embeddings), texts
+    # is called twice: for the fingerprint of a resumable build and then
+    # to stream the texts, digest replaces the first call when given
+    def stream_embeddings(
+        self,
+        path: str,
+        texts: Callable[[], Iterable[str]],
+        n_rows: int,
+        digest: Optional[bytes] = None,
+    ) -> None:
+        dim = self.model.get_sentence_embedding_dimension() or 0
+        fingerprint = hashlib.sha1(
+            f"{self.model_name}\0{dim}\0{n_rows}\0".encode("utf-8")
+            + (digest if digest is not None else texts_digest(texts()))
+        ).hexdigest()
+
+        stream_embeddings(
+            path,
+            texts(),
+            n_rows,
+            dim,
+            fingerprint,
+            lambda batch: self.encode_documents(batch, verbose=False),
+        )
+
     def save_embeddings(self) -> None:
-        np.save(
-            MOVIE_EMBDEDDINGS_PATH,
-            self.embeddings,
+        self.save_index_files(self.index, MOVIE_FILES)
+
+    # float vectors, the ivf file (whatever index_type is in use so
+    # switching to ivf never has to cluster on the query path) and the
+    # codes when a quantization is selected
+    def save_index_files(
+        self,
+        index: FlatIndex | IVFIndex | QuantizedIndex,
+        files: EmbeddingFiles,
+    ) -> None:
+        # streamed builds map the vectors straight from files.vectors
+        if not is_mapping_of(index.vectors, files.vectors):
+            save_npy(files.vectors, index.vectors)
+
+        ivf_index = (
+            index
+            if isinstance(index, IVFIndex)
+            else IVFIndex.build(index.vectors, nprobe=self.nprobe, normalized=True)
+        )
+        ivf_index.save(files.ivf)
+
+        if self.quantization == "none":
+            return
+
+        quantized_index = (
+            index
+            if isinstance(index, QuantizedIndex)
+            else QuantizedIndex.build(index.vectors, self.quantization, normalized=True)
         )
+        quantized_index.save(files.codes, files.quantizer)
 
     def generate_embedding(
         self,
@@ -107,9 +392,51 @@ class SemanticSearch:
             print("Warning: Empty text provided for embedding.")
             return np.array([])
 
-        return self.model.encode(
-            [text],
-        )[0]
+        embedding = self.query_cache.get(self.model_name, text)
+        if embedding is None:
+            embedding = self.model.encode(
+                [text],
+            )[0]
+            self.query_cache.put(self.model_name, text, embedding)
+
+        return embedding
+
+    # encodes many texts in one model call, empty texts get zero
+    # vectors which score 0 against every document
+    def generate_embeddings(
+        self,
+        texts: List[str],
+    ) -> np.ndarray:
+        stripped = [text.strip() for text in texts]
+        non_empty = [idx for idx, text in enumerate(stripped) if text]
+
+        embeddings = np.zeros(
+            (len(texts), self.model.get_sentence_embedding_dimension() or 0),
+            dtype=np.float32,
+        )
+        # cached queries are copied, the rest is encoded in one call
+        misses = []
+        for idx in non_empty:
+            cached = self.query_cache.get(self.model_name, stripped[idx])
+            if cached is None:
+                misses.append(idx)
+            else:
+                embeddings[idx] = cached
+
+        if misses:
+            encoded = self.model.encode(
+                [stripped[idx] for idx in misses],
+            )
+            embeddings[misses] = encoded
+            for idx, embedding in zip(misses, encoded):
+                self.query_cache.put(self.model_name, stripped[idx], embedding)
+
+        return embeddings
+
+
+# text a movie embedding is computed from
+def embedding_text(document: Movie) -> str:
+    return f"{document['title']}:{document['description']}"
 
 
 def semantic_chunk(
@@ -160,11 +487,14 @@ def chunk(
     ]
 
 
-def semantic_search(query: str, limit: int) -> List[SemanticSearchRes]:
-    semantic_search = SemanticSearch()
-    semantic_search.load_or_create_embeddings(
-        load_movie_data(),
-    )
+def semantic_search(
+    query: str,
+    limit: int,
+    index_type: str = SEMANTIC_INDEX_TYPE,
+    nprobe: int = IVF_NPROBE,
+) -> List[SemanticSearchRes]:
+    semantic_search = SemanticSearch(index_type=index_type, nprobe=nprobe)
+    semantic_search.load_or_create_embeddings()
 
     search_results = []
     try:
@@ -207,12 +537,9 @@ def cosine_similarity(vec1: ArrayLike, vec2: ArrayLike) -> float:
 def verify_embeddings() -> None:
     semantic_search = SemanticSearch()
 
-    documents = load_movie_data()
-    embeddings = semantic_search.load_or_create_embeddings(
-        documents,
-    )
+    embeddings = semantic_search.load_or_create_embeddings()
 
-    print(f"Number of docs:   {len(documents)}")
+    print(f"Number of docs:   {len(semantic_search.docs)}")
     print(
         f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions"
     )
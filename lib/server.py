@@ -0,0 +1,261 @@
+import json
+import os
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Any, Callable, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from config.data import ALPHA, DEFAULT_SEARCH_LIMIT, RRF_K
+from lib.batch_search import (
+    bm25_record,
+    chunk_record,
+    rrf_record,
+    semantic_record,
+    weighted_record,
+)
+from lib.chunked_semantic_search import CHUNKED_SEMEANTIC_SEARCH, populate_embeddings
+from lib.enums.enahnce_methods import EnhanceMethod
+from lib.enums.rerank_methods import RerankMethod
+from lib.hybrid_search import HybridSearch, exec_rrf_search, exec_weighted_search
+from lib.keyword_search import (
+    CURRENT_INVERTED_INDEX,
+    populate_index,
+    populate_segmented_index,
+)
+from lib.query_cache import QUERY_EMBEDDING_CACHE
+from lib.result_cache import RESULT_CACHE
+
+
+# every resource is loaded exactly once when the service starts :-
+# 1. the mmapped bm25 segment
+# 2. one sentence transformer with the movie and chunk embeddings
+# 3. the hybrid engine on top of both
+# 4. the segmented bm25 index, which takes ingests while serving
+# the cross encoder is loaded lazily by the first cross_encoder rerank
+class SearchService:
+    def __init__(self) -> None:
+        populate_index()
+        populate_embeddings()
+        self.segmented = populate_segmented_index()
+
+        self.hybrid = HybridSearch(
+            semantic_search=CHUNKED_SEMEANTIC_SEARCH,
+            inverted_idx=CURRENT_INVERTED_INDEX,
+        )
+
+        # path -> handler(query, params)
+        self.routes: Dict[str, Callable[[str, Dict[str, str]], List[Any]]] = {
+            "/keyword": self.keyword,
+            "/boolean": self.boolean,
+            "/segmented": self.segmented_keyword,
+            "/semantic": self.semantic,
+            "/chunked": self.chunked,
+            "/weighted": self.weighted,
+            "/rrf": self.rrf,
+        }
+
+    def keyword(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            bm25_record(res)
+            for res in CURRENT_INVERTED_INDEX.bm25_search(
+                query,
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+            )
+        ]
+
+    # exact boolean filter, matches in catalogue order
+    def boolean(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            {"id": movie["id"], "title": movie["title"]}
+            for movie in CURRENT_INVERTED_INDEX.boolean_search(
+                query,
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+            )
+        ]
+
+    def segmented_keyword(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            bm25_record(res)
+            for res in self.segmented.bm25_search(
+                query,
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+            )
+        ]
+
+    # {"movies": [...], "delete": [ids], "flush": bool}, ingested movies
+    # are searchable through /segmented as soon as this returns
+    def ingest(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        removed = self.segmented.delete_movies(
+            [int(doc_id) for doc_id in body.get("delete", [])],
+        )
+        self.segmented.add_movies(body.get("movies", []))
+        if body.get("flush"):
+            self.segmented.flush()
+
+        return {"removed": removed, **self.segmented.stats()}
+
+    # counters for sizing the caches
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "query_cache": QUERY_EMBEDDING_CACHE.stats(),
+            "result_cache": RESULT_CACHE.stats(),
+        }
+
+    def semantic(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            semantic_record(res)
+            for res in CHUNKED_SEMEANTIC_SEARCH.search(
+                query,
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+            )
+        ]
+
+    def chunked(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            chunk_record(res)
+            for res in CHUNKED_SEMEANTIC_SEARCH.search_chunks(
+                query,
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+            )
+        ]
+
+    def weighted(self, query: str, params: Dict[str, str]) -> List[Any]:
+        return [
+            weighted_record(res)
+            for res in exec_weighted_search(
+                query,
+                float(params.get("alpha", ALPHA)),
+                int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+                hybrid_search_instance=self.hybrid,
+            )
+        ]
+
+    def rrf(self, query: str, params: Dict[str, str]) -> List[Any]:
+        enhance = params.get("enhance")
+        rerank = params.get("rerank")
+
+        return [
+            rrf_record(res)
+            for res in exec_rrf_search(
+                query,
+                limit=int(params.get("limit", DEFAULT_SEARCH_LIMIT)),
+                k=int(params.get("k", RRF_K)),
+                enahnce_method=EnhanceMethod(enhance) if enhance else None,
+                rerank_method=RerankMethod(rerank) if rerank else None,
+                hybrid_search_instance=self.hybrid,
+            )
+        ]
+
+
+# GET /<mode>?q=<query>&limit=<n>[&alpha=..][&k=..][&enhance=..][&rerank=..]
+# answers with {"query": ..., "results": [...]}, GET /health is a liveness probe
+# and GET /stats reports cache counters
+# POST /ingest feeds the segmented index (see SearchService.ingest)
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    server: "ThreadingHTTPServer | UnixThreadingHTTPServer"
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        service: SearchService = self.server.service  # type: ignore[attr-defined]
+
+        if url.path == "/health":
+            self.send_json(HTTPStatus.OK, {"status": "ok"})
+            return
+
+        if url.path == "/stats":
+            self.send_json(HTTPStatus.OK, service.stats())
+            return
+
+        route = service.routes.get(url.path)
+        if route is None:
+            self.send_json(
+                HTTPStatus.NOT_FOUND,
+                {"error": f"unknown endpoint {url.path}"},
+            )
+            return
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        query = params.get("q", "").strip()
+        if not query:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": "missing query `q`"})
+            return
+
+        try:
+            results = route(query, params)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        self.send_json(HTTPStatus.OK, {"query": query, "results": results})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        service: SearchService = self.server.service  # type: ignore[attr-defined]
+
+        if url.path != "/ingest":
+            self.send_json(
+                HTTPStatus.NOT_FOUND,
+                {"error": f"unknown endpoint {url.path}"},
+            )
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            if not isinstance(body, dict):
+                raise ValueError("body must be a json object")
+            result = service.ingest(body)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+
+        self.send_json(HTTPStatus.OK, result)
+
+    def send_json(self, status: HTTPStatus, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # unix socket peers have no (host, port) address
+    def address_string(self) -> str:
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+
+        return "unix"
+
+
+class UnixThreadingHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host: str, port: int, socket_path: str | None = None) -> None:
+    service = SearchService()
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixThreadingHTTPServer(socket_path, SearchRequestHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+        address = f"http://{host}:{port}"
+
+    server.service = service  # type: ignore[attr-defined]
+
+    print(f"Serving search on {address} (ctrl+c to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nshutting down...")
+    finally:
+        server.server_close()
+        # buffered ingests are made durable before exiting
+        service.segmented.flush()
+        service.segmented.wait_for_merges()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -1,18 +1,41 @@
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from config.data import STEM_CACHE_SIZE
+
 from .data_loaders import load_stop_words
-from .clean_str import get_cleaned_string
+from .clean_str import clean_words
 
-from .stem_words import stem_words
+from .stem_words import stemmer
 
 # loading the stopd words in memory for once
 # yeah this could have been an array for set gives O(1) time complextiy for checks
 STOPWORDS = set(load_stop_words())
 
 
+# index term of a cleaned word, None for stop words
+# memoized: word frequencies follow zipf's law so a few thousand
+# distinct words make up most of the words of the catalogue and the
+# porter stemmer runs once per distinct word instead of once per word
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def index_term(word: str) -> Optional[str]:
+    if word in STOPWORDS:
+        return None
+
+    return stemmer.stem(word)
+
+
 # tokenizes the passed string
 def tokenize(arg_str: str) -> list[str]:
-    cleaned = get_cleaned_string(
-        arg_str,
-    )
-    return stem_words(
-        [token for token in cleaned.split() if token and token not in STOPWORDS],
-    )
+    return [
+        term for term in map(index_term, clean_words(arg_str)) if term is not None
+    ]
+
+
+# tokenize over many texts (index builders), same tokens in the same order
+def tokenize_many(texts: Iterable[str]) -> List[List[str]]:
+    term_of = index_term
+    return [
+        [term for term in map(term_of, clean_words(text)) if term is not None]
+        for text in texts
+    ]
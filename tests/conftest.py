@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+from typing import Callable, Iterator, List
+
+import pytest
+
+import lib.ai.action as action
+from lib.ai.llm_cache import LLMCache
+from lib.ai.rate_limit import TokenBucket
+
+
+# local stand-in for the gemini client, answers every prompt with
+# respond(prompt, config) and records the prompts it was asked
+class FakeLLMClient:
+    def __init__(self, respond: Callable) -> None:
+        self.respond = respond
+        self.prompts: List[str] = []
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+
+    def generate_content(self, model: str, contents: str, config=None):
+        self.prompts.append(contents)
+        return SimpleNamespace(text=self.respond(contents, config))
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch) -> LLMCache:
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(action, "get_llm_cache", lambda: cache)
+    return cache
+
+
+# unlimited rate limiter, tests that pace requests install their own
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch) -> None:
+    monkeypatch.setattr(action, "LLM_RATE_LIMITER", TokenBucket(0, 0))
+
+
+@pytest.fixture
+def fake_llm() -> Iterator[Callable[[Callable], FakeLLMClient]]:
+    def install(respond: Callable) -> FakeLLMClient:
+        client = FakeLLMClient(respond)
+        action.set_llm_client(client)
+        return client
+
+    yield install
+    action.set_llm_client(None)
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+
+import lib.ai.llm_cache as llm_cache
+from config.data import LLM_MODEL
+from lib.ai.action import generate_resp
+from lib.ai.llm_cache import LLMCache
+from typedicts.llm_response import CachedLLMResponse
+
+
+TTLS = {"spell": 100.0, "individual": 10.0, "default": 10.0}
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def test_hit_skips_the_client(llm_cache, fake_llm):
+    client = fake_llm(lambda prompt, config: "fixed query")
+
+    first = generate_resp("fix the spelling", method="spell")
+    second = generate_resp("fix the spelling", method="spell")
+
+    assert first.text == "fixed query"
+    assert second == CachedLLMResponse(text="fixed query")
+    assert client.prompts == ["fix the spelling"]
+    assert llm_cache.stats()["spell"]["hits"] == 1
+
+
+def test_miss_stores_the_response(llm_cache, fake_llm):
+    fake_llm(lambda prompt, config: prompt.upper())
+
+    generate_resp("rewrite me", method="rewrite")
+
+    assert llm_cache.get("rewrite", LLM_MODEL, "rewrite me") == "REWRITE ME"
+    assert llm_cache.stats()["rewrite"]["entries"] == 1
+
+
+def test_calls_without_a_method_are_not_cached(llm_cache, fake_llm):
+    client = fake_llm(lambda prompt, config: "answer")
+
+    generate_resp("prompt")
+    generate_resp("prompt")
+
+    assert len(client.prompts) == 2
+    assert llm_cache.stats() == {}
+
+
+def test_ttl_is_per_method(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"), ttls=TTLS)
+    cache.put("spell", "model", "a", "spelled")
+    cache.put("individual", "model", "b", "7")
+    cache.put("expand", "model", "c", "expanded")
+
+    clock.value += 50
+
+    assert cache.get("spell", "model", "a") == "spelled"
+    assert cache.get("individual", "model", "b") is None
+    # methods without their own ttl use the default one
+    assert cache.get("expand", "model", "c") is None
+
+    clock.value += 60
+
+    assert cache.get("spell", "model", "a") is None
+
+
+def test_expired_entries_are_swept(tmp_path, clock):
+    cache = LLMCache(
+        str(tmp_path / "llm_cache.sqlite"),
+        ttls=TTLS,
+        sweep_interval=2,
+    )
+    cache.put("individual", "model", "a", "1")
+
+    clock.value += 50
+    cache.put("spell", "model", "b", "spelled")
+
+    assert cache.entries == 1
+    assert cache.stats().keys() == {"spell"}
+
+
+def test_least_recently_used_are_evicted(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"), max_entries=2, ttls=TTLS)
+    cache.put("spell", "model", "a", "1")
+    clock.value += 1
+    cache.put("spell", "model", "b", "2")
+    clock.value += 1
+    # a hit makes a the most recently used one
+    assert cache.get("spell", "model", "a") == "1"
+    clock.value += 1
+    cache.put("spell", "model", "c", "3")
+
+    assert cache.entries == 2
+    assert cache.get("spell", "model", "a") == "1"
+    assert cache.get("spell", "model", "b") is None
+    assert cache.get("spell", "model", "c") == "3"
+
+
+def test_entry_count_survives_reopening(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMCache(path, max_entries=3)
+    for prompt in "abc":
+        cache.put("spell", "model", prompt, prompt)
+    cache.put("spell", "model", "a", "replaced")
+
+    assert cache.entries == 3
+    assert LLMCache(path, max_entries=3).entries == 3
+
+
+def test_llm_cache_clear_drops_one_method(llm_cache, capsys):
+    from cli.parser import setup_parsers
+    from lib.actions import act
+
+    llm_cache.put("spell", LLM_MODEL, "a", "spelled")
+    llm_cache.put("individual", LLM_MODEL, "b", "7")
+    llm_cache.put("individual", LLM_MODEL, "c", "3")
+
+    parser = setup_parsers()
+    args = parser.parse_args(["hybrid", "llm-cache-clear", "--method", "individual"])
+    act(args, parser)
+
+    assert "Dropped 2 cached responses" in capsys.readouterr().out
+    assert llm_cache.stats().keys() == {"spell"}
+    assert llm_cache.entries == 1
@@ -0,0 +1,156 @@
+import re
+import time
+from types import SimpleNamespace
+from typing import List
+
+import httpx
+import pytest
+from google.genai.errors import ClientError
+
+import lib.ai.action as action
+from lib.ai.action import request_resp
+from lib.ai.rate_limit import TokenBucket, backoff_delay
+from lib.hybrid_search import rerank_individual
+from typedicts.search_res import RRFSearchResult
+
+
+def rate_limited() -> ClientError:
+    return ClientError(
+        429,
+        {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED"}},
+    )
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    slept: List[float] = []
+    monkeypatch.setattr(
+        action,
+        "time",
+        SimpleNamespace(sleep=slept.append, monotonic=time.monotonic),
+    )
+    return slept
+
+
+def rrf_results(n: int) -> List[RRFSearchResult]:
+    return [
+        RRFSearchResult(
+            id=doc_id,
+            movie={"id": doc_id, "title": f"movie{doc_id}", "description": ""},
+            rrf_score=1 / (60 + doc_id),
+            semantic_rank=doc_id,
+            keyword_rank=doc_id,
+        )
+        for doc_id in range(1, n + 1)
+    ]
+
+
+def movie_id(prompt: str) -> int:
+    return int(re.search(r"movie(\d+)", prompt).group(1))
+
+
+def test_backoff_delay_grows_with_jitter_and_is_capped():
+    for attempt in range(8):
+        ceiling = min(30.0, 2**attempt)
+        assert ceiling / 2 <= backoff_delay(attempt, 1.0, cap=30.0) <= ceiling
+
+
+def test_token_bucket_gives_up_at_the_deadline():
+    bucket = TokenBucket(rate=1.0, capacity=1)
+
+    assert bucket.acquire()
+    assert not bucket.acquire(deadline=time.monotonic() + 0.1)
+
+
+def test_429_is_retried_with_backoff(fake_llm, sleeps, monkeypatch):
+    # no refill over the test, every attempt spends one of the 3 tokens
+    bucket = TokenBucket(rate=1e-9, capacity=3)
+    monkeypatch.setattr(action, "LLM_RATE_LIMITER", bucket)
+
+    attempts: List[str] = []
+
+    def respond(prompt, config):
+        attempts.append(prompt)
+        if len(attempts) < 3:
+            raise rate_limited()
+        return "7"
+
+    fake_llm(respond)
+    response = request_resp("rate this", delay=1.0)
+
+    assert response.text == "7"
+    assert len(attempts) == 3
+    assert bucket.tokens < 1
+    assert 0.5 <= sleeps[0] <= 1.0
+    assert 1.0 <= sleeps[1] <= 2.0
+
+
+def test_429_backoff_stops_at_the_deadline(fake_llm, sleeps):
+    def respond(prompt, config):
+        raise rate_limited()
+
+    client = fake_llm(respond)
+
+    # the first backoff (at least 5 seconds) would pass the deadline
+    assert request_resp("rate this", delay=10.0, deadline=time.monotonic() + 1) is None
+    assert len(client.prompts) == 1
+    assert sleeps == []
+
+
+def test_requests_under_a_deadline_time_out_at_it(fake_llm):
+    timeouts: List[int] = []
+
+    def respond(prompt, config):
+        timeouts.append(config.http_options.timeout)
+        raise httpx.ReadTimeout("timed out")
+
+    fake_llm(respond)
+
+    assert request_resp("rate this", deadline=time.monotonic() + 2) is None
+    assert 0 < timeouts[0] <= 2000
+
+
+def test_partial_ratings_keep_the_rrf_slots_of_the_unrated(llm_cache, fake_llm):
+    ratings = {1: "2", 3: "9", 4: "not a number", 5: "5"}
+
+    def respond(prompt, config):
+        doc_id = movie_id(prompt)
+        if doc_id not in ratings:
+            # a call that runs into the deadline, like the http client
+            time.sleep(config.http_options.timeout / 1000)
+            raise httpx.ReadTimeout("timed out")
+        return ratings[doc_id]
+
+    fake_llm(respond)
+
+    start = time.monotonic()
+    reranked, complete = rerank_individual(
+        "query", rrf_results(5), deadline_seconds=0.5
+    )
+
+    # 2 timed out and 4 is not a number, both stay where rrf put them
+    assert [doc.id for doc in reranked] == [3, 2, 5, 4, 1]
+    assert not complete
+    assert time.monotonic() - start < 1.5
+
+
+def test_no_ratings_is_the_rrf_order(llm_cache, fake_llm):
+    fake_llm(lambda prompt, config: "")
+
+    results = rrf_results(4)
+
+    assert rerank_individual("query", results, deadline_seconds=1) == (
+        results,
+        False,
+    )
+
+
+def test_all_ratings_is_complete(llm_cache, fake_llm):
+    fake_llm(lambda prompt, config: str(movie_id(prompt)))
+
+    reranked, complete = rerank_individual(
+        "query", rrf_results(3), deadline_seconds=1
+    )
+
+    assert [doc.id for doc in reranked] == [3, 2, 1]
+    assert complete
@@ -0,0 +1,54 @@
+from lib.result_cache import ResultCache
+
+
+class Generation:
+    def __init__(self) -> None:
+        self.value = "1"
+
+    def __call__(self) -> str:
+        return self.value
+
+
+def test_repeat_lookups_are_hits():
+    cache = ResultCache(max_entries=4, ttl=60, generation=lambda: "1")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return ["response"]
+
+    assert cache.get_or_compute("key", compute) == ["response"]
+    assert cache.get_or_compute("key", compute) == ["response"]
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_a_build_during_compute_is_not_stored():
+    generation = Generation()
+    cache = ResultCache(max_entries=4, ttl=60, generation=generation)
+
+    def compute():
+        # cli/build.py finishing while the search runs
+        generation.value = "2"
+        return "stale"
+
+    assert cache.get_or_compute("key", compute) == "stale"
+    assert len(cache) == 0
+
+    assert cache.get_or_compute("key", lambda: "fresh") == "fresh"
+    assert cache.get_or_compute("key", lambda: "recomputed") == "fresh"
+
+
+def test_degraded_responses_are_served_but_not_stored():
+    cache = ResultCache(max_entries=4, ttl=60, generation=lambda: "1")
+
+    def complete(response):
+        return response[1]
+
+    degraded = (["rrf order"], False)
+    assert cache.get_or_compute("key", lambda: degraded, complete) == degraded
+    assert len(cache) == 0
+
+    reranked = (["reranked"], True)
+    assert cache.get_or_compute("key", lambda: reranked, complete) == reranked
+    assert cache.get_or_compute("key", lambda: degraded, complete) == reranked
@@ -0,0 +1,59 @@
+import os
+from typing import List
+
+from lib.indexes.doc_store import DocStore, get_doc_store
+from lib.indexes.inverted_index import InvertedIndex
+from lib.indexes.segmented_index import SegmentedIndex
+from typedicts.movies import Movie
+
+WORDS = ["space", "pirate", "robot", "detective", "island", "dragon", "heist"]
+
+
+def movie(doc_id: int, version: int = 0) -> Movie:
+    words = [WORDS[(doc_id * step + version) % len(WORDS)] for step in range(1, 6)]
+    return {
+        "id": doc_id,
+        "title": f"movie {doc_id}",
+        "description": " ".join(words),
+    }
+
+
+def ranked(results) -> List[tuple]:
+    return [(doc_id, round(score, 4)) for doc_id, _, score in results]
+
+
+def test_buffered_ingests_search_like_one_index(tmp_path):
+    index = SegmentedIndex(str(tmp_path), buffer_size=1000)
+    for start in range(0, 60, 3):
+        index.add_movies([movie(doc_id) for doc_id in range(start, start + 3)])
+
+    # a delete and an update of documents in earlier ingests
+    index.delete_movies([4, 31])
+    index.add_movies([movie(7, version=1)])
+
+    live = {doc_id: movie(doc_id) for doc_id in range(60) if doc_id not in (4, 31)}
+    live[7] = movie(7, version=1)
+    single = InvertedIndex()
+    single.build(list(live.values()), processes=1)
+
+    assert len(index.buffer) > 1
+    for query in ["space robot", "dragon heist island", "detective"]:
+        assert ranked(index.bm25_search(query, 10)) == ranked(
+            single.bm25_search(query, 10)
+        )
+
+    # the search merged the buffer once
+    assert len(index.buffer) == 1
+    assert len(index) == index.buffered == len(live)
+
+
+def test_flush_keeps_other_doc_stores_open(tmp_path):
+    path = os.path.join(tmp_path, "cache.docs")
+    DocStore.from_movies([movie(1)]).write(path)
+    store = get_doc_store(path)
+
+    index = SegmentedIndex(str(tmp_path / "segments"), buffer_size=2)
+    index.add_movies([movie(2), movie(3)])
+
+    assert index.stats()["segments"] == 1
+    assert get_doc_store(path) is store
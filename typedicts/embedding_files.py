@@ -0,0 +1,9 @@
+from typing import NamedTuple
+
+
+# cache files belonging to one embedding matrix
+class EmbeddingFiles(NamedTuple):
+    vectors: str
+    ivf: str
+    codes: str
+    quantizer: str
@@ -0,0 +1,6 @@
+from typing import NamedTuple
+
+
+# response served from the llm cache, exposes .text like the api response
+class CachedLLMResponse(NamedTuple):
+    text: str
@@ -4,7 +4,6 @@ from typedicts.movies import Movie
 
 @dataclass
 class HybridScores:
-    movie: Movie
     kw_score: float = 0.0
     sem_score: float = 0.0
 